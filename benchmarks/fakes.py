@@ -0,0 +1,279 @@
+import base64
+import hashlib
+import http.server
+import json
+import socketserver
+import struct
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+from .harness import ThreadingHTTPServer
+
+# a valid 1x1 PNG, the image store doesn't look inside it
+_PNG = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                     '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082')
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    """
+    Stand-in for Slack's Web API and response_urls and Google's Directions,
+    Geocoding and Static Maps APIs.
+
+    Serves from a background thread on a free port as soon as it is made,
+    with its base URL in ``url``. Slack calls wait ``slack_latency`` seconds
+    and Google calls wait ``google_latency`` seconds before answering. Every
+    call is counted in ``calls`` by service, and the arrival time of each
+    response_url post is kept in ``responses``; ``reset`` clears both.
+    rtm.connect hands out the websocket URL of ``rtm``, and users.info
+    answers with its ``users``. ``stop``, or leaving a ``with`` block, shuts
+    the server down.
+    """
+
+    def __init__(self, slack_latency=0.0, google_latency=0.0, rtm=None):
+        super().__init__(('127.0.0.1', 0), _UpstreamHandler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+        self.slack_latency = slack_latency
+        self.google_latency = google_latency
+        self.rtm = rtm
+        self.calls = Counter()
+        self.responses = []
+        self._lock = threading.Lock()
+        # a short poll interval keeps stop quick
+        threading.Thread(target=self.serve_forever, args=(0.05,), name='fake-upstream', daemon=True).start()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            # cleared in place, so a caller holding the list sees new arrivals
+            self.responses[:] = []
+
+    def count(self, service):
+        with self._lock:
+            self.calls[service] += 1
+
+    def respond(self):
+        with self._lock:
+            self.calls['response_url'] += 1
+            self.responses.append(time.perf_counter())
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class _UpstreamHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+        path = urlsplit(self.path).path
+        time.sleep(self.server.slack_latency)
+        rtm = self.server.rtm
+
+        if path == '/api/rtm.connect':
+            self._count('rtm.connect')
+            self._json({'ok': True, 'url': rtm.url, 'self': {'id': rtm.self_id}})
+        elif path == '/api/users.info':
+            self._count('users.info')
+            user = form.get('user', [''])[0]
+            self._json({'ok': True, 'user': {'id': user, 'name': rtm.users.get(user, user)}})
+        elif path == '/api/conversations.list':
+            self._count('conversations.list')
+            self._json({'ok': True, 'channels': [{'id': 'C0GENERAL', 'name': 'general'}]})
+        elif path == '/api/chat.postMessage':
+            self._count('chat.postMessage')
+            self._reply(200, 'application/json', json.dumps({'ok': True, 'ts': str(time.time())}).encode())
+        elif path.startswith('/respond/'):
+            self.server.respond()
+            self._reply(200, 'text/plain', b'ok')
+        else:
+            self._reply(404, 'text/plain', b'')
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        time.sleep(self.server.google_latency)
+
+        if url.path == '/maps/api/directions/json':
+            self._count('directions')
+            self._json({'status': 'OK', 'routes': [{
+                'overview_polyline': {'points': 'a~l~Fjk~uOwHJy@P'},
+                'legs': [_leg()]
+            }]})
+        elif url.path == '/maps/api/geocode/json':
+            self._count('geocode')
+            # a stable made up location per address
+            digest = hashlib.md5(params.get('address', [''])[0].encode()).digest()
+            self._json({'status': 'OK', 'results': [{'geometry': {'location': {
+                'lat': 30 + digest[0] / 16, 'lng': -120 + digest[1] / 8
+            }}}]})
+        elif url.path == '/maps/api/staticmap':
+            self._count('static_map')
+            self._reply(200, 'image/png', _PNG)
+        else:
+            self._reply(404, 'text/plain', b'')
+
+    def _json(self, body):
+        self._reply(200, 'application/json', json.dumps(body).encode())
+
+    def _reply(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count(self, service):
+        self.server.count(service)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeRtm(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Stand-in for Slack's real time messaging websocket.
+
+    Every connection is greeted with hello. Pings get pongs and posted
+    messages get acknowledged, each arrival recorded in ``received`` as
+    ``(time, message)``. ``broadcast`` sends an event to every open
+    connection and ``drop`` cuts them all without a close frame. Set
+    ``acknowledge`` to False to leave posts unacknowledged. ``url`` is what
+    a ``FakeUpstream`` hands out from rtm.connect, and ``users`` maps user
+    ids to the names its users.info answers with. ``stop``, or leaving a
+    ``with`` block, drops every connection and shuts the server down.
+    """
+
+    self_id = 'UBOT'
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _RtmHandler)
+        self.url = 'ws://127.0.0.1:{}/'.format(self.server_address[1])
+        self.users = {}
+        self.received = []
+        self.acknowledge = True
+        self.connections = 0
+        self._clients = set()
+        self._lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, args=(0.05,), name='fake-rtm', daemon=True).start()
+
+    def broadcast(self, event):
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.send_json(event)
+
+    def drop(self):
+        with self._lock:
+            clients, self._clients = list(self._clients), set()
+        for client in clients:
+            client.request.shutdown(2)
+
+    def stop(self):
+        self.shutdown()
+        self.drop()
+        self.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def wait_for_clients(self, count=1, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if len(self._clients) >= count:
+                    return True
+            time.sleep(0.01)
+        return False
+
+
+class _RtmHandler(socketserver.StreamRequestHandler):
+    _GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        headers = {}
+        self.rfile.readline()
+        for line in iter(self.rfile.readline, b'\r\n'):
+            name, _, value = line.decode().partition(':')
+            headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + self._GUID).encode()).digest())
+        self.wfile.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                         b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+
+        self._send_lock = threading.Lock()
+        with self.server._lock:
+            self.server.connections += 1
+            self.server._clients.add(self)
+        self.send_json({'type': 'hello'})
+        try:
+            while True:
+                opcode, payload = self._read_frame()
+                if opcode is None or opcode == 0x8:
+                    return
+                if opcode == 0x1:
+                    self._on_message(json.loads(payload.decode()))
+        except OSError:
+            pass
+        finally:
+            with self.server._lock:
+                self.server._clients.discard(self)
+
+    def _on_message(self, message):
+        if message.get('type') == 'ping':
+            self.send_json({'type': 'pong', 'reply_to': message.get('id')})
+            return
+        with self.server._lock:
+            self.server.received.append((time.perf_counter(), message))
+        if self.server.acknowledge:
+            self.send_json({'ok': True, 'reply_to': message.get('id'), 'ts': str(time.time())})
+
+    def _read_frame(self):
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None, None
+        opcode, length = header[0] & 0x0f, header[1] & 0x7f
+        if length == 126:
+            length, = struct.unpack('!H', self.rfile.read(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', self.rfile.read(8))
+        # client frames are always masked
+        mask = self.rfile.read(4)
+        payload = self.rfile.read(length)
+        return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    def send_json(self, event):
+        payload = json.dumps(event).encode()
+        if len(payload) < 126:
+            header = struct.pack('!BB', 0x81, len(payload))
+        elif len(payload) < 1 << 16:
+            header = struct.pack('!BBH', 0x81, 126, len(payload))
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, len(payload))
+        try:
+            with self._send_lock:
+                self.wfile.write(header + payload)
+        except OSError:
+            pass
+
+
+def _leg():
+    return {
+        'duration_in_traffic': {'text': '27 mins', 'value': 1620},
+        'distance': {'text': '11.2 mi', 'value': 18025}
+    }
+
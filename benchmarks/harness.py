@@ -0,0 +1,158 @@
+import hashlib
+import hmac
+import http.server
+import os
+import shutil
+import socketserver
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import click
+import pkg_resources
+import yaml
+
+SECRET = 'benchmark-signing-secret'
+TOKEN = 'benchmark-token'
+ENV = 'bench'
+
+
+class PooledWSGIServer(WSGIServer):
+    """A WSGI server with a fixed number of request threads, like a gthread worker."""
+
+    threads = 8
+    request_queue_size = 128
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = ThreadPoolExecutor(max_workers=self.threads)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def write_configs(directory, scratch, overrides):
+    """
+    Write a config directory for the ``bench`` env.
+
+    The earliest file wins when configs are merged, so ``overrides`` are
+    applied to a copy of the default config rather than put in ``bench.yaml``.
+    Tokens, the signing secret and every path that gets written to are
+    overridden to benchmark values under ``scratch``.
+    """
+    config_files = pkg_resources.resource_filename('fangorn', 'config_files')
+    with open(os.path.join(config_files, 'default.yaml')) as f_in:
+        default = yaml.safe_load(f_in)
+
+    override(default, {
+        'cors': {'allow_all_origins': True},
+        'logging': {'level': 'WARNING'},
+        'records': {'tinnitus': {'path': os.path.join(scratch, 'tinnitus')}},
+        'slack': {
+            'signing': {'secret': SECRET},
+            'dedup': {'directory': os.path.join(scratch, 'dedup')},
+            'outgoing_webhook': {'token': TOKEN},
+            'traffic_command': {'token': TOKEN},
+            'tinnitus_command': {'token': TOKEN}
+        },
+        'google': {
+            'geocode': {'path': os.path.join(scratch, 'geocode.json')},
+            'directions': {'key': 'AIza' + '0' * 35},
+            'static_map': {'image_directory': os.path.join(scratch, 'maps')}
+        }
+    })
+    override(default, overrides)
+    os.makedirs(default['google']['static_map']['image_directory'], exist_ok=True)
+
+    with open(os.path.join(directory, 'default.yaml'), 'w') as f_out:
+        yaml.safe_dump(default, f_out)
+    with open(os.path.join(directory, '{}.yaml'.format(ENV)), 'w') as f_out:
+        f_out.write('{}\n')
+    shutil.copy(os.path.join(config_files, 'sample_secret.yaml'), os.path.join(directory, 'secret.yaml'))
+
+
+def override(config, overrides):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            override(config[key], value)
+        else:
+            config[key] = value
+
+
+def sign(body):
+    """Headers for a form body signed the way Slack signs slash commands."""
+    timestamp = str(int(time.time()))
+    base = 'v0:{}:{}'.format(timestamp, body).encode()
+    return {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'X-Slack-Request-Timestamp': timestamp,
+        'X-Slack-Signature': 'v0=' + hmac.new(SECRET.encode(), base, hashlib.sha256).hexdigest()
+    }
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else float('nan')
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen('http://127.0.0.1:{}/healthcheck'.format(port), timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise click.ClickException('server on port {} did not start'.format(port))
+
+
+@click.command()
+@click.option('--mode', type=click.Choice(['wsgi', 'asgi']), default='wsgi', show_default=True)
+@click.option('--port', type=int, required=True)
+@click.option('--config-dir', required=True)
+@click.option('--threads', default=8, show_default=True, help='Request threads for the WSGI server.')
+@click.option('--fake-lookup', type=float, help='Replace traffic lookups with a sleep of this many seconds.')
+def serve(mode, port, config_dir, threads, fake_lookup):
+    """Serve the app for a benchmark, in the process the benchmark starts."""
+    if fake_lookup is not None:
+        from fangorn.google_maps_wrapper import TrafficMapper
+
+        def traffic_message(self, origin, destinations):
+            time.sleep(fake_lookup)
+            return {'text': 'traffic from {} to {}'.format(origin, ', '.join(destinations))}
+
+        TrafficMapper.traffic_message = traffic_message
+
+    if mode == 'wsgi':
+        from fangorn.server import get_app
+
+        PooledWSGIServer.threads = threads
+        make_server('127.0.0.1', port, get_app(ENV, config_dir),
+                    server_class=PooledWSGIServer, handler_class=QuietHandler).serve_forever()
+    else:
+        import uvicorn
+        from fangorn.async_server import get_asgi_app
+
+        uvicorn.run(get_asgi_app(ENV, config_dir), host='127.0.0.1', port=port, log_level='warning')
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import threading
+import time
+
+import click
+
+from fangorn import init
+from fangorn.configuration import config
+from fangorn.listener import RtmListener
+
+from . import fakes
+from .harness import ENV, percentile, write_configs
+
+USER_ID, USER_NAME = 'U0SELLER', 'seller'
+TEXTS = ('selling my old ssd', 'lunch anyone?', 'spare hdd, pre-built removed')
+
+
+@click.command()
+@click.option('-n', '--number', default=1000, show_default=True, help='Messages to send.')
+@click.option('--rate', default=200.0, show_default=True, help='Messages per second.')
+@click.option('--drops', default=3, show_default=True, help='Times to cut the connection during the run.')
+@click.option('--slack-latency', default=0.05, show_default=True, help='Seconds the fake web API takes to answer.')
+def main(number, rate, drops, slack_latency):
+    """
+    Measure ``fangorn listen`` against a fake Slack websocket.
+
+    Messages are broadcast at a fixed rate and the connection is cut
+    ``drops`` times along the way. Reported are how long each match took to
+    come back over the websocket, and whether every match still arrived
+    exactly once despite the reconnects.
+    """
+    with fakes.FakeRtm() as rtm, fakes.FakeUpstream(slack_latency=slack_latency, rtm=rtm) as upstream:
+        rtm.users[USER_ID] = USER_NAME
+        _measure(upstream, rtm, number, rate, drops)
+
+
+def _measure(upstream, rtm, number, rate, drops):
+    with tempfile.TemporaryDirectory() as scratch:
+        config_dir = os.path.join(scratch, 'config')
+        os.makedirs(config_dir)
+        write_configs(config_dir, scratch, {
+            'slack': {
+                'listen': {'api_url': upstream.url + '/api', 'backoff': 0.05, 'max_backoff': 0.5, 'ping_interval': 1},
+                'outgoing_webhook': {'matchers': {USER_NAME: {
+                    'text_contains': ['ssd', 'hdd'],
+                    'unmatch': ['pre-built'],
+                    'output_channel': '#general'
+                }}}
+            }
+        })
+        os.environ['XDG_CACHE_HOME'] = os.path.join(scratch, 'cache')
+        init.load_configs(ENV, config_dir)
+
+    listener = RtmListener(config['slack']['bot_user']['token'], config['slack']['outgoing_webhook']['matchers'],
+                           **config['slack']['listen'])
+    thread = threading.Thread(target=listener.run, name='listener')
+    thread.start()
+    if not rtm.wait_for_clients():
+        raise click.ClickException('listener never connected')
+
+    sent = {}
+    drop_at = {number * (i + 1) // (drops + 1) for i in range(drops)}
+    start = time.perf_counter()
+    for i in range(number):
+        if i in drop_at:
+            rtm.drop()
+            rtm.wait_for_clients()
+        text = '{} #{}'.format(TEXTS[i % len(TEXTS)], i)
+        sent[text] = time.perf_counter()
+        rtm.broadcast({'type': 'message', 'channel': 'C0SALES', 'user': USER_ID, 'text': text})
+        time.sleep(max(0, start + (i + 1) / rate - time.perf_counter()))
+
+    expected = sum(1 for text in sent if 'ssd' in text)
+    deadline = time.monotonic() + 10
+    while len(rtm.received) < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    listener.stop()
+    thread.join()
+
+    latencies, seen = [], {}
+    for arrived, message in rtm.received:
+        text = message['text'].rsplit('>', 1)[-1]
+        seen[text] = seen.get(text, 0) + 1
+        latencies.append(arrived - sent[text])
+
+    stats = listener.stats
+    click.echo('sent {}, matches expected {}, posted {}, duplicates {}, missing {}'.format(
+        number, expected, len(seen), sum(c - 1 for c in seen.values()), expected - len(seen)))
+    click.echo('connections {}, reconnects {}, resent {}'.format(
+        rtm.connections, stats['disconnects'], stats['resent']))
+    click.echo('match to post ms: p50 {:.2f}, p95 {:.2f}, p99 {:.2f}'.format(
+        percentile(latencies, .5), percentile(latencies, .95), percentile(latencies, .99)))
+    click.echo('web api calls: {}'.format(', '.join(
+        '{} {}'.format(method, count) for method, count in sorted(upstream.calls.items()))))
+
+
+if __name__ == '__main__':
+    main()
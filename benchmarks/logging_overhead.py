@@ -0,0 +1,74 @@
+import logging
+import queue
+import time
+import timeit
+from logging.handlers import QueueListener
+
+import click
+
+from fangorn.init import DeferredQueueHandler, SamplingFilter
+from fangorn.utils import LazyFormat, format_pairs
+
+
+class SlowStream:
+    """A stream that stalls like a blocked stderr pipe."""
+
+    def __init__(self, delay):
+        self._delay = delay
+
+    def write(self, text):
+        time.sleep(self._delay)
+
+    def flush(self):
+        pass
+
+
+def _eager(logger, headers, params):
+    h = '\n'.join('\t{}: {}'.format(k, v) for k, v in headers.items())
+    p = '\n'.join('\t{}: {}'.format(k, v) for k, v in params.items())
+    logger.info('\nheaders: \n%s\nparams: \n%s', h, p)
+
+
+def _lazy(logger, headers, params):
+    logger.info('\nheaders: \n%s\nparams: \n%s',
+                LazyFormat(format_pairs, headers), LazyFormat(format_pairs, params),
+                extra={'route': '/api/messagerouter'})
+
+
+def _logger(name, level, handler):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(level)
+    logger.addHandler(handler)
+    return logger
+
+
+@click.command()
+@click.option('-n', '--number', default=2000, show_default=True, help='Log calls per measurement.')
+@click.option('--stall', default=0.0001, show_default=True, help='Seconds each stream write blocks for.')
+@click.option('--sample-rate', default=1.0, show_default=True, help='Sampling rate for the message router route.')
+def main(number, stall, sample_rate):
+    """Measure per-request logging cost on the request thread, before and after."""
+    headers = {'HOST': 'example.com', 'USER-AGENT': 'Slackbot 1.0', 'CONTENT-TYPE': 'application/x-www-form-urlencoded',
+               'CONTENT-LENGTH': '312', 'ACCEPT': '*/*', 'X-FORWARDED-FOR': '10.0.0.1'}
+    params = {'token': 'x' * 24, 'team_id': 'T0001', 'channel_name': 'general', 'user_name': 'logan',
+              'text': 'selling a 1tb ssd, barely used ' * 4, 'timestamp': '1355517523.000005'}
+
+    for level_name, level in (('INFO', logging.INFO), ('WARNING', logging.WARNING)):
+        eager = _logger('bench.eager.' + level_name, level, logging.StreamHandler(SlowStream(stall)))
+
+        log_queue = queue.Queue(-1)
+        listener = QueueListener(log_queue, logging.StreamHandler(SlowStream(stall)))
+        listener.start()
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter({'/api/messagerouter': sample_rate}))
+        lazy = _logger('bench.lazy.' + level_name, level, queue_handler)
+
+        for name, fn, logger in (('before', _eager, eager), ('after', _lazy, lazy)):
+            seconds = timeit.timeit(lambda: fn(logger, headers, params), number=number)
+            click.echo('{:<8}{:<7}{:>10.2f} us/request'.format(level_name, name, seconds / number * 1e6))
+        listener.stop()
+
+
+if __name__ == '__main__':
+    main()
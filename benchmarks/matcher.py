@@ -0,0 +1,63 @@
+import random
+import string
+import timeit
+from collections import namedtuple
+
+import click
+
+from fangorn.message_router import Matcher
+
+Text = namedtuple('Text', ('text',))
+
+
+class LoopMatcher:
+    """The original per-term substring scan, kept as the comparison baseline."""
+
+    def __init__(self, spec):
+        self._text_contains = spec['text_contains']
+        self._unmatches = spec['unmatch']
+
+    def __call__(self, data):
+        lowered = data.text.lower()
+        return any(t in lowered for t in self._text_contains) \
+            and all(u not in lowered for u in self._unmatches)
+
+
+def _word(rng, length):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+@click.command()
+@click.option('-t', '--terms', default=300, show_default=True, help='Number of include and exclude terms each.')
+@click.option('-l', '--length', default=400, show_default=True, help='Message length in characters.')
+@click.option('-m', '--messages', default=200, show_default=True, help='Number of distinct messages.')
+@click.option('-r', '--repeat', default=5, show_default=True, help='Timing repetitions, best is reported.')
+@click.option('--seed', default=0, show_default=True, help='Random seed.')
+def main(terms, length, messages, repeat, seed):
+    """Compare the compiled Matcher against the per-term any/all loop."""
+    rng = random.Random(seed)
+    spec = {
+        'text_contains': [_word(rng, rng.randint(4, 12)) for _ in range(terms)],
+        'unmatch': [_word(rng, rng.randint(4, 12)) for _ in range(terms)],
+        'output_channel': '#general'
+    }
+    words = spec['text_contains'] + spec['unmatch'] + [_word(rng, 6) for _ in range(terms * 10)]
+    texts = []
+    for _ in range(messages):
+        text = ''
+        while len(text) < length:
+            text += rng.choice(words) + ' '
+        texts.append(Text(text.upper()))
+
+    compiled, loop = Matcher(spec), LoopMatcher(spec)
+    mismatched = sum(bool(compiled(t)) != loop(t) for t in texts)
+    if mismatched:
+        raise click.ClickException('{} messages disagree between matchers'.format(mismatched))
+
+    for name, matcher in (('any/all loop', loop), ('compiled', compiled)):
+        best = min(timeit.repeat(lambda: [matcher(t) for t in texts], number=1, repeat=repeat))
+        click.echo('{:<14}{:>10.1f} us/message'.format(name, best / messages * 1e6))
+
+
+if __name__ == '__main__':
+    main()
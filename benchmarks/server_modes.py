@@ -0,0 +1,116 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import click
+
+from . import fakes
+from .harness import TOKEN, percentile, sign, wait_until_up, write_configs
+
+
+async def _load(url, response_url, number, concurrency):
+    import aiohttp
+
+    latencies, busy, errors = [], 0, 0
+    requests = iter(range(number))
+    # a fresh connection per request, since the WSGI server can't keep them alive
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True, limit=0)) as session:
+        async def client():
+            nonlocal busy, errors
+            for i in requests:
+                body = urlencode({
+                    'token': TOKEN,
+                    'command': '/traffic',
+                    'text': 'from: home to: work',
+                    'response_url': '{}/{}'.format(response_url, i),
+                    'trigger_id': str(i)
+                })
+                start = time.perf_counter()
+                try:
+                    async with session.post(url, data=body, headers=sign(body)) as response:
+                        text = await response.text()
+                except aiohttp.ClientError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if response.status != 200:
+                    errors += 1
+                elif 'Too many' in text:
+                    busy += 1
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, busy, errors
+
+
+@click.command()
+@click.option('-n', '--number', default=2000, show_default=True, help='Slash commands per mode.')
+@click.option('-c', '--concurrency', default=64, show_default=True, help='Concurrent clients.')
+@click.option('--threads', default=8, show_default=True, help='Request threads for the WSGI server.')
+@click.option('--job-workers', default=16, show_default=True, help='Threads running deferred traffic lookups.')
+@click.option('--google-latency', default=0.1, show_default=True, help='Seconds each traffic lookup takes.')
+@click.option('--slack-latency', default=0.2, show_default=True, help='Seconds Slack takes to accept a response.')
+@click.option('--mode', 'modes', multiple=True, type=click.Choice(['wsgi', 'asgi']), default=('wsgi', 'asgi'),
+              help='Server modes to compare.')
+def main(number, concurrency, threads, job_workers, google_latency, slack_latency, modes):
+    """
+    Load test the WSGI and ASGI servers with signed /traffic commands.
+
+    Each server runs in its own process against a fake traffic lookup and a
+    fake Slack response_url, both with fixed latency. Reported are the
+    acknowledgement latency the client sees, how many commands were turned
+    away as busy, and how long it took for every deferred answer to arrive.
+    """
+    with fakes.FakeUpstream(slack_latency=slack_latency) as upstream:
+        _compare(upstream, number, concurrency, threads, job_workers, google_latency, modes)
+
+
+def _compare(upstream, number, concurrency, threads, job_workers, google_latency, modes):
+    response_url = upstream.url + '/respond'
+
+    click.echo('{:<6}{:>10}{:>10}{:>10}{:>10}{:>8}{:>8}{:>14}'.format(
+        'mode', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'busy', 'errors', 'answered in s'))
+    with tempfile.TemporaryDirectory() as scratch:
+        config_dir = os.path.join(scratch, 'config')
+        os.makedirs(config_dir)
+        write_configs(config_dir, scratch, {
+            'http': {'pool_maxsize': job_workers},
+            # queue every command, so the modes differ in how fast they answer rather than what they refuse
+            'slack': {'traffic_command': {'deferred': {'workers': job_workers, 'backlog': 100000}}}
+        })
+
+        for index, mode in enumerate(modes):
+            port = 18400 + index
+            server = subprocess.Popen([
+                sys.executable, '-m', 'benchmarks.harness', '--mode', mode, '--port', str(port),
+                '--config-dir', config_dir, '--threads', str(threads), '--fake-lookup', str(google_latency)
+            ], env=dict(os.environ, XDG_CACHE_HOME=os.path.join(scratch, 'cache')))
+            try:
+                wait_until_up(port)
+                upstream.reset()
+
+                start = time.perf_counter()
+                latencies, busy, errors = asyncio.get_event_loop().run_until_complete(
+                    _load('http://127.0.0.1:{}/api/traffic'.format(port), response_url, number, concurrency))
+                elapsed = time.perf_counter() - start
+
+                # wait for the deferred answers to stop arriving
+                received = upstream.responses
+                while len(received) < number - busy - errors and \
+                        time.perf_counter() - (received or [start])[-1] < 5:
+                    time.sleep(0.1)
+                answered = (received or [start])[-1] - start
+
+                click.echo('{:<6}{:>10.0f}{:>10.1f}{:>10.1f}{:>10.1f}{:>8}{:>8}{:>14.2f}'.format(
+                    mode, len(latencies) / elapsed, percentile(latencies, .5), percentile(latencies, .95),
+                    percentile(latencies, .99), busy, errors, answered))
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import click
+
+# (name, arguments) for each subcommand. Every one runs against an empty
+# config directory, so it imports what it needs and then exits on the
+# missing configs before it reaches the network.
+_COMMANDS = (
+    ('help', ['--help']),
+    ('create-configs', ['create-configs', '--config-dir', '{tmp}']),
+    ('dev-server', ['dev-server']),
+    ('listen', ['listen']),
+    ('ping-site', ['ping-site', 'https://example.com']),
+    ('scheduler', ['scheduler']),
+    ('tinnitus-records', ['tinnitus-records']),
+    ('traffic', ['traffic', 'home', 'work'])
+)
+
+# every subcommand imports click before anything of ours, so timing it in the same run gives a
+# baseline that is as slow or fast as the machine and the moment
+_BASELINE = 'click'
+
+# cumulative import time allowed per subcommand, as a multiple of the baseline. measured
+# ratios run from about 1.3 (help) to 9 (dev-server); each budget leaves about twice that
+_BUDGETS = {
+    'help': 3,
+    'create-configs': 7,
+    'dev-server': 18,
+    'listen': 10,
+    'ping-site': 10,
+    'scheduler': 10,
+    'tinnitus-records': 5,
+    'traffic': 10
+}
+
+
+def import_times(args, env, start='fangorn'):
+    """
+    Run ``python -X importtime *args``.
+
+    Returns ``{module: cumulative microseconds}`` for the modules imported at
+    the top level from the point ``start`` starts loading, which leaves out
+    the interpreter's own startup imports.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            env=env, universal_newlines=True)
+
+    times, started = {}, False
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith('  '):
+            # nested imports are already counted in their parent's cumulative time
+            continue
+        name = name.strip()
+        started = started or name.split('.')[0] == start
+        if started:
+            times[name] = int(cumulative)
+    return times
+
+
+@click.command()
+@click.option('-r', '--repeat', default=5, show_default=True, help='Runs per subcommand, the median is reported.')
+@click.option('-t', '--top', default=5, show_default=True, help='Slowest imports to list per subcommand.')
+@click.option('-b', '--budget', 'budgets', multiple=True, metavar='COMMAND=TIMES',
+              help='Override the import budget for a subcommand, as a multiple of the baseline.')
+@click.option('--scale', default=1.0, show_default=True, help='Multiply every budget.')
+def main(repeat, top, budgets, scale):
+    """
+    Measure each subcommand's import time and fail when one exceeds its budget.
+
+    Budgets are multiples of the time it takes to import click, measured in
+    the same run, so the gate holds on slower and busier machines too.
+    """
+    limits = dict(_BUDGETS)
+    for budget in budgets:
+        name, _, times = budget.partition('=')
+        if name not in limits:
+            raise click.BadParameter('unknown subcommand {}'.format(name), param_hint='--budget')
+        limits[name] = float(times)
+
+    over = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, XDG_CONFIG_HOME=os.path.join(tmp, 'config'), XDG_CACHE_HOME=os.path.join(tmp, 'cache'))
+        baseline = statistics.median(
+            sum(import_times(['-c', 'import ' + _BASELINE], env, start=_BASELINE).values()) for _ in range(repeat)
+        ) / 1000
+        click.echo('{:<18}{:>9.1f} ms'.format('baseline', baseline))
+
+        for name, args in _COMMANDS:
+            runs = [import_times(['-m', 'fangorn'] + [a.format(tmp=tmp) for a in args], env) for _ in range(repeat)]
+            total = statistics.median(sum(run.values()) for run in runs) / 1000
+            limit = limits[name] * baseline * scale
+
+            click.echo('{:<18}{:>9.1f} ms  budget {:>6.0f} ms  {}'.format(
+                name, total, limit, 'ok' if total <= limit else 'OVER'))
+            slowest = sorted(runs[-1].items(), key=lambda item: item[1], reverse=True)[:top]
+            for module, us in slowest:
+                click.echo('    {:<32}{:>9.1f} ms'.format(module, us / 1000))
+
+            if total > limit:
+                over.append(name)
+
+    if over:
+        raise click.ClickException('over the import budget: {}'.format(', '.join(over)))
+
+
+if __name__ == '__main__':
+    main()
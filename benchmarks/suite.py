@@ -0,0 +1,279 @@
+import itertools
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from collections import defaultdict, namedtuple
+from urllib.parse import urlencode
+
+import click
+import pkg_resources
+import requests
+import yaml
+
+from fangorn import records, traffic
+from fangorn.geocode import LocationIndex
+from fangorn.message_router import Matcher
+from fangorn.utils import merge_many_dicts
+
+from . import fakes
+from .harness import TOKEN, percentile, sign, wait_until_up, write_configs
+
+BENCH_USER = 'loadtest'
+ALIASES = {'home': '401 North Racine Avenue, Chicago, IL 60642', 'work': '1370 Piccard Drive, Rockville, MD 20850'}
+WEBHOOK_TEXTS = (
+    'anyone selling an ssd or a spare hdd?',
+    'ultrawide monitor, barely used, pre-built desk included',
+    'lunch at noon?',
+    'raw denim from nordstrom on sale',
+    'the passphrase is swordfish, no unmatch here'
+)
+TRAFFIC_TEXTS = ('from: home to: work', 'to: Work from: HOME', 'from: work to: home; 1 Main St',
+                 'from: 233 S Wacker Dr, Chicago to: hoem')
+TINNITUS_TEXTS = ('l140', 'r2200', 'L095', 'r1180')
+DEFAULT_MIX = 'webhook=50,traffic=20,tinnitus=15,tinnitus-read=10,healthcheck=5'
+
+Text = namedtuple('Text', ('text',))
+
+
+def _webhook(base, i, rng):
+    body = urlencode({
+        'token': TOKEN,
+        'team_id': 'T0BENCH',
+        'channel_id': 'C0BENCH',
+        'user_id': 'U0BENCH',
+        'user_name': BENCH_USER,
+        'timestamp': '1500000000.{:06d}'.format(i),
+        'text': rng.choice(WEBHOOK_TEXTS)
+    })
+    return 'POST', base + '/api/messagerouter', body, {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def _traffic(base, i, rng, response_url):
+    body = urlencode({
+        'token': TOKEN,
+        'command': '/traffic',
+        'text': rng.choice(TRAFFIC_TEXTS),
+        'response_url': '{}/{}'.format(response_url, i),
+        # signatures over identical bodies would be rejected as replays
+        'trigger_id': 'bench.{}'.format(i)
+    })
+    return 'POST', base + '/api/traffic', body, sign(body)
+
+
+def _tinnitus(base, i, rng, response_url):
+    body = urlencode({
+        'token': TOKEN,
+        'command': '/tinnitus',
+        'text': rng.choice(TINNITUS_TEXTS),
+        'response_url': '{}/{}'.format(response_url, i),
+        'trigger_id': 'bench.{}'.format(i)
+    })
+    return 'POST', base + '/api/records/tinnitus', body, sign(body)
+
+
+def _tinnitus_read(base, i, rng):
+    return 'GET', base + '/api/records/tinnitus', None, {'Authorization': 'Bearer ' + TOKEN}
+
+
+def _healthcheck(base, i, rng):
+    return 'GET', base + '/healthcheck', None, {}
+
+
+class _MixParam(click.ParamType):
+    name = 'mix'
+
+    def convert(self, value, param, ctx):
+        try:
+            mix = {route: int(weight) for route, weight in (p.split('=') for p in value.split(','))}
+        except ValueError:
+            self.fail('expected ROUTE=WEIGHT[,ROUTE=WEIGHT...], got {!r}'.format(value), param, ctx)
+        unknown = set(mix) - set(ROUTES)
+        if unknown:
+            self.fail('unknown routes {}, choose from {}'.format(
+                ', '.join(sorted(unknown)), ', '.join(sorted(ROUTES))), param, ctx)
+        return mix
+
+
+ROUTES = {
+    'webhook': _webhook,
+    'traffic': _traffic,
+    'tinnitus': _tinnitus,
+    'tinnitus-read': _tinnitus_read,
+    'healthcheck': _healthcheck
+}
+
+
+@click.group()
+def main():
+    """End to end load tests and microbenchmarks."""
+
+
+@main.command()
+@click.option('-n', '--number', default=2000, show_default=True, help='Total requests.')
+@click.option('-c', '--concurrency', default=16, show_default=True, help='Concurrent clients.')
+@click.option('--mix', type=_MixParam(), default=DEFAULT_MIX, show_default=True,
+              help='Relative weight of each route.')
+@click.option('--mode', type=click.Choice(['wsgi', 'asgi']), default='wsgi', show_default=True)
+@click.option('--threads', default=8, show_default=True, help='Request threads for the WSGI server.')
+@click.option('--slack-latency', default=0.05, show_default=True,
+              help='Seconds the fake Slack takes to answer.')
+@click.option('--google-latency', default=0.1, show_default=True,
+              help='Seconds the fake Google APIs take to answer.')
+@click.option('--port', default=18480, show_default=True)
+@click.option('--repeats', default=0.0, type=click.FloatRange(0, 1), show_default=True,
+              help='Fraction of Slack deliveries sent twice, the way Slack retries them.')
+@click.option('--digest', type=float, help='Coalesce the bench matcher\'s alerts over this many seconds.')
+@click.option('--seed', default=0, show_default=True, help='Random seed for the request mix.')
+def load(number, concurrency, mix, mode, threads, slack_latency, google_latency, port, repeats, digest, seed):
+    """
+    Drive a realistic request mix through the whole app.
+
+    The server runs in its own process with chat.postMessage, response_urls
+    and the Google Directions, Geocoding and Static Maps APIs all
+    pointed at local stand-ins that answer after a fixed latency. Webhooks
+    go to a bench matcher that fires on some messages, and slash commands
+    are signed. Reported per route are throughput and client side latency
+    percentiles, followed by how often each stand-in was called. With
+    --repeats, some deliveries are sent a second time and reported as their
+    own route.
+    """
+    with fakes.FakeUpstream(slack_latency=slack_latency, google_latency=google_latency) as upstream:
+        _load(upstream, number, concurrency, mix, mode, threads, port, repeats, digest, seed)
+
+
+def _load(upstream, number, concurrency, mix, mode, threads, port, repeats, digest, seed):
+    response_url = upstream.url + '/respond'
+
+    with tempfile.TemporaryDirectory() as scratch:
+        config_dir = os.path.join(scratch, 'config')
+        os.makedirs(config_dir)
+        write_configs(config_dir, scratch, {
+            'http': {'max_retries': 0, 'pool_maxsize': 16},
+            'slack': {
+                'delivery': {'url': upstream.url + '/api/chat.postMessage'},
+                'outgoing_webhook': {'matchers': {BENCH_USER: {
+                    'text_contains': ['ssd', 'hdd', 'ultrawide', 'raw denim', 'passphrase'],
+                    'unmatch': ['pre-built', 'unmatch'],
+                    'output_channel': '#general',
+                    'digest': {'max_delay': digest, 'max_batch': 20} if digest else None
+                }}}
+            },
+            'google': {
+                'directions': {'url_base': upstream.url},
+                'static_map': {'url_base': upstream.url + '/maps/api/staticmap'}
+            }
+        })
+
+        server = subprocess.Popen([
+            sys.executable, '-m', 'benchmarks.harness', '--mode', mode, '--port', str(port),
+            '--config-dir', config_dir, '--threads', str(threads)
+        ], env=dict(os.environ, XDG_CACHE_HOME=os.path.join(scratch, 'cache')))
+        try:
+            wait_until_up(port)
+            upstream.reset()
+            results, elapsed = _drive('http://127.0.0.1:{}'.format(port), response_url,
+                                      number, concurrency, mix, repeats, seed)
+            # let deferred answers and queued deliveries drain before counting upstream calls
+            time.sleep(max(1.0, 4 * (upstream.slack_latency + upstream.google_latency)))
+        finally:
+            server.terminate()
+            server.wait()
+
+    click.echo('{:<15}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+        'route', 'count', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for route in sorted(results):
+        latencies, errors = results[route]
+        click.echo('{:<15}{:>8}{:>8}{:>10.0f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+            route, len(latencies), errors, len(latencies) / elapsed,
+            percentile(latencies, .5), percentile(latencies, .95), percentile(latencies, .99)))
+    everything = [latency for latencies, _ in results.values() for latency in latencies]
+    click.echo('{:<15}{:>8}{:>8}{:>10.0f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+        'all', len(everything), sum(errors for _, errors in results.values()), len(everything) / elapsed,
+        percentile(everything, .5), percentile(everything, .95), percentile(everything, .99)))
+
+    click.echo('\nupstream calls: {}'.format(
+        ', '.join('{} {}'.format(service, count) for service, count in sorted(upstream.calls.items()))
+        or 'none'))
+
+
+def _drive(base, response_url, number, concurrency, mix, repeats, seed):
+    rng = random.Random(seed)
+    routes = sorted(mix)
+    plan = rng.choices(routes, weights=[mix[r] for r in routes], k=number)
+    work = iter(enumerate(plan))
+    lock = threading.Lock()
+    results = defaultdict(lambda: ([], 0))
+
+    def client(client_seed):
+        client_rng = random.Random(client_seed)
+        session = requests.Session()
+        while True:
+            with lock:
+                item = next(work, None)
+            if item is None:
+                return
+            i, route = item
+            build = ROUTES[route]
+            args = (response_url,) if route in ('traffic', 'tinnitus') else ()
+            method, url, body, headers = build(base, i, client_rng, *args)
+
+            sends = 2 if method == 'POST' and client_rng.random() < repeats else 1
+            for label in (route, route + ' repeat')[:sends]:
+                start = time.perf_counter()
+                try:
+                    ok = session.request(method, url, data=body, headers=headers, timeout=30).status_code == 200
+                except requests.RequestException:
+                    ok = False
+                latency = time.perf_counter() - start
+
+                with lock:
+                    latencies, errors = results[label]
+                    if ok:
+                        latencies.append(latency)
+                    results[label] = (latencies, errors + (not ok))
+
+    clients = [threading.Thread(target=client, args=(seed + n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return dict(results), time.perf_counter() - start
+
+
+@main.command()
+@click.option('-n', '--number', default=2000, show_default=True, help='Calls per measurement.')
+@click.option('-r', '--repeat', default=5, show_default=True, help='Timing repetitions, best is reported.')
+def micro(number, repeat):
+    """Time the per-request hot paths in isolation: matching, parsing and config merging."""
+    config_files = pkg_resources.resource_filename('fangorn', 'config_files')
+    configs = []
+    for name in ('local.yaml', 'sample_secret.yaml', 'default.yaml'):
+        with open(os.path.join(config_files, name)) as f_in:
+            configs.append(yaml.safe_load(f_in) or {})
+
+    matchers = [Matcher(spec) for spec in configs[-1]['slack']['outgoing_webhook']['matchers'].values()]
+    texts = itertools.cycle([Text(t) for t in WEBHOOK_TEXTS])
+    traffic_texts = itertools.cycle(TRAFFIC_TEXTS)
+    locations = LocationIndex(ALIASES)
+    tinnitus_texts = itertools.cycle(TINNITUS_TEXTS)
+
+    cases = (
+        ('Matcher', lambda: [m(next(texts)) for m in matchers]),
+        ('traffic._parse_text', lambda: traffic._parse_text(next(traffic_texts), locations)),
+        ('records._parse_text', lambda: records._parse_text(next(tinnitus_texts))),
+        # merging writes into the first config's nested dicts, but every call still walks every key
+        ('merge_many_dicts', lambda: merge_many_dicts(*configs))
+    )
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=number, repeat=repeat))
+        click.echo('{:<22}{:>10.2f} us/op'.format(name, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
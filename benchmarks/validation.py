@@ -0,0 +1,79 @@
+import itertools
+import timeit
+
+import click
+
+from fangorn import records, traffic
+from fangorn.message_router import WebhookDataSchema, WebhookDataValidator
+
+TOKEN = 'xoxb-token'
+ALIASES = {'home': '401 North Racine Avenue, Chicago, IL 60642', 'work': '1370 Piccard Drive, Rockville, MD 20850'}
+RESPONSE_URLS = ('https://hooks.slack.com/commands/T0001/1234/abcd', 'http://localhost:8080/x', 'not a url', '',
+                 'ftp://a.b/')
+
+
+def _combinations(fields):
+    """Every mix of present, absent and each candidate value for the fields."""
+    names = list(fields)
+    for values in itertools.product(*(fields[n] + (None,) for n in names)):
+        yield {n: v for n, v in zip(names, values) if v is not None}
+
+
+CASES = {
+    'webhook': (
+        WebhookDataSchema(TOKEN, {'logan', 'deals'}),
+        WebhookDataValidator(TOKEN, {'logan', 'deals'}),
+        list(_combinations({
+            'token': (TOKEN, 'wrong', ''),
+            'text': ('selling an ssd', ''),
+            'user_name': ('logan', 'stranger'),
+            'bot_name': ('deals', 'other')
+        }))
+    ),
+    'traffic': (
+        traffic.SlashCommandDataSchema(TOKEN, ALIASES),
+        traffic.SlashCommandDataValidator(TOKEN, ALIASES),
+        list(_combinations({
+            'command': ('/traffic',),
+            'token': (TOKEN, 'wrong'),
+            'text': ('from: home to: work', 'to: work from: 1 Main St', 'from: home', 'from: to: work', ''),
+            'response_url': RESPONSE_URLS
+        }))
+    ),
+    'tinnitus': (
+        records.SlashCommandDataSchema(TOKEN),
+        records.SlashCommandDataValidator(TOKEN),
+        list(_combinations({
+            'command': ('/tinnitus',),
+            'token': (TOKEN, 'wrong'),
+            'text': ('l140', 'R2200', 'x9abc', 'l1', ' r050 ', 'l1201'),
+            'response_url': RESPONSE_URLS
+        }))
+    )
+}
+
+
+def _check_parity(name, schema, validator, cases):
+    for params in cases:
+        expected = schema.load(dict(params))
+        actual = validator.load(dict(params))
+        if tuple(expected) != actual:
+            raise click.ClickException('{} differs for {}: schema {} fast {}'.format(name, params, expected, actual))
+
+
+@click.command()
+@click.option('-n', '--number', default=20, show_default=True, help='Passes over each case set per measurement.')
+def main(number):
+    """Check the fast validators agree with the marshmallow schemas, then time both."""
+    for name, (schema, validator, cases) in sorted(CASES.items()):
+        _check_parity(name, schema, validator, cases)
+        valid = [c for c in cases if not validator.load(dict(c))[1]]
+        for label, loader in (('marshmallow', schema), ('fast', validator)):
+            for subset, subset_cases in (('all', cases), ('valid', valid)):
+                seconds = timeit.timeit(lambda: [loader.load(dict(c)) for c in subset_cases], number=number)
+                click.echo('{:<9}{:<12}{:<6}{:>12.0f} loads/s'.format(
+                    name, label, subset, number * len(subset_cases) / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,15 @@
 import datetime
 import os
-import pathlib
-import pkg_resources
-import shutil
-import time
 
 import click
-import requests
-import slackclient
 
-from . import init
 from .configuration import config
-from .google_maps_wrapper import TrafficMapper
-from .server import get_app
 from .utils import path_type, FloatRange
 
+# Subcommands import what they use themselves, so `--help`, create-configs
+# and the cron driven traffic posts don't load the whole web stack.
+# `python -m benchmarks.startup` keeps track of what each one costs.
+
 
 @click.group()
 def main():
@@ -30,14 +25,28 @@ def main():
 @click.option('-p', '--port', default=8080, show_default=True, help='Port for the server.')
 @click.option('-d', '--debugger', is_flag=True, help='Start server with debugger.')
 @click.option('-r', '--reloader', is_flag=True, help='Start server with hot reloader.')
-def dev_server(hostname, port, reloader, debugger, env):
+@click.option('--asgi', is_flag=True, help='Serve the ASGI app from an event loop instead.')
+def dev_server(hostname, port, reloader, debugger, env, config_dir, asgi):
     """
     Run the development server.
 
     Run the development server with the provided options. Requires the
-    development dependencies to be installed to work.
+    development dependencies to be installed to work, or the ASGI ones with
+    --asgi, which ignores --debugger and --reloader.
     """
-    app = get_app(env)
+    if asgi:
+        try:
+            import uvicorn
+            from .async_server import get_asgi_app
+        except ImportError:
+            click.secho('ASGI dependencies not installed!', fg='red', err=True)
+            raise click.Abort()
+        uvicorn.run(get_asgi_app(env, config_dir), host=hostname, port=port)
+        return
+
+    from .server import get_app
+
+    app = get_app(env, config_dir)
     try:
         from werkzeug.serving import run_simple
     except ImportError:
@@ -51,6 +60,10 @@ def dev_server(hostname, port, reloader, debugger, env):
 @click.option('--config-dir', type=path_type, help='Explicit configuration directory to use.')
 def create_configs(config_dir):
     """Copy the template config files into a usable location."""
+    import pathlib
+    import pkg_resources
+    import shutil
+
     config_dir = config_dir or \
         os.path.join(
             os.getenv('XDG_CONFIG_HOME', os.path.join(os.getenv('HOME'), '.config')),
@@ -68,34 +81,169 @@ def create_configs(config_dir):
 @click.option('--local', 'env', flag_value='local', default=True, show_default=True, help='Run with dev configs.')
 @click.option('--prod', 'env', flag_value='prod', help='Run with prod configs.')
 @click.option('--config-dir', type=path_type, help='Explicit configuration directory to use.')
-@click.option('--slack-channel', default='#general', help='Channel to post message in.')
-@click.option('-d', '--duration', default=1, type=click.IntRange(1, 60), help='Time in minutes to ping site for.')
-@click.option('-s', '--sleep-time', default=15, type=click.IntRange(1, 600), help='Time in seconds between pings.')
-@click.argument('url')
-def ping_site(env, config_dir, slack_channel, duration, sleep_time, url):
-    """."""
+@click.option('--slack-channel', help='Channel to post alerts in, overriding the configured one.')
+@click.option('-d', '--duration', type=click.IntRange(min=1), help='Time in minutes to monitor for. [default: forever]')
+@click.option('-s', '--sleep-time', default=15, type=click.IntRange(1, 600), show_default=True,
+              help='Time in seconds between pings of URLs given on the command line.')
+@click.option('-t', '--timeout', default=5, type=FloatRange(min=0), show_default=True,
+              help='Request timeout in seconds for URLs given on the command line.')
+@click.argument('urls', nargs=-1)
+def ping_site(env, config_dir, slack_channel, duration, sleep_time, timeout, urls):
+    """
+    Monitor sites and alert slack when they go down or recover.
+
+    Monitor the targets listed under monitor.targets in the config, or only
+    the given URLS. Every target is probed concurrently on its own interval,
+    and a single alert is posted when it goes down and when it recovers.
+    """
+    import slackclient
+
+    from . import init
+    from .monitor import UptimeMonitor, target_from_config
+
     init.load_configs(env, config_dir)
     init.set_up_logging()
+
+    monitor_config = config['monitor']
+    if urls:
+        defaults = dict(monitor_config['defaults'], interval=sleep_time, timeout=timeout)
+        targets = [target_from_config({'url': url}, **defaults) for url in urls]
+    else:
+        targets = [target_from_config(spec, **monitor_config['defaults']) for spec in monitor_config['targets']]
+    if not targets:
+        click.secho('No URLs given and no monitor targets configured.', fg='red', err=True)
+        raise click.Abort()
+
     slack = slackclient.SlackClient(config['slack']['bot_user']['token'])
+    slack_channel = slack_channel or monitor_config['channel']
 
-    session = requests.Session()
+    def notify(target, up, probe):
+        slack.api_call(
+            'chat.postMessage',
+            channel=slack_channel,
+            as_user=True,
+            text='{} has recovered.'.format(target.url) if up else
+                 '<!channel> {} is returning a bad response.'.format(target.url),
+            attachments=[{
+                'text': probe.detail,
+                'color': 'good' if up else 'danger'
+            }])
 
-    start = time.time()
-    while time.time() - start < duration * 60:
-        response = session.get(url)
-        try:
-            response.raise_for_status()
-        except requests.HTTPError as e:
-            slack.api_call(
-                'chat.postMessage',
-                channel=slack_channel,
-                as_user=True,
-                text='<!channel> {} is returning a bad response.'.format(url),
-                attachments=[{
-                    'text': 'Status Code: {}'.format(response.status_code),
-                    'color': 'danger'
-                }])
-        time.sleep(sleep_time)
+    UptimeMonitor(targets, notify).run(duration * 60 if duration else None)
+
+
+@main.command()
+@click.option('--local', 'env', flag_value='local', default=True, show_default=True, help='Run with dev configs.')
+@click.option('--prod', 'env', flag_value='prod', help='Run with prod configs.')
+@click.option('--config-dir', type=path_type, help='Explicit configuration directory to use.')
+def scheduler(env, config_dir):
+    """
+    Run the recurring traffic posts listed in the config.
+
+    Run every job under scheduler.jobs from one long running process, sharing
+    a single maps client and slack client between them. Stops cleanly on
+    SIGINT or SIGTERM once in-progress posts finish.
+    """
+    import signal
+
+    import slackclient
+
+    from . import init
+    from .geocode import location_index
+    from .google_maps_wrapper import TrafficMapper
+    from .scheduler import TrafficScheduler, job_from_config
+
+    init.load_configs(env, config_dir)
+    init.set_up_logging()
+
+    scheduler_config = config['scheduler']
+    location_aliases = location_index()
+    jobs = [job_from_config(spec, location_aliases) for spec in scheduler_config['jobs']]
+    if not jobs:
+        click.secho('No scheduler jobs configured.', fg='red', err=True)
+        raise click.Abort()
+
+    traffic_scheduler = TrafficScheduler(
+        jobs,
+        TrafficMapper(),
+        slackclient.SlackClient(config['slack']['bot_user']['token']),
+        max_concurrency=scheduler_config['max_concurrency'],
+        catch_up=scheduler_config['catch_up'],
+        state_path=scheduler_config.get('state_path'))
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: traffic_scheduler.stop())
+    traffic_scheduler.run()
+
+
+@main.command()
+@click.option('--local', 'env', flag_value='local', default=True, show_default=True, help='Run with dev configs.')
+@click.option('--prod', 'env', flag_value='prod', help='Run with prod configs.')
+@click.option('--config-dir', type=path_type, help='Explicit configuration directory to use.')
+def listen(env, config_dir):
+    """
+    Route messages from a Slack websocket instead of outgoing webhooks.
+
+    Keep one real time messaging connection open, match every message with
+    the outgoing_webhook matchers and post matches back over it. Reconnects
+    with backoff when the connection drops, and stops cleanly on SIGINT or
+    SIGTERM.
+    """
+    import logging
+    import signal
+
+    from . import init
+    from .listener import RtmListener
+
+    init.load_configs(env, config_dir)
+    init.set_up_logging()
+
+    listener = RtmListener(
+        config['slack']['bot_user']['token'],
+        config['slack']['outgoing_webhook']['matchers'],
+        **config['slack']['listen'])
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: listener.stop())
+    listener.run()
+    logging.info('listener stopped: %s', listener.stats)
+
+
+@main.command('tinnitus-records')
+@click.option('--local', 'env', flag_value='local', default=True, show_default=True, help='Run with dev configs.')
+@click.option('--prod', 'env', flag_value='prod', help='Run with prod configs.')
+@click.option('--config-dir', type=path_type, help='Explicit configuration directory to use.')
+@click.option('--ear', type=click.Choice(['l', 'r']), help='Only records for this ear.')
+@click.option('--since', help='Only records at or after this UTC time (e.g. 2017-11-01T08:00).')
+@click.option('--until', help='Only records at or before this UTC time (e.g. 2017-11-30).')
+@click.option('--min-decibels', type=click.IntRange(0, 200), help='Only records at or above this level.')
+@click.option('--max-decibels', type=click.IntRange(0, 200), help='Only records at or below this level.')
+@click.option('--daily', is_flag=True, help='Print daily averages instead of records.')
+def tinnitus_records(env, config_dir, ear, since, until, min_decibels, max_decibels, daily):
+    """Print tinnitus records matching the filters as JSON lines."""
+    import json
+
+    from . import init
+    from .record_index import daily_averages, record_time
+    from .record_store import query_records
+
+    init.load_configs(env, config_dir)
+
+    try:
+        since, until = (record_time(t) if t else None for t in (since, until))
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+    records = query_records(
+        config['records']['tinnitus']['path'],
+        ear=ear,
+        start=since,
+        end=until,
+        min_decibels=min_decibels,
+        max_decibels=max_decibels)
+
+    for row in daily_averages(records) if daily else records:
+        click.echo(json.dumps(row))
 
 
 @main.command()
@@ -117,7 +265,8 @@ def traffic(env, days, config_dir, slack_channel, interval, number_of_posts, ori
     Post traffic maps for the provided ORIGIN and DESTINATION to slack. Post a
     given number of iterations while waiting some amount of time between posts.
     Aliases may be used for ORIGIN or DESTINATION, or fully addresses.
-    (e.g. "work" or "home")
+    (e.g. "work" or "home") DESTINATION may list several destinations
+    separated by semicolons, or by commas when they are all aliases.
     """
     if interval < 0:
         click.secho('', fg='red', err=True)
@@ -127,24 +276,27 @@ def traffic(env, days, config_dir, slack_channel, interval, number_of_posts, ori
         click.echo('Today is not a selected run day. Exiting')
         return
 
+    import time
+
+    import slackclient
+
+    from . import init
+    from .geocode import location_index
+    from .google_maps_wrapper import TrafficMapper
+    from .scheduler import post_traffic
+    from .utils import split_destinations
+
     init.load_configs(env, config_dir)
     init.set_up_logging()
     slack = slackclient.SlackClient(config['slack']['bot_user']['token'])
     mapper = TrafficMapper()
 
-    location_aliases = config['google']['location_aliases']
+    location_aliases = location_index()
     origin = location_aliases.get(origin, origin)
-    destination = location_aliases.get(destination, destination)
+    destinations = [location_aliases.get(d, d) for d in split_destinations(destination, location_aliases)]
 
     for i in range(number_of_posts):
-        duration, distance, image_name = mapper.get_map(origin, destination)
-        slack_message = mapper.as_slack_message(
-            origin, destination, duration, distance, image_name)
-        slack.api_call(
-            'chat.postMessage',
-            channel=slack_channel,
-            as_user=True,
-            **slack_message)
+        post_traffic(mapper, slack, slack_channel, origin, destinations)
 
         if i != number_of_posts - 1:
             time.sleep(interval * 60)
@@ -0,0 +1,251 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import logging
+import sys
+import threading
+
+import aiohttp
+
+from . import init
+from .configuration import config
+from .deferred import ERROR_MESSAGE, TIMEOUT_MESSAGE
+from .metrics import OUTBOUND_LATENCY
+from .server import _build_app
+
+
+def get_asgi_app(env, config_dir=None):
+    """Build the same app as ``server.get_app``, served as an ASGI application."""
+    init.load_configs(env, config_dir)
+    init.set_up_logging()
+    app = _build_asgi_app()
+    init.reload_on_sighup(env, config_dir)
+    return app
+
+
+def _build_asgi_app():
+    asgi_config = config['asgi']
+    deferred = config['slack']['traffic_command']['deferred']
+    responder = AsyncDeferredResponder(
+        workers=deferred['workers'],
+        backlog=deferred['backlog'],
+        job_timeout=deferred['job_timeout'],
+        connections_per_host=asgi_config['connections_per_host'])
+
+    loop_paths = set(asgi_config['loop_paths'])
+    dedup = config['slack']['dedup']
+    if dedup['enabled']:
+        # a repeated delivery waits on the first for up to in_flight_wait seconds, and every
+        # delivery reads and writes its dedup entry on disk
+        loop_paths.difference_update(dedup['paths'])
+
+    return AsgiApp(
+        _build_app(traffic_responder=responder),
+        loop_paths=loop_paths,
+        workers=asgi_config['workers'],
+        on_startup=[responder.start],
+        on_shutdown=[responder.close])
+
+
+class AsgiApp:
+    """
+    Serve a falcon app from an event loop.
+
+    The falcon app is synchronous, so requests are handed to it on a pool of
+    ``workers`` threads and a route that blocks can't stall the loop. Routes
+    listed in ``loop_paths`` never block and are called on the loop itself,
+    saving the hop to a thread. ``on_startup`` callables get the running loop
+    and ``on_shutdown`` coroutine functions are awaited when the server stops.
+    """
+
+    def __init__(self, wsgi_app, loop_paths=(), workers=8, on_startup=(), on_shutdown=()):
+        self._app = wsgi_app
+        self._loop_paths = frozenset(loop_paths)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._on_startup = list(on_startup)
+        self._on_shutdown = list(on_shutdown)
+        self._started = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        # servers without lifespan support never send startup
+        if not self._started:
+            self._startup()
+
+        body = await _read_body(receive)
+        environ = _environ(scope, body)
+        if scope['path'] in self._loop_paths:
+            status, headers, chunks = _call_wsgi(self._app, environ)
+        else:
+            status, headers, chunks = await asyncio.get_event_loop().run_in_executor(
+                self._executor, _call_wsgi, self._app, environ)
+
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        })
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+
+    def _startup(self):
+        self._started = True
+        loop = asyncio.get_event_loop()
+        for callback in self._on_startup:
+            callback(loop)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if not self._started:
+                    self._startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for callback in self._on_shutdown:
+                    try:
+                        await callback()
+                    except Exception:
+                        logging.exception('error during shutdown')
+                self._executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def _environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = '{},{}'.format(environ[key], value) if key in environ else value
+    return environ
+
+
+def _call_wsgi(app, environ):
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+
+    result = app(environ, start_response)
+    try:
+        chunks = list(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started[0], started[1], chunks
+
+
+class AsyncDeferredResponder:
+    """
+    Event loop counterpart of ``deferred.DeferredResponder``.
+
+    ``submit`` has the same contract, but only the job itself takes a thread,
+    from a pool of ``workers``. Waiting on it, timing it out and posting its
+    result to the ``response_url`` all happen on the loop, through an aiohttp
+    session with at most ``connections_per_host`` connections to each host.
+    """
+
+    def __init__(self, workers=4, backlog=16, job_timeout=30.0, post_timeout=10.0, connections_per_host=4):
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+        self._job_timeout = job_timeout
+        self._post_timeout = post_timeout
+        self._connections_per_host = connections_per_host
+        self._loop = None
+        self._session = None
+        self._tasks = set()
+
+    def start(self, loop):
+        self._loop = loop
+
+    def submit(self, response_url, fn, *args):
+        """Queue ``fn(*args)``, returning False if the pool is saturated."""
+        if self._loop is None or not self._slots.acquire(blocking=False):
+            return False
+        self._loop.call_soon_threadsafe(self._spawn, response_url, fn, args)
+        return True
+
+    async def close(self, timeout=10):
+        """Wait up to ``timeout`` seconds for jobs in flight, then release the session."""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+        if self._session is not None:
+            await self._session.close()
+        self._executor.shutdown(wait=False)
+
+    def _spawn(self, response_url, fn, args):
+        task = self._loop.create_task(self._run(response_url, fn, args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, response_url, fn, args):
+        try:
+            job = self._loop.run_in_executor(self._executor, fn, *args)
+        except RuntimeError:
+            self._slots.release()
+            return
+        # the slot is held until the job really finishes, even after it times out
+        job.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            message = await asyncio.wait_for(asyncio.shield(job), self._job_timeout)
+        except asyncio.TimeoutError:
+            logging.warning('deferred job for %s timed out after %ss', response_url, self._job_timeout)
+            message = TIMEOUT_MESSAGE
+        except Exception as e:
+            logging.error('deferred job for %s failed: %r', response_url, e)
+            message = ERROR_MESSAGE
+        await self._respond(response_url, message)
+
+    async def _respond(self, response_url, message):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self._connections_per_host),
+                timeout=aiohttp.ClientTimeout(total=self._post_timeout))
+
+        try:
+            with OUTBOUND_LATENCY.time('slack_response_url'):
+                async with self._session.post(response_url, json=message) as response:
+                    response.raise_for_status()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error('could not post to response_url %s: %r', response_url, e)
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+import yaml
+
+from .utils import merge_many_dicts
+
+# libyaml's loader is several times faster when PyYAML was built against it
+_Loader = getattr(yaml, 'CLoader', yaml.Loader)
+_VERSION = 1
+
+
+def load_merged(paths, snapshot_path=None):
+    """
+    Load and merge the YAML files at ``paths`` with ``merge_many_dicts``.
+
+    The first file to set a value wins; later files only add keys that
+    earlier ones leave out.
+
+    The merged result is pickled to ``snapshot_path`` along with the size,
+    mtime and sha256 of every source file. Later loads reuse the snapshot
+    when the sizes and mtimes still match, or when a source was touched but
+    its contents hash the same, and otherwise parse the YAML again. Without
+    a ``snapshot_path`` the files are always parsed.
+    """
+    stats = [os.stat(p) for p in paths]
+    stamps = [(p, s.st_size, s.st_mtime_ns) for p, s in zip(paths, stats)]
+
+    snapshot = _read_snapshot(snapshot_path) if snapshot_path else None
+    if snapshot is not None and snapshot['paths'] == list(paths):
+        if snapshot['stamps'] == stamps:
+            return snapshot['config']
+
+    contents = [_read(p) for p in paths]
+    hashes = [hashlib.sha256(c).hexdigest() for c in contents]
+
+    if snapshot is not None and snapshot['paths'] == list(paths) and snapshot['hashes'] == hashes:
+        merged = snapshot['config']
+    else:
+        merged = merge_many_dicts(*(yaml.load(c, Loader=_Loader) for c in contents))
+
+    if snapshot_path:
+        _write_snapshot(snapshot_path, {
+            'version': _VERSION,
+            'paths': list(paths),
+            'stamps': stamps,
+            'hashes': hashes,
+            'config': merged
+        })
+    return merged
+
+
+def default_snapshot_path(env, config_dir):
+    cache_dir = os.path.join(
+        os.getenv('XDG_CACHE_HOME', os.path.join(os.getenv('HOME'), '.cache')),
+        'fangorn')
+    key = hashlib.sha256(os.path.abspath(config_dir).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, 'config-{}-{}.pickle'.format(env, key))
+
+
+def _read(path):
+    with open(path, 'rb') as f_in:
+        return f_in.read()
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, 'rb') as f_in:
+            snapshot = pickle.load(f_in)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != _VERSION:
+        return None
+    return snapshot
+
+
+def _write_snapshot(path, snapshot):
+    # the snapshot holds secrets, mkstemp creates it readable by the owner only
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.config-')
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(fd, 'wb') as f_out:
+            pickle.dump(snapshot, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+import requests
+
+from . import outbound
+from .metrics import OUTBOUND_LATENCY
+
+ERROR_MESSAGE = {
+    'text': 'Sorry, something went wrong handling that command.',
+    'response_type': 'ephemeral'
+}
+TIMEOUT_MESSAGE = {
+    'text': 'Sorry, that took too long. Please try again.',
+    'response_type': 'ephemeral'
+}
+
+
+class DeferredResponder:
+    """
+    Run slow slash command work off the request thread.
+
+    Jobs run on a fixed size thread pool and their result, a Slack message
+    dict, is posted to the command's ``response_url``. At most ``workers``
+    jobs run at once with up to ``backlog`` more waiting; anything beyond that
+    is refused so the caller can answer straight away. A job that has not
+    finished within ``job_timeout`` seconds gets a timeout message instead and
+    its eventual result is discarded.
+
+    The timeout only answers Slack; a thread can't be interrupted, so the
+    worker and the job's slot stay taken until the job returns. Jobs should
+    bound their own outbound calls. Those made through ``outbound.session``
+    give up after its connect and read timeouts.
+    """
+
+    def __init__(self, workers=4, backlog=16, job_timeout=30.0, post_timeout=10.0):
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers + backlog)
+        self._job_timeout = job_timeout
+        self._post_timeout = post_timeout
+        self._session = outbound.session()
+
+    def submit(self, response_url, fn, *args):
+        """Queue ``fn(*args)``, returning False if the pool is saturated."""
+        if not self._slots.acquire(blocking=False):
+            return False
+
+        job = _Job(response_url)
+        try:
+            future = self._executor.submit(fn, *args)
+        except RuntimeError:
+            self._slots.release()
+            return False
+
+        timer = threading.Timer(self._job_timeout, self._on_timeout, args=(job,))
+        timer.daemon = True
+        timer.start()
+        future.add_done_callback(lambda f: self._on_done(job, timer, f))
+        return True
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _on_done(self, job, timer, future):
+        timer.cancel()
+        self._slots.release()
+
+        error = future.exception()
+        if error is not None:
+            logging.error('deferred job for %s failed: %r', job.response_url, error)
+            message = ERROR_MESSAGE
+        else:
+            message = future.result()
+
+        if job.claim():
+            self._respond(job.response_url, message)
+
+    def _on_timeout(self, job):
+        if job.claim():
+            logging.warning('deferred job for %s timed out after %ss', job.response_url, self._job_timeout)
+            self._respond(job.response_url, TIMEOUT_MESSAGE)
+
+    def _respond(self, response_url, message):
+        try:
+            with OUTBOUND_LATENCY.time('slack_response_url'):
+                response = self._session.post(response_url, json=message, timeout=self._post_timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logging.error('could not post to response_url %s: %s', response_url, e)
+
+
+class _Job:
+    def __init__(self, response_url):
+        self.response_url = response_url
+        self._lock = threading.Lock()
+        self._responded = False
+
+    def claim(self):
+        """Return True for the first caller only, so a job is answered once."""
+        with self._lock:
+            if self._responded:
+                return False
+            self._responded = True
+            return True
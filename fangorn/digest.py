@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+
+# slack drops attachments past this many in one message
+_MAX_ATTACHMENTS = 100
+
+
+class ChannelDigest:
+    """
+    Coalesce alerts headed for the same channel into one message.
+
+    The first alert for a channel opens a batch that is posted through
+    ``post_message`` after ``max_delay`` seconds, or as soon as it holds
+    ``max_batch`` alerts, whichever comes first. Each alert's limits come
+    from its matcher, and a batch keeps the tightest limits of the alerts in
+    it. ``close`` posts whatever is still buffered.
+    """
+
+    def __init__(self, post_message, text='<!channel>: This looks interesting...'):
+        self._post_message = post_message
+        self._text = text
+        self._batches = {}
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._stats = {
+            'buffered': 0,
+            'posted': 0,
+            'dropped': 0
+        }
+
+        self._flusher = threading.Thread(target=self._flush_periodically, name='digest-flusher', daemon=True)
+        self._flusher.start()
+
+    @property
+    def stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats['pending'] = sum(len(b.attachments) for b in self._batches.values())
+        return stats
+
+    def add(self, channel, attachment, max_delay=30.0, max_batch=20):
+        """Buffer an alert, returning False if the digest is already closed."""
+        with self._condition:
+            if self._closed:
+                return False
+            deadline = time.monotonic() + max_delay
+            batch = self._batches.get(channel)
+            if batch is None:
+                batch = self._batches[channel] = _Batch(deadline, max_batch)
+            batch.add(attachment, deadline, max_batch)
+            self._stats['buffered'] += 1
+            # the batch may now be due sooner than the flusher is waiting for
+            self._condition.notify()
+
+            full = batch if len(batch.attachments) >= batch.max_batch else None
+            if full is not None:
+                del self._batches[channel]
+
+        if full is not None:
+            self._post(channel, full)
+        return True
+
+    def close(self):
+        """Post every buffered batch and stop accepting alerts."""
+        with self._condition:
+            self._closed = True
+            batches, self._batches = self._batches, {}
+            self._condition.notify()
+        for channel, batch in batches.items():
+            self._post_or_drop(channel, batch)
+        self._flusher.join()
+
+    def _flush_periodically(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                due = [c for c, b in self._batches.items() if b.deadline <= now]
+                ready = [(c, self._batches.pop(c)) for c in due]
+                if not ready:
+                    if self._closed:
+                        return
+                    deadlines = [b.deadline for b in self._batches.values()]
+                    self._condition.wait(min(deadlines) - now if deadlines else None)
+                    continue
+
+            for channel, batch in ready:
+                self._post_or_drop(channel, batch)
+
+    def _post_or_drop(self, channel, batch):
+        # the flusher has to outlive a failed post, or every later batch waits forever
+        try:
+            self._post(channel, batch)
+        except Exception:
+            logging.exception('error posting a digest for %s', channel)
+            with self._condition:
+                self._stats['dropped'] += 1
+
+    def _post(self, channel, batch):
+        attachments = batch.attachments
+        if len(attachments) == 1:
+            text = self._text
+        else:
+            text = '{} ({} matches)'.format(self._text, len(attachments))
+
+        for start in range(0, len(attachments), _MAX_ATTACHMENTS):
+            queued = self._post_message(
+                channel=channel,
+                text=text,
+                attachments=attachments[start:start + _MAX_ATTACHMENTS],
+                as_user=True)
+            with self._condition:
+                self._stats['posted' if queued else 'dropped'] += 1
+            if not queued:
+                logging.warning('could not queue a digest of %d matches for %s', len(attachments), channel)
+
+
+class _Batch:
+    def __init__(self, deadline, max_batch):
+        self.deadline = deadline
+        self.max_batch = max_batch
+        self.attachments = []
+
+    def add(self, attachment, deadline, max_batch):
+        self.attachments.append(attachment)
+        self.deadline = min(self.deadline, deadline)
+        self.max_batch = min(self.max_batch, max_batch)
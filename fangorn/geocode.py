@@ -0,0 +1,152 @@
+from collections import OrderedDict
+import difflib
+import functools
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from .configuration import config
+
+
+def normalize(location):
+    """Lowercase and collapse whitespace, ignoring stray punctuation at either end."""
+    return ' '.join(location.lower().split()).strip(' ,.;')
+
+
+def location_index():
+    """A ``LocationIndex`` of the configured location aliases."""
+    return LocationIndex(config['google']['location_aliases'], config['google']['geocode']['fuzzy_cutoff'])
+
+
+def default_geocode_path():
+    return os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'fangorn', 'geocode.json')
+
+
+class LocationIndex:
+    """
+    Location aliases, looked up the way people type them.
+
+    Works as a read only mapping from alias to address. Lookups ignore case,
+    extra whitespace and stray punctuation. Text without digits that is at
+    least ``fuzzy_cutoff`` similar to an alias, like a typo, resolves to the
+    closest one, and ``assumed`` names the alias it was taken for. Addresses
+    have digits, so they are never mistaken for an alias.
+    """
+
+    def __init__(self, aliases, fuzzy_cutoff=0.9):
+        self._aliases = {normalize(alias): address for alias, address in aliases.items()}
+        self._names = {normalize(alias): alias for alias in aliases}
+        self._fuzzy_cutoff = fuzzy_cutoff
+        # the same few typos come up again and again
+        self._closest = functools.lru_cache(maxsize=1024)(self._closest_alias)
+
+    def __contains__(self, text):
+        return self._alias(text) is not None
+
+    def __getitem__(self, text):
+        alias = self._alias(text)
+        if alias is None:
+            raise KeyError(text)
+        return self._aliases[alias]
+
+    def get(self, text, default=None):
+        alias = self._alias(text)
+        return default if alias is None else self._aliases[alias]
+
+    def assumed(self, text):
+        """The alias ``text`` was taken to mean if it only resolved as a typo, otherwise None."""
+        alias = self._alias(text)
+        if alias is None or alias == normalize(text):
+            return None
+        return self._names[alias]
+
+    def _alias(self, text):
+        key = normalize(text)
+        if key in self._aliases:
+            return key
+        if self._fuzzy_cutoff >= 1 or any(c.isdigit() for c in key):
+            return None
+        return self._closest(key)
+
+    def _closest_alias(self, key):
+        matches = difflib.get_close_matches(key, self._aliases, n=1, cutoff=self._fuzzy_cutoff)
+        return matches[0] if matches else None
+
+
+class GeocodeCache:
+    """
+    Persistent map from an address to its coordinates.
+
+    Addresses are keyed normalized, so the same place typed differently is
+    geocoded once, and ``geocode`` is only called for addresses not already
+    in the file at ``path``. The file is shared by every process on the host
+    and keeps the ``max_entries`` most recently resolved addresses.
+    Coordinates come back as a ``lat,lng`` string both the Directions and
+    Static Maps APIs accept in place of an address.
+    """
+
+    def __init__(self, path, geocode, max_entries=4096):
+        self._path = os.path.expanduser(path)
+        self._geocode = geocode
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        self._coordinates = OrderedDict(self._load())
+
+    def coordinates(self, address):
+        """The coordinates of ``address``, or None if it can't be geocoded."""
+        key = normalize(address)
+        with self._lock:
+            coordinates = self._coordinates.get(key)
+        if coordinates is not None:
+            return coordinates
+
+        location = self._geocode(address)
+        if location is None:
+            return None
+        coordinates = '{:.6f},{:.6f}'.format(*location)
+
+        with self._lock:
+            self._coordinates[key] = coordinates
+            self._coordinates.move_to_end(key)
+            while len(self._coordinates) > self._max_entries:
+                self._coordinates.popitem(last=False)
+            try:
+                self._save()
+            except OSError as e:
+                logging.warning('could not save geocode cache %s: %r', self._path, e)
+        return coordinates
+
+    def warm(self, addresses):
+        """Resolve every address not already cached."""
+        for address in addresses:
+            self.coordinates(address)
+
+    def _load(self):
+        try:
+            with open(self._path) as f_in:
+                return json.load(f_in)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save(self):
+        # pick up addresses other processes have resolved since we loaded, as
+        # older than ours, so ours are the last to be trimmed
+        coordinates = [(k, v) for k, v in self._load().items() if k not in self._coordinates]
+        coordinates.extend(self._coordinates.items())
+        coordinates = coordinates[-self._max_entries:]
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self._path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f_out:
+                json.dump(OrderedDict(coordinates), f_out)
+            os.replace(temp_path, self._path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
@@ -1,10 +1,22 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
+import json
+import logging
 import os
+import tempfile
+import threading
+import time
 
 import googlemaps
+import googlemaps.exceptions
 import requests
 
+from . import outbound
 from .configuration import config
+from .geocode import GeocodeCache, default_geocode_path, normalize
+from .image_store import ImageStore
+from .metrics import OUTBOUND_LATENCY
 
 _MODE = 'driving'
 _LANGUAGE = 'en'
@@ -15,41 +27,46 @@ _DEPARTURE_TIME = 'now'
 
 class TrafficMapper:
     def __init__(self):
-        self._gmaps = googlemaps.Client(key=config['google']['directions']['key'])
-
-        self._image_directory = config['google']['static_map']['image_directory']
+        directions_config = config['google']['directions']
+        self._gmaps = _MapsClient(directions_config['url_base'], key=directions_config['key'])
+        # the client has no option for this, but only ever uses ``session`` to send requests
+        self._gmaps.session = outbound.session()
+        self._directions_cache = DirectionsCache(**directions_config['cache'])
 
         static_map_config = config['google']['static_map']
+        self._image_store = ImageStore(static_map_config['image_directory'], **static_map_config['store'])
+        self._route_images = RouteImageIndex(
+            os.path.join(self._image_store.directory, 'routes.json'),
+            _fingerprint({k: v for k, v in static_map_config.items() if k != 'store'}))
+
         self._image_format = config['google']['static_map']['url_format']
         self._marker_format = static_map_config['marker_format']
         self._path_format = static_map_config['path_format']
         self._url = static_map_config['url_base']
 
-        self._session = requests.Session()
-        self._session.params = {
+        self._route_pool = ThreadPoolExecutor(max_workers=config['google']['max_parallel_routes'])
+
+        geocode_config = config['google']['geocode']
+        self._geocodes = GeocodeCache(geocode_config.get('path') or default_geocode_path(), self._geocode,
+                                      geocode_config['max_entries'])
+        # aliases are asked for most, resolve any not on disk yet without holding up startup or a route worker
+        threading.Thread(target=self._geocodes.warm, args=(list(config['google']['location_aliases'].values()),),
+                         name='geocode-warm', daemon=True).start()
+
+        self._session = outbound.session()
+        self._params = {
             'size': '{}x{}'.format(static_map_config['size']['width'], static_map_config['size']['height']),
             'key': static_map_config['key']
         }
 
-    def get_map(self, origin, destination):
-        directions_response = self._gmaps.directions(
-            origin=origin,
-            destination=destination,
-            mode=_MODE,
-            language=_LANGUAGE,
-            units=_UNITS,
-            traffic_model=_TRAFFIC_MODEL,
-            departure_time=_DEPARTURE_TIME)
-        polyline = directions_response[0]['overview_polyline']['points']
+    @property
+    def directions_cache_stats(self):
+        return self._directions_cache.stats
 
-        map_response = self._session.get(self._url, params={
-            'path': self._path_format.format(polyline),
-            'markers': (self._marker_format.format('A', origin),
-                        self._marker_format.format('B', destination))
-        })
-        fname = '{}.png'.format(hashlib.md5(map_response.content).hexdigest())
-        with open(os.path.join(os.path.expanduser(self._image_directory), fname), 'wb') as fout:
-            fout.write(map_response.content)
+    def get_map(self, origin, destination):
+        origin, destination = self._coordinates(origin), self._coordinates(destination)
+        directions_response = self._directions_cache.get(origin, destination, self._directions)
+        fname = self._route_image(origin, destination, directions_response)
 
         return (
             directions_response[0]['legs'][0]['duration_in_traffic']['text'],
@@ -57,6 +74,90 @@ class TrafficMapper:
             fname
         )
 
+    def get_maps(self, origin, destinations):
+        """
+        Get the duration, distance and map image from origin to each destination.
+
+        Each destination takes one Directions request, made in parallel
+        through the directions cache, whose route gives the duration in
+        traffic and distance as well as the polyline for the map. A
+        destination Google can't route to gets None for all three values.
+        """
+        origin = self._coordinates(origin)
+        destinations = [self._coordinates(d) for d in destinations]
+
+        def route(destination):
+            try:
+                directions_response = self._directions_cache.get(origin, destination, self._directions)
+            except googlemaps.exceptions.ApiError as e:
+                # one address Google can't find shouldn't cost the other destinations their answers
+                if e.status != 'NOT_FOUND':
+                    raise
+                directions_response = []
+            if not directions_response:
+                return None, None, None
+            leg = directions_response[0]['legs'][0]
+            fname = self._route_image(origin, destination, directions_response)
+            return leg['duration_in_traffic']['text'], leg['distance']['text'], fname
+
+        return list(self._route_pool.map(route, destinations))
+
+    def traffic_message(self, origin, destinations):
+        """Build the Slack message for one or several destinations."""
+        if len(destinations) == 1:
+            return self.as_slack_message(origin, destinations[0], *self.get_map(origin, destinations[0]))
+        return self.as_slack_multi_message(origin, destinations, self.get_maps(origin, destinations))
+
+    def _route_image(self, origin, destination, directions_response):
+        polyline = directions_response[0]['overview_polyline']['points']
+
+        params = {
+            'path': self._path_format.format(polyline),
+            'markers': (self._marker_format.format('A', origin),
+                        self._marker_format.format('B', destination))
+        }
+        route_key = _fingerprint([params['path'], params['markers'], self._params['size']])
+
+        fname = self._route_images.get(route_key)
+        if fname is None or not self._image_store.reuse(fname):
+            with OUTBOUND_LATENCY.time('static_map'):
+                map_response = self._session.get(self._url, stream=True, params=dict(self._params, **params))
+            # an error body would otherwise be stored, and indexed, as this route's image
+            _check_image(map_response)
+            # the body streams to disk, so this covers the rest of the download
+            with OUTBOUND_LATENCY.time('image_write'):
+                fname = self._image_store.put(map_response)
+            self._route_images.set(route_key, fname)
+        return fname
+
+    def _coordinates(self, location):
+        """Coordinates for ``location`` where it can be geocoded, so Google doesn't resolve it on every call."""
+        return self._geocodes.coordinates(location) or location
+
+    def _geocode(self, address):
+        try:
+            with OUTBOUND_LATENCY.time('geocode'):
+                results = self._gmaps.geocode(address)
+        except (googlemaps.exceptions.ApiError, googlemaps.exceptions.TransportError,
+                googlemaps.exceptions.Timeout) as e:
+            logging.warning('could not geocode %s: %r', address, e)
+            return None
+        if not results:
+            return None
+        location = results[0]['geometry']['location']
+        return location['lat'], location['lng']
+
+    def _directions(self, origin, destination):
+        with OUTBOUND_LATENCY.time('directions'):
+            return self._gmaps.directions(
+                origin=origin,
+                destination=destination,
+                mode=_MODE,
+                language=_LANGUAGE,
+                units=_UNITS,
+                traffic_model=_TRAFFIC_MODEL,
+                departure_time=_DEPARTURE_TIME)
+
     def as_slack_message(self, origin, destination, duration, distance, image_name):
         return {
             'text': 'Here are the traffic conditions between {} and {}'.format(origin, destination),
@@ -79,3 +180,196 @@ class TrafficMapper:
                 }
             ]
         }
+
+    def as_slack_multi_message(self, origin, destinations, results):
+        attachments = []
+        for destination, (duration, distance, image_name) in zip(destinations, results):
+            if duration is None:
+                attachments.append({'title': destination, 'text': 'No route found', 'color': 'danger'})
+                continue
+            attachments.append({
+                'title': destination,
+                'fields': [
+                    {
+                        'title': 'Duration',
+                        'value': duration,
+                        'short': True
+                    },
+                    {
+                        'title': 'Distance',
+                        'value': distance,
+                        'short': True
+                    }
+                ],
+                'image_url': self._image_format.format(image_name)
+            })
+
+        return {
+            'text': 'Here are the traffic conditions from {}'.format(origin),
+            'attachments': attachments
+        }
+
+
+class _MapsClient(googlemaps.Client):
+    """A googlemaps client that sends its requests to ``url_base`` rather than always to Google."""
+
+    def __init__(self, url_base, **kwargs):
+        super().__init__(**kwargs)
+        self._url_base = url_base
+
+    def _request(self, url, params, first_request_time=None, retry_counter=0, base_url=None, *args, **kwargs):
+        return super()._request(url, params, first_request_time, retry_counter, base_url or self._url_base,
+                                *args, **kwargs)
+
+
+class DirectionsCache:
+    """
+    Short lived LRU cache of directions responses keyed on origin/destination.
+
+    Keys are normalized for case and whitespace. Entries expire ``ttl``
+    seconds after they were fetched since traffic data goes stale quickly,
+    and the least recently used entry is evicted once ``max_size`` is reached.
+    Concurrent lookups of the same missing key share a single fetch.
+    """
+
+    def __init__(self, ttl=60, max_size=256):
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries))
+
+    def get(self, origin, destination, fetch):
+        key = (normalize(origin), normalize(destination))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+                self._stats['misses'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            return flight.wait()
+
+        try:
+            value = fetch(origin, destination)
+        except Exception as e:
+            with self._lock:
+                del self._in_flight[key]
+            flight.fail(e)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        flight.resolve(value)
+        return value
+
+
+class RouteImageIndex:
+    """
+    Persistent map from a rendered route to the stored image of it.
+
+    The index file records a fingerprint of the static map config it was
+    built with and is discarded when that no longer matches, since the same
+    route would then render differently. Only the ``max_entries`` most
+    recently used routes are kept.
+    """
+
+    def __init__(self, path, config_fingerprint, max_entries=1024):
+        self._path = path
+        self._fingerprint = config_fingerprint
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._routes = OrderedDict(self._load())
+
+    def get(self, route_key):
+        with self._lock:
+            fname = self._routes.get(route_key)
+            if fname is not None:
+                self._routes.move_to_end(route_key)
+            return fname
+
+    def set(self, route_key, fname):
+        with self._lock:
+            self._routes[route_key] = fname
+            self._routes.move_to_end(route_key)
+            while len(self._routes) > self._max_entries:
+                self._routes.popitem(last=False)
+            self._save()
+
+    def _load(self):
+        try:
+            with open(self._path) as f_in:
+                index = json.load(f_in)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if index.get('fingerprint') != self._fingerprint:
+            return {}
+        return index.get('routes', {})
+
+    def _save(self):
+        # pick up routes other processes have added since we loaded
+        routes = self._load()
+        routes.update(self._routes)
+        routes = list(routes.items())[-self._max_entries:]
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self._path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f_out:
+            json.dump({'fingerprint': self._fingerprint, 'routes': OrderedDict(routes)}, f_out)
+        os.replace(temp_path, self._path)
+
+
+class _Flight:
+    def __init__(self):
+        self._done = threading.Event()
+        self._value = None
+        self._error = None
+
+    def resolve(self, value):
+        self._value = value
+        self._done.set()
+
+    def fail(self, error):
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+def _check_image(response):
+    try:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        if not content_type.startswith('image/'):
+            raise requests.HTTPError('static map came back as {!r}'.format(content_type), response=response)
+    except requests.HTTPError:
+        response.close()
+        raise
+
+
+def _fingerprint(value):
+    return hashlib.md5(json.dumps(value, sort_keys=True).encode()).hexdigest()
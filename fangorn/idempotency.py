@@ -0,0 +1,239 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import falcon
+
+from .metrics import DUPLICATE_DELIVERIES
+
+
+def default_directory():
+    """A per-user directory on tmpfs where there is one, so workers share entries without touching disk."""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'fangorn-dedup-{}'.format(os.getuid()))
+
+
+class DeliveryCache:
+    """
+    Remember the response to each Slack delivery for ``window`` seconds.
+
+    Entries are small JSON files in ``directory``, named after the delivery
+    key, so every worker process on the host sees the same entries. The
+    first request for a key claims it with an exclusive create and replaces
+    the claim with its response once done, or marks it released so the
+    delivery's retry can claim it again. A claim that is never completed,
+    because its worker died, lapses after ``pending_timeout`` seconds. A
+    background sweeper removes expired entries and then the oldest ones
+    until at most ``max_entries`` remain.
+    """
+
+    def __init__(self, directory=None, window=300, max_entries=10000, pending_timeout=30, sweep_interval=60):
+        self._directory = os.path.expanduser(directory or default_directory())
+        self._window = window
+        self._max_entries = max_entries
+        self._pending_timeout = pending_timeout
+
+        os.makedirs(self._directory, mode=0o700, exist_ok=True)
+        # anyone who can write here can choose the answers to our requests
+        if os.stat(self._directory).st_uid != os.getuid():
+            raise PermissionError('{} is owned by another user'.format(self._directory))
+
+        self._sweeper = threading.Thread(target=self._sweep_forever, args=(sweep_interval,),
+                                         name='delivery-cache-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def claim(self, key):
+        """
+        Claim ``key`` for the caller to handle.
+
+        Returns ``(True, None)`` when the caller is first, otherwise
+        ``(False, response)`` where response is None while the first request
+        is still in flight.
+        """
+        path = self._path(key)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileExistsError:
+                entry = self._read(path)
+                if entry is not None and (entry['expires'] < time.time() or entry.get('released')):
+                    _remove(path)
+                    continue
+                return False, entry and entry.get('response')
+            with os.fdopen(fd, 'w') as f_out:
+                json.dump({'expires': time.time() + self._pending_timeout}, f_out)
+            return True, None
+        return False, None
+
+    def wait(self, key, timeout, poll=0.02):
+        """Wait up to ``timeout`` seconds for the first request for ``key`` to finish, returning its response."""
+        deadline = time.monotonic() + timeout
+        path = self._path(key)
+        while True:
+            entry = self._read(path)
+            if entry is not None and 'response' in entry:
+                return entry['response']
+            if time.monotonic() >= deadline or entry is not None and entry.get('released'):
+                return None
+            time.sleep(poll)
+
+    def complete(self, key, response):
+        self._write(key, {'expires': time.time() + self._window, 'response': response})
+
+    def release(self, key):
+        """Give up a claim, so a retry of the delivery runs again."""
+        # kept rather than removed, so the retry is still known as a delivery we have seen
+        self._write(key, {'expires': time.time() + self._window, 'released': True})
+
+    def known(self, key):
+        """Whether ``key`` has been claimed and not yet expired or evicted."""
+        return os.path.exists(self._path(key))
+
+    def sweep(self):
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self._directory):
+            if not entry.name.endswith('.json'):
+                continue
+            contents = self._read(entry.path)
+            if contents is not None and contents['expires'] < now:
+                _remove(entry.path)
+            else:
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self._max_entries)]:
+            _remove(path)
+
+    def _sweep_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception:
+                logging.exception('error sweeping delivery cache')
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + '.json')
+
+    def _write(self, key, entry):
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f_out:
+                json.dump(entry, f_out)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            _remove(temp_path)
+            raise
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f_in:
+                return json.load(f_in)
+        except (FileNotFoundError, ValueError):
+            # a claim that is still being written reads as empty
+            return None
+
+
+class IdempotencyMiddleware:
+    """
+    Answer repeated Slack deliveries with the response to the first one.
+
+    Slack retries webhooks and slash commands it doesn't get a fast answer
+    for, and each retry would otherwise run the resource again. POSTs to
+    ``paths`` are keyed by their signature when ``SlackRequestMiddleware``
+    verified it, since a retry is byte for byte the same request, and
+    otherwise by the team, channel, user, timestamp and text of the message.
+    A repeat that arrives while the first is still being handled waits up
+    to ``in_flight_wait`` seconds for its response, then gets a 503 so Slack
+    tries again later rather than taking an answer the first might never
+    give. Responses of 500 and above are not kept, so their retries run
+    again.
+    """
+
+    def __init__(self, cache, paths=(), in_flight_wait=2.5):
+        self._cache = cache
+        self._paths = frozenset(paths)
+        self._in_flight_wait = in_flight_wait
+
+    def process_request(self, req, resp):
+        if req.method != 'POST' or req.path not in self._paths:
+            _reject_replay(req)
+            return
+
+        key = delivery_key(req)
+        if key is None:
+            _reject_replay(req)
+            return
+
+        if req.context.get('slack_replay') and not self._cache.known(key):
+            # the signature was seen before, but its response has since been evicted
+            _reject_replay(req)
+
+        first, response = self._cache.claim(key)
+        if first:
+            req.context['delivery_key'] = key
+            return
+
+        result = 'replayed'
+        if response is None:
+            result = 'in_flight'
+            response = self._cache.wait(key, self._in_flight_wait)
+        if response is None:
+            DUPLICATE_DELIVERIES.inc(req.path, 'unanswered')
+            logging.info('delivery to %s (retry %s) has no answer yet, asking slack to retry', req.path,
+                         req.get_header('X-Slack-Retry-Num') or '?')
+            raise falcon.HTTPServiceUnavailable(title='Delivery in progress', retry_after=1)
+        DUPLICATE_DELIVERIES.inc(req.path, result)
+        logging.info('answering duplicate delivery to %s (retry %s) with the %s response', req.path,
+                     req.get_header('X-Slack-Retry-Num') or '?', result.replace('_', ' '))
+        raise falcon.HTTPStatus(response['status'], body=response['body'],
+                                headers={'Content-Type': response.get('content_type') or 'application/json'})
+
+    def process_response(self, req, resp, resource, req_succeeded=True):
+        key = req.context.get('delivery_key')
+        if key is None:
+            return
+
+        try:
+            if req_succeeded and int(resp.status.split(' ', 1)[0]) < 500:
+                self._cache.complete(key, {'status': resp.status, 'body': resp.body or '',
+                                           'content_type': resp.content_type})
+            else:
+                self._cache.release(key)
+        except OSError as e:
+            logging.error('could not record response for delivery to %s: %r', req.path, e)
+
+
+def delivery_key(req):
+    """A key identifying one Slack delivery across its retries, or None if it can't be identified."""
+    # anyone can send a signature header, only a verified one identifies the delivery
+    if req.context.get('slack_verified'):
+        parts = (req.get_header('X-Slack-Signature'),)
+    else:
+        timestamp = req.get_param('timestamp')
+        if not timestamp:
+            return None
+        parts = (req.get_param('team_id'), req.get_param('channel_id'),
+                 req.get_param('user_id') or req.get_param('user_name'), timestamp, req.get_param('text'))
+    return hashlib.sha256('\0'.join((req.path,) + tuple(p or '' for p in parts)).encode()).hexdigest()
+
+
+def _reject_replay(req):
+    if req.context.get('slack_replay'):
+        raise falcon.HTTPUnauthorized(title='Replayed request')
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
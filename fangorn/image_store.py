@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+_INDEX_NAME = 'index.json'
+_CHUNK_SIZE = 64 * 1024
+
+
+class ImageStore:
+    """
+    Content addressed store for static map images.
+
+    Images are streamed to a temporary file while being hashed and are named
+    after their MD5 digest, so an image already on disk is never rewritten.
+    An index of size and last access time per image is kept in
+    ``index.json`` alongside the images. A background sweeper removes images
+    not accessed within ``max_age`` seconds and then evicts the least
+    recently accessed images until the store fits in ``max_bytes``.
+    """
+
+    def __init__(self, directory, max_bytes=100 * 1024 * 1024, max_age=7 * 24 * 60 * 60, sweep_interval=300):
+        self._directory = os.path.expanduser(directory)
+        self._index_path = os.path.join(self._directory, _INDEX_NAME)
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._lock = threading.Lock()
+
+        os.makedirs(self._directory, exist_ok=True)
+        self._index = self._load_index()
+
+        self._sweeper = threading.Thread(target=self._sweep_forever, args=(sweep_interval,),
+                                         name='image-store-sweeper', daemon=True)
+        self._sweeper.start()
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def put(self, response):
+        """Store the body of a streamed ``requests`` response and return its file name."""
+        digest = hashlib.md5()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fout:
+                for chunk in response.iter_content(_CHUNK_SIZE):
+                    digest.update(chunk)
+                    fout.write(chunk)
+                    size += len(chunk)
+
+            name = '{}.png'.format(digest.hexdigest())
+            path = os.path.join(self._directory, name)
+            try:
+                # the mtime doubles as the access time seen by other processes
+                os.utime(path)
+            except FileNotFoundError:
+                # not stored yet, or swept by another process just now
+                os.replace(temp_path, path)
+            else:
+                os.remove(temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        finally:
+            response.close()
+
+        self.touch(name, size)
+        return name
+
+    def reuse(self, name):
+        """Record an access of an already stored image, returning False if it is gone."""
+        path = os.path.join(self._directory, name)
+        try:
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return False
+        return self.touch(name, size)
+
+    def touch(self, name, size=None):
+        """Record an access of ``name``, returning False if it is not stored."""
+        with self._lock:
+            entry = self._index.get(name)
+            if entry is None:
+                if size is None:
+                    return False
+                entry = self._index[name] = {'size': size}
+            entry['last_access'] = time.time()
+        return True
+
+    def sweep(self):
+        """Enforce the age and size limits and persist the index."""
+        now = time.time()
+        with self._lock:
+            self._reconcile()
+            expired = {name for name, entry in self._index.items()
+                       if now - entry['last_access'] > self._max_age}
+
+            total = sum(entry['size'] for name, entry in self._index.items() if name not in expired)
+            by_access = sorted((entry['last_access'], name) for name, entry in self._index.items()
+                               if name not in expired)
+            evicted = []
+            for _, name in by_access:
+                if total <= self._max_bytes:
+                    break
+                evicted.append(name)
+                total -= self._index[name]['size']
+
+            for name in expired.union(evicted):
+                del self._index[name]
+                try:
+                    os.remove(os.path.join(self._directory, name))
+                except FileNotFoundError:
+                    pass
+            self._save_index()
+
+        if expired or evicted:
+            logging.info('image store removed %d expired and %d evicted images', len(expired), len(evicted))
+
+    def _sweep_forever(self, interval):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                logging.exception('image store sweep failed')
+            time.sleep(interval)
+
+    def _reconcile(self):
+        # other processes share the directory, so trust the files over the index
+        on_disk = {}
+        for entry in os.scandir(self._directory):
+            try:
+                stat = entry.stat()
+                if entry.name.endswith('.png'):
+                    on_disk[entry.name] = stat
+                elif entry.name.endswith('.tmp') and time.time() - stat.st_mtime > 60 * 60:
+                    # left behind by a download that crashed part way through
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # removed by another process's sweep since the directory was listed
+                continue
+
+        for name in set(self._index) - set(on_disk):
+            del self._index[name]
+        for name, stat in on_disk.items():
+            entry = self._index.setdefault(name, {'size': stat.st_size, 'last_access': stat.st_mtime})
+            entry['last_access'] = max(entry['last_access'], stat.st_mtime)
+
+    def _load_index(self):
+        try:
+            with open(self._index_path) as f_in:
+                return json.load(f_in)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_index(self):
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f_out:
+            json.dump(self._index, f_out)
+        os.replace(temp_path, self._index_path)
@@ -1,36 +1,167 @@
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import json
 import logging
 import os
+import queue
+import random
+import signal
 import sys
+import threading
+import traceback
 
 import click
-import yaml
 
+from .config_snapshot import default_snapshot_path, load_merged
 from .configuration import config
-from .utils import merge_many_dicts
+
+
+_LOG_FORMAT = '%(asctime)s:%(levelname)s\t:%(name)s:%(message)s'
+# attributes every LogRecord has, anything else was passed through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
 
 
 def set_up_logging(level=None):
-    level = level or logging.INFO
-    handlers = [logging.StreamHandler()]
-    log_format = '%(asctime)s:%(levelname)s\t:%(name)s:%(message)s'
-    logging.basicConfig(level=level, handlers=handlers, format=log_format)
+    """
+    Log through a queue so handler I/O happens off the calling thread.
+
+    Records are put on an unbounded queue without being formatted and a
+    ``QueueListener`` thread formats and writes them, as JSON when
+    ``logging.structured`` is set in the config. INFO and DEBUG records that
+    carry a ``route`` extra are sampled at ``logging.sample_rates[route]``.
+    """
+    log_config = config.get('logging', {})
+    level = level or log_config.get('level', logging.INFO)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if log_config.get('structured') else logging.Formatter(_LOG_FORMAT))
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    queue_handler = DeferredQueueHandler(log_queue)
+    if log_config.get('sample_rates'):
+        queue_handler.addFilter(SamplingFilter(log_config['sample_rates']))
+    logging.basicConfig(level=level, handlers=[queue_handler])
+
+
+class DeferredQueueHandler(QueueHandler):
+    """A ``QueueHandler`` that leaves message formatting to the listener thread."""
+
+    def prepare(self, record):
+        if record.exc_info:
+            # tracebacks hold frames, so render them while they're still valid
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip('\n')
+            record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rates):
+        super().__init__()
+        self._sample_rates = sample_rates
+
+    def filter(self, record):
+        rate = self._sample_rates.get(getattr(record, 'route', None))
+        if rate is None or record.levelno > logging.INFO:
+            return True
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
 
 
 def load_configs(env, config_dir=None):
-    config_dir = config_dir or \
-        os.path.join(
-            os.getenv('XDG_CONFIG_HOME', os.path.join(os.getenv('HOME'), '.config')),
-            'fangorn')
+    config_dir = config_dir or _default_config_dir()
 
     try:
-        with open(os.path.join(config_dir, 'default.yaml')) as default_in, \
-                open(os.path.join(config_dir, '{}.yaml'.format(env))) as env_in, \
-                open(os.path.join(config_dir, 'secret.yaml')) as secret_in:
-            default_config = yaml.load(default_in)
-            env_config = yaml.load(env_in)
-            secret_config = yaml.load(secret_in)
+        merged = _read_configs(env, config_dir)
     except FileNotFoundError:
         click.echo('No configuration files found at: {}'.format(config_dir))
         sys.exit(1)
 
-    config.update(merge_many_dicts(default_config, env_config, secret_config))
+    config.update(merged)
+
+
+def _default_config_dir():
+    return os.path.join(
+        os.getenv('XDG_CONFIG_HOME', os.path.join(os.getenv('HOME'), '.config')),
+        'fangorn')
+
+
+def _read_configs(env, config_dir):
+    paths = [os.path.join(config_dir, name) for name in ('default.yaml', '{}.yaml'.format(env), 'secret.yaml')]
+    return load_merged(paths, default_snapshot_path(env, config_dir))
+
+
+_reload_callbacks = []
+_reload_lock = threading.Lock()
+
+
+def on_reload(callback):
+    """Call ``callback()`` after the shared config has been reloaded."""
+    _reload_callbacks.append(callback)
+
+
+def reload_configs(env, config_dir=None):
+    """
+    Re-read the config files and rebuild whatever registered with ``on_reload``.
+
+    The new config is fully loaded before anything changes, so a missing or
+    malformed file leaves the running config alone. Each callback swaps in
+    its own state at once, but the callbacks run one after another, so a
+    request handled mid reload can see the new config in one place and the
+    old one in another. Anything that did not register keeps the config it
+    was built with until a restart.
+    """
+    config_dir = config_dir or _default_config_dir()
+
+    with _reload_lock:
+        try:
+            merged = _read_configs(env, config_dir)
+        except Exception:
+            logging.exception('failed to reload configs from %s, keeping the current ones', config_dir)
+            return False
+
+        config.update(merged)
+        for key in set(config) - set(merged):
+            del config[key]
+
+        for callback in _reload_callbacks:
+            try:
+                callback()
+            except Exception:
+                logging.exception('failed to apply reloaded config to %s', callback)
+        logging.info('reloaded configs from %s', config_dir)
+        return True
+
+
+def reload_on_sighup(env, config_dir=None):
+    """
+    Reload configs when the process receives SIGHUP.
+
+    The reload runs on its own thread rather than inside the signal handler,
+    which could otherwise interrupt the main thread while it holds a lock the
+    reload needs. Only the main thread can install signal handlers, anywhere
+    else this does nothing.
+    """
+    if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+        return
+
+    def handle(signum, frame):
+        threading.Thread(target=reload_configs, args=(env, config_dir), daemon=True).start()
+
+    signal.signal(signal.SIGHUP, handle)
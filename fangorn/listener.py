@@ -0,0 +1,250 @@
+from collections import namedtuple
+import itertools
+import json
+import logging
+import random
+import threading
+
+import requests
+import websocket
+
+from . import outbound
+from .digest import ChannelDigest
+from .matching import Matcher
+
+_API_URL = 'https://slack.com/api'
+_ALERT = '<!channel>: This looks interesting...'
+
+Message = namedtuple('Message', ('text', 'user_name'))
+
+
+class RtmListener:
+    """
+    Route Slack messages read from one real time messaging websocket.
+
+    Each message is checked against the matcher for its author's user or bot
+    name, the same matchers outgoing webhooks use, and a match is posted back
+    over the same websocket. Authors and channel names are resolved through
+    the web API once and cached. Matchers with a ``digest`` coalesce their
+    matches through a ``ChannelDigest`` instead, posted with chat.postMessage
+    since websocket messages can't carry attachments, and whatever is still
+    buffered is posted when ``run`` returns. A quiet connection is pinged
+    every ``ping_interval`` seconds and dropped if Slack stops answering.
+    Dropped connections are reopened after a jittered exponential backoff,
+    up to ``max_backoff`` seconds, that resets once Slack says hello again.
+    Posts Slack had not acknowledged when a connection dropped are sent
+    again on the next one.
+    """
+
+    def __init__(self, token, matchers, api_url=_API_URL, ping_interval=30.0, backoff=1.0, max_backoff=60.0,
+                 timeout=10.0):
+        self._token = token
+        self._matchers = {user_name: Matcher(spec) for user_name, spec in matchers.items()}
+        self._api_url = api_url.rstrip('/')
+        self._ping_interval = ping_interval
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._timeout = timeout
+
+        self._session = outbound.session()
+        self._user_names = {}
+        self._channel_ids = {}
+        self._self_id = None
+        self._greeted = False
+        self._ids = itertools.count(1)
+        self._unacked = {}
+        self._digest = ChannelDigest(self._post_digest, text=_ALERT)
+
+        self._stopping = threading.Event()
+        self._socket = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'connects': 0,
+            'disconnects': 0,
+            'events': 0,
+            'matched': 0,
+            'posted': 0,
+            'digested': 0,
+            'resent': 0,
+            'unroutable': 0
+        }
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, unacked=len(self._unacked))
+
+    def run(self):
+        """Listen until ``stop`` is called, reconnecting whenever the connection drops."""
+        attempt = 0
+        while not self._stopping.is_set():
+            self._greeted = False
+            try:
+                self._listen()
+            except (requests.RequestException, websocket.WebSocketException, OSError, ValueError) as e:
+                if self._stopping.is_set():
+                    break
+                logging.warning('rtm connection lost: %r', e)
+            finally:
+                self._close()
+            # most connections end in an error, so the hello is remembered rather than returned
+            if self._greeted:
+                attempt = 0
+
+            if not self._stopping.is_set():
+                self._count('disconnects')
+                # full jitter keeps a fleet of listeners from reconnecting in lockstep
+                delay = random.uniform(0, min(self._max_backoff, self._backoff * 2 ** attempt))
+                attempt += 1
+                logging.info('reconnecting to rtm in %.1fs', delay)
+                self._stopping.wait(delay)
+        self._digest.close()
+
+    def stop(self):
+        """Close the connection and make ``run`` return. Safe to call from a signal handler."""
+        self._stopping.set()
+        with self._lock:
+            socket = self._socket
+        if socket is not None:
+            socket.abort()
+
+    def _listen(self):
+        """Hold one connection open until it drops or Slack asks for a reconnect."""
+        url = self._api('rtm.connect')['url']
+        socket = websocket.create_connection(url, timeout=self._timeout)
+        with self._lock:
+            self._socket = socket
+        if self._stopping.is_set():
+            return
+        self._count('connects')
+        socket.settimeout(self._ping_interval)
+
+        awaiting_pong = False
+        while not self._stopping.is_set():
+            try:
+                raw = socket.recv()
+            except websocket.WebSocketTimeoutException:
+                if awaiting_pong:
+                    raise websocket.WebSocketTimeoutException('no pong within {}s'.format(self._ping_interval))
+                socket.send(json.dumps({'id': next(self._ids), 'type': 'ping'}))
+                awaiting_pong = True
+                continue
+            if not raw:
+                raise websocket.WebSocketConnectionClosedException('closed by slack')
+            awaiting_pong = False
+
+            event = json.loads(raw)
+            event_type = event.get('type')
+            if event_type == 'hello':
+                self._greeted = True
+                logging.info('rtm connected')
+                self._resend(socket)
+            elif event_type == 'goodbye':
+                logging.info('slack asked rtm to reconnect')
+                break
+            elif event_type == 'message':
+                self._count('events')
+                try:
+                    self._route(socket, event)
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    # a failed lookup costs this one message, not the connection
+                    self._count('unroutable')
+                    logging.error('could not route message in %s: %r', event.get('channel'), e)
+            elif 'reply_to' in event:
+                with self._lock:
+                    self._unacked.pop(event['reply_to'], None)
+                if not event.get('ok', True):
+                    logging.error('slack rejected rtm message %s: %s', event['reply_to'], event.get('error'))
+
+    def _route(self, socket, event):
+        # edits, joins and the like carry a subtype, bot posts are the one kind still worth matching
+        if event.get('subtype') not in (None, 'bot_message') or event.get('user') == self._self_id:
+            return
+
+        user_name = event.get('username') or self._user_name(event.get('user'))
+        matcher = self._matchers.get(user_name)
+        if matcher is None:
+            return
+
+        fired = matcher(Message(event.get('text', ''), user_name))
+        if not fired:
+            return
+        logging.info('matched %s on: %s', user_name, ', '.join(sorted(fired)))
+        self._count('matched')
+
+        channel = self._channel_id(matcher.channel)
+        if channel is None:
+            self._count('unroutable')
+            logging.error('no channel named %s to post matches for %s in', matcher.channel, user_name)
+            return
+        if matcher.digest:
+            if self._digest.add(channel, {'text': event.get('text', '')}, **matcher.digest):
+                self._count('digested')
+            return
+        quoted = '\n'.join('>' + line for line in event.get('text', '').splitlines())
+        self._send(socket, {'type': 'message', 'channel': channel, 'text': '{}\n{}'.format(_ALERT, quoted)})
+
+    def _send(self, socket, message):
+        message = dict(message, id=next(self._ids))
+        with self._lock:
+            self._unacked[message['id']] = message
+        socket.send(json.dumps(message))
+        self._count('posted')
+
+    def _resend(self, socket):
+        with self._lock:
+            pending, self._unacked = list(self._unacked.values()), {}
+        for message in pending:
+            self._count('resent')
+            self._send(socket, message)
+
+    def _post_digest(self, channel, text, attachments, as_user):
+        try:
+            self._api('chat.postMessage', channel=channel, text=text, attachments=json.dumps(attachments),
+                      as_user=json.dumps(as_user))
+        except (requests.RequestException, ValueError) as e:
+            logging.error('could not post digest to %s: %r', channel, e)
+            return False
+        return True
+
+    def _user_name(self, user_id):
+        if user_id is None:
+            return None
+        if user_id not in self._user_names:
+            self._user_names[user_id] = self._api('users.info', user=user_id)['user']['name']
+        return self._user_names[user_id]
+
+    def _channel_id(self, channel):
+        if not channel.startswith('#'):
+            return channel
+        if channel not in self._channel_ids:
+            cursor = None
+            while True:
+                page = self._api('conversations.list', types='public_channel,private_channel',
+                                 exclude_archived='true', limit=200, cursor=cursor)
+                self._channel_ids.update(('#' + c['name'], c['id']) for c in page['channels'])
+                cursor = page.get('response_metadata', {}).get('next_cursor')
+                if channel in self._channel_ids or not cursor:
+                    break
+        return self._channel_ids.get(channel)
+
+    def _api(self, method, **params):
+        response = self._session.post('{}/{}'.format(self._api_url, method), timeout=self._timeout,
+                                      data=dict(params, token=self._token))
+        response.raise_for_status()
+        body = response.json()
+        if not body.get('ok'):
+            raise ValueError('slack {} failed: {}'.format(method, body.get('error')))
+        if method == 'rtm.connect':
+            self._self_id = body.get('self', {}).get('id')
+        return body
+
+    def _close(self):
+        with self._lock:
+            socket, self._socket = self._socket, None
+        if socket is not None:
+            socket.close()
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
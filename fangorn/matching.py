@@ -0,0 +1,82 @@
+import re
+
+_DIGEST_LIMITS = frozenset(('max_delay', 'max_batch'))
+
+
+class Matcher:
+    """
+    Match message text against a user's include and exclude terms.
+
+    All terms are compiled into one alternation per list when the matcher is
+    built, so each message is scanned once for every exclude term and once for
+    every include term rather than once per term. Terms are matched verbatim
+    against the lowercased message text. An optional ``digest`` in the spec
+    holds the ``max_delay`` and ``max_batch`` for coalescing matches, and
+    anything else in it is rejected up front rather than on the first match.
+    """
+
+    def __init__(self, spec):
+        self._output_channel = spec['output_channel']
+        self._digest = spec.get('digest')
+        if self._digest is not None and (not isinstance(self._digest, dict) or set(self._digest) - _DIGEST_LIMITS):
+            raise ValueError('digest for {} takes max_delay and max_batch, got {!r}'.format(
+                self._output_channel, self._digest))
+        self._text_contains = _compile_terms(spec['text_contains'], overlapping=True)
+        self._unmatches = _compile_terms(spec['unmatch'])
+
+    def __call__(self, data):
+        """Return the set of include terms found, empty if unmatched or excluded."""
+        lowered = data.text.lower()
+        if self._text_contains is None:
+            return frozenset()
+        if self._text_contains.search(lowered) is None:
+            return frozenset()
+        if self._unmatches is not None and self._unmatches.search(lowered):
+            return frozenset()
+        return frozenset(self._text_contains.findall(lowered))
+
+    @property
+    def channel(self):
+        return self._output_channel
+
+    @property
+    def digest(self):
+        return self._digest
+
+
+def _compile_terms(terms, overlapping=False):
+    if not terms:
+        return None
+
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    pattern = _trie_pattern(trie)
+    if overlapping:
+        # a zero-width lookahead reports a term at every offset, not just
+        # after the end of the previous match
+        return re.compile('(?=({}))'.format(pattern))
+    return re.compile(pattern)
+
+
+def _trie_pattern(node):
+    """
+    Render a term trie as a regular expression.
+
+    Shared prefixes are factored out so the regex engine only follows the
+    branches that agree with the text so far, and longer terms are tried
+    before the terms that are their prefixes.
+    """
+    branches = [re.escape(char) + _trie_pattern(child)
+                for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+
+    pattern = branches[0] if len(branches) == 1 else '(?:{})'.format('|'.join(branches))
+    if '' in node:
+        pattern = '(?:{})?'.format(pattern)
+    return pattern
@@ -1,42 +1,68 @@
 from .configuration import config
+from .digest import ChannelDigest
+from .matching import Matcher
+from .slack_delivery import SlackDeliveryQueue
+from .utils import LazyFormat, format_pairs
+from .validation import Validator, matches_token, string
 from collections import namedtuple
+import atexit
 import falcon
 import logging
 import marshmallow
-import slackclient
 
 
 class SlackMessageRouter:
     def __init__(self):
-        self._slack = slackclient.SlackClient(config['slack']['bot_user']['token'])
-
+        self._slack = SlackDeliveryQueue(config['slack']['bot_user']['token'],
+                                         **config['slack']['delivery'])
+        atexit.register(self._slack.close, timeout=10)
+        self._digest = ChannelDigest(self._slack.post_message)
+        # registered after the queue, so it runs first and the queue delivers what it flushes
+        atexit.register(self._digest.close)
+        self.reload()
+
+    def reload(self):
+        """Rebuild the validator and matchers, and pick up the bot token, from the current config."""
         webhook = config['slack']['outgoing_webhook']
-        self._schema = WebhookDataSchema(webhook['token'],
-                                         set(webhook['matchers'].keys()))
-        self._matchers = {user_name: Matcher(spec) for
-                          user_name, spec in webhook['matchers'].items()}
+        schema = WebhookDataValidator(webhook['token'],
+                                      set(webhook['matchers'].keys()))
+        matchers = {user_name: Matcher(spec) for
+                    user_name, spec in webhook['matchers'].items()}
+        # swapped as one attribute so a request never sees a mix of old and new
+        self._routing = (schema, matchers)
+        self._slack.reload(config['slack']['bot_user']['token'])
 
     def on_post(self, req, resp):
-        h = '\n'.join('\t{}: {}'.format(k, v) for k, v in req.headers.items())
-        p = '\n'.join('\t{}: {}'.format(k, v) for k, v in req.params.items())
-        logging.info('\nheaders: \n%s\nparams: \n%s', h, p)
+        schema, matchers = self._routing
+        log_extra = {'route': req.path}
+        logging.info('\nheaders: \n%s\nparams: \n%s',
+                     LazyFormat(format_pairs, req.headers), LazyFormat(format_pairs, req.params),
+                     extra=log_extra)
 
-        data, err = self._schema.load(req.params)
+        data, err = schema.load(req.params)
         if err:
-            logging.info('%s %s', data, err)
+            logging.info('%s %s', data, err, extra=log_extra)
             logging.info('valid user names %s',
-                         ' '.join(self._matchers.keys()))
+                         LazyFormat(' '.join, matchers.keys()), extra=log_extra)
             resp.status = falcon.HTTP_400
             return
 
-        matcher = self._matchers[data.user_name]
-        if matcher(data):
-            self._slack.api_call(
-                'chat.postMessage',
-                channel=matcher.channel,
-                text='<!channel>: This looks interesting...',
-                attachments=[{'text': data.text}],
-                as_user=True)
+        matcher = matchers[data.user_name]
+        fired = matcher(data)
+        if fired:
+            logging.info('matched %s on: %s', data.user_name, LazyFormat(', '.join, sorted(fired)),
+                         extra=log_extra)
+            if matcher.digest:
+                queued = self._digest.add(matcher.channel, {'text': data.text}, **matcher.digest)
+            else:
+                queued = self._slack.post_message(
+                    channel=matcher.channel,
+                    text='<!channel>: This looks interesting...',
+                    attachments=[{'text': data.text}],
+                    as_user=True)
+            if not queued:
+                resp.status = falcon.HTTP_503
+                return
 
         resp.status = falcon.HTTP_200
 
@@ -57,34 +83,47 @@ class WebhookDataSchema(marshmallow.Schema):
 
     @marshmallow.validates_schema
     def _matches_user_name_or_bot_name(self, data):
-        if data.get('user_name') not in self._user_names and \
-                data.get('bot_name') not in self._user_names:
-            raise marshmallow.ValidationError('invalid user/bot name')
+        _matches_user_name_or_bot_name(data, self._user_names)
 
     @marshmallow.validates('token')
     def _matches_token(self, value):
-        if value != self._token:
+        if not matches_token(value, self._token):
             raise marshmallow.ValidationError('invalid token')
 
     @marshmallow.post_load
     def _post_load(self, data):
-        if 'bot_name' in data:
-            data['user_name'] = data['bot_name']
-            del data['bot_name']
-        return WebhookData(**data)
-
-
-class Matcher:
-    def __init__(self, spec):
-        self._text_contains = spec['text_contains']
-        self._output_channel = spec['output_channel']
-        self._unmatches = spec['unmatch']
-
-    def __call__(self, data):
-        lowered = data.text.lower()
-        return any(t in lowered for t in self._text_contains) \
-            and all(u not in lowered for u in self._unmatches)
-
-    @property
-    def channel(self):
-        return self._output_channel
+        return _webhook_data(data)
+
+
+class WebhookDataValidator(Validator):
+    """Fast equivalent of ``WebhookDataSchema(...).load``."""
+
+    fields = (
+        ('token', True, string),
+        ('text', True, string),
+        ('user_name', True, string),
+        ('bot_name', False, string)
+    )
+
+    def __init__(self, webhook_token, user_names):
+        super().__init__(webhook_token)
+        self._user_names = user_names
+
+    def _validate(self, data):
+        _matches_user_name_or_bot_name(data, self._user_names)
+
+    def build(self, token, text, user_name, bot_name=None):
+        return WebhookData(token, text, user_name if bot_name is None else bot_name)
+
+
+def _matches_user_name_or_bot_name(data, user_names):
+    if data.get('user_name') not in user_names and \
+            data.get('bot_name') not in user_names:
+        raise marshmallow.ValidationError('invalid user/bot name')
+
+
+def _webhook_data(data):
+    if 'bot_name' in data:
+        data['user_name'] = data['bot_name']
+        del data['bot_name']
+    return WebhookData(**data)
@@ -0,0 +1,202 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import atexit
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+_DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+_metrics = []
+_lock = threading.Lock()
+_directory = None
+
+
+def counter(name, documentation, label_names=()):
+    return _register(Counter(name, documentation, label_names))
+
+
+def histogram(name, documentation, label_names=(), buckets=_DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, label_names, buckets))
+
+
+def _register(metric):
+    _metrics.append(metric)
+    return metric
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with _lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    def samples(self, snapshots):
+        totals = {}
+        for snapshot in snapshots:
+            for labels, value in snapshot:
+                totals[tuple(labels)] = totals.get(tuple(labels), 0) + value
+
+        for labels, value in sorted(totals.items()):
+            yield self.name, self._labels(labels), value
+
+    def _labels(self, labels, **extra):
+        pairs = list(zip(self.label_names, labels)) + list(extra.items())
+        return ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"')) for k, v in pairs)
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names, buckets):
+        super().__init__(name, documentation, label_names)
+        self._buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with _lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # one count per bucket plus +Inf, then the running sum
+                counts = self._values[labels] = [0] * (len(self._buckets) + 1) + [0.0]
+            counts[bisect_left(self._buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self, snapshots):
+        totals = {}
+        for snapshot in snapshots:
+            for labels, counts in snapshot:
+                total = totals.setdefault(tuple(labels), [0] * len(counts))
+                for i, count in enumerate(counts):
+                    total[i] += count
+
+        for labels, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self._buckets + ('+Inf',), counts):
+                cumulative += count
+                yield self.name + '_bucket', self._labels(labels, le=bound), cumulative
+            yield self.name + '_sum', self._labels(labels), counts[-1]
+            yield self.name + '_count', self._labels(labels), cumulative
+
+
+def configure(directory=None, flush_interval=5):
+    """
+    Share metrics between worker processes through ``directory``.
+
+    Each process periodically writes its own metrics to a file named after
+    its pid and the ``/metrics`` endpoint sums every file it finds, so the
+    directory should be emptied when the service is redeployed. Without a
+    directory only the serving process's metrics are reported. Only the
+    first call with a directory takes effect, so rebuilding the app doesn't
+    start another flush thread.
+    """
+    global _directory
+    if directory is None:
+        return
+    if _directory is not None:
+        if os.path.expanduser(directory) != _directory:
+            logging.warning('metrics already shared through %s, ignoring %s', _directory, directory)
+        return
+
+    _directory = os.path.expanduser(directory)
+    os.makedirs(_directory, exist_ok=True)
+
+    def flush_forever():
+        while True:
+            time.sleep(flush_interval)
+            try:
+                _flush()
+            except Exception:
+                logging.exception('failed to write metrics')
+
+    threading.Thread(target=flush_forever, name='metrics-flush', daemon=True).start()
+    atexit.register(_flush)
+
+
+def _flush():
+    snapshot = {metric.name: metric.snapshot() for metric in _metrics}
+    fd, temp_path = tempfile.mkstemp(dir=_directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f_out:
+        json.dump(snapshot, f_out)
+    os.replace(temp_path, os.path.join(_directory, '{}.json'.format(os.getpid())))
+
+
+def render():
+    """Render every metric in the Prometheus text exposition format."""
+    snapshots = [{metric.name: metric.snapshot() for metric in _metrics}]
+    if _directory is not None:
+        own = os.path.join(_directory, '{}.json'.format(os.getpid()))
+        for path in glob.glob(os.path.join(_directory, '*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f_in:
+                    snapshots.append(json.load(f_in))
+            except (OSError, ValueError):
+                logging.warning('skipping unreadable metrics file %s', path)
+
+    lines = []
+    for metric in _metrics:
+        lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for name, labels, value in metric.samples(s.get(metric.name, []) for s in snapshots):
+            lines.append('{}{{{}}} {}'.format(name, labels, value) if labels else '{} {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+REQUESTS = counter('fangorn_http_requests_total', 'HTTP requests handled.', ('route', 'method', 'status'))
+REQUEST_LATENCY = histogram('fangorn_http_request_duration_seconds', 'HTTP request latency.', ('route', 'method'))
+OUTBOUND_LATENCY = histogram('fangorn_outbound_duration_seconds', 'Outbound call latency.', ('target',))
+OUTBOUND_REQUESTS = counter('fangorn_outbound_requests_total', 'Outbound HTTP requests sent.', ('host',))
+OUTBOUND_CONNECTIONS = counter('fangorn_outbound_connections_total', 'Outbound connections opened.', ('host',))
+OUTBOUND_RETRIES = counter('fangorn_outbound_retries_total', 'Outbound retries, by whether the budget allowed them.',
+                           ('host', 'result'))
+DUPLICATE_DELIVERIES = counter('fangorn_duplicate_deliveries_total',
+                               'Repeated Slack deliveries, by how they were answered.', ('route', 'result'))
+
+
+class MetricsMiddleware:
+    def process_request(self, req, resp):
+        req.context['metrics_start'] = time.perf_counter()
+
+    def process_response(self, req, resp, resource, req_succeeded=True):
+        start = req.context.get('metrics_start')
+        if start is None:
+            return
+
+        # unrouted paths share one label so scanners can't blow up cardinality
+        route = req.path if resource is not None else '<unmatched>'
+        REQUEST_LATENCY.observe(time.perf_counter() - start, route, req.method)
+        REQUESTS.inc(route, req.method, resp.status.split(' ', 1)[0])
+
+
+class MetricsResource:
+    def on_get(self, req, resp):
+        # imported here so the CLI can time outbound calls without loading falcon
+        import falcon
+
+        resp.content_type = 'text/plain; version=0.0.4'
+        resp.body = render()
+        resp.status = falcon.HTTP_200
@@ -0,0 +1,110 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import logging
+import threading
+import time
+
+import requests
+
+Target = namedtuple('Target', ('url', 'interval', 'timeout', 'failures_before_down', 'successes_before_up'))
+Probe = namedtuple('Probe', ('ok', 'latency', 'detail'))
+
+
+def target_from_config(spec, interval=15, timeout=5, failures_before_down=2, successes_before_up=2):
+    return Target(
+        url=spec['url'],
+        interval=spec.get('interval', interval),
+        timeout=spec.get('timeout', timeout),
+        failures_before_down=spec.get('failures_before_down', failures_before_down),
+        successes_before_up=spec.get('successes_before_up', successes_before_up))
+
+
+class UptimeMonitor:
+    """
+    Probe many URLs concurrently, each on its own interval and timeout.
+
+    Probes are dispatched from one timer loop onto a thread pool, and a
+    target never has more than one probe in flight. ``notify(target, up,
+    probe)`` is called only when a target changes state: after
+    ``failures_before_down`` consecutive failures it is marked down, and
+    after ``successes_before_up`` consecutive successes it is marked up
+    again, so a flapping target doesn't alert on every poll.
+    """
+
+    def __init__(self, targets, notify, max_workers=None):
+        self._targets = list(targets)
+        self._notify = notify
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or len(self._targets))
+
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=len(self._targets))
+        self._session = requests.Session()
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._up = [True] * len(self._targets)
+        self._streaks = [0] * len(self._targets)
+        self._in_flight = [False] * len(self._targets)
+
+    def run(self, duration=None):
+        """Probe until ``duration`` seconds have passed, or forever."""
+        start = time.monotonic()
+        due = [(start, i) for i in range(len(self._targets))]
+        heapq.heapify(due)
+
+        try:
+            while duration is None or time.monotonic() - start < duration:
+                when, i = due[0]
+                now = time.monotonic()
+                if when > now:
+                    time.sleep(min(when - now, 1))
+                    continue
+
+                heapq.heapreplace(due, (when + self._targets[i].interval, i))
+                with self._lock:
+                    if self._in_flight[i]:
+                        logging.warning('skipping probe of %s, the previous one is still running',
+                                        self._targets[i].url)
+                        continue
+                    self._in_flight[i] = True
+                self._executor.submit(self._probe_and_record, i)
+        finally:
+            self._executor.shutdown(wait=True)
+            self._session.close()
+
+    def _probe_and_record(self, i):
+        target = self._targets[i]
+        try:
+            probe = self._probe(target)
+        except Exception as e:
+            probe = Probe(False, None, repr(e))
+        logging.info('probed %s: ok=%s latency=%s %s', target.url, probe.ok, probe.latency, probe.detail)
+
+        with self._lock:
+            self._in_flight[i] = False
+            up = self._up[i]
+            # the streak counts consecutive results that disagree with the current state
+            self._streaks[i] = self._streaks[i] + 1 if probe.ok != up else 0
+            threshold = target.failures_before_down if up else target.successes_before_up
+            changed = self._streaks[i] >= threshold
+            if changed:
+                self._up[i] = not up
+                self._streaks[i] = 0
+
+        if changed:
+            self._notify(target, not up, probe)
+
+    def _probe(self, target):
+        start = time.perf_counter()
+        try:
+            response = self._session.get(target.url, timeout=target.timeout)
+        except requests.Timeout:
+            return Probe(False, None, 'timed out after {}s'.format(target.timeout))
+        except requests.RequestException as e:
+            return Probe(False, None, str(e))
+        latency = time.perf_counter() - start
+
+        if response.status_code >= 400:
+            return Probe(False, latency, 'Status Code: {}'.format(response.status_code))
+        return Probe(True, latency, 'Status Code: {}'.format(response.status_code))
@@ -0,0 +1,205 @@
+from urllib.parse import urlsplit
+import logging
+import random
+import threading
+import time
+
+import requests
+import urllib3
+
+from .configuration import config
+from .metrics import OUTBOUND_CONNECTIONS, OUTBOUND_REQUESTS, OUTBOUND_RETRIES
+
+_IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+_RETRY_STATUSES = frozenset((502, 503, 504))
+
+_session = None
+_budgets = {}
+_settings = {}
+_lock = threading.Lock()
+
+
+def session():
+    """
+    The ``requests.Session`` every outbound integration shares.
+
+    It is built from the ``http`` config on first use. Each host listed under
+    ``http.hosts`` gets its own connection pool sized for it, and every other
+    host shares the default one. Requests without an explicit timeout get the
+    configured connect and read timeouts, and failures that are safe to
+    repeat are retried while the host's retry budget allows.
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session(**config.get('http', {}))
+    return _session
+
+
+def _build_session(pool_maxsize=10, connect_timeout=3.05, read_timeout=10, max_retries=2, backoff=0.1,
+                   retry_budget=None, hosts=None):
+    _settings.update(retry_budget or {})
+    defaults = {
+        'pool_maxsize': pool_maxsize,
+        'connect_timeout': connect_timeout,
+        'read_timeout': read_timeout,
+        'max_retries': max_retries,
+        'backoff': backoff
+    }
+
+    new_session = requests.Session()
+    default_adapter = PooledAdapter(**defaults)
+    new_session.mount('https://', default_adapter)
+    new_session.mount('http://', default_adapter)
+    for host, overrides in (hosts or {}).items():
+        adapter = PooledAdapter(**dict(defaults, **overrides))
+        # the longest matching prefix wins, so these take precedence over the defaults
+        new_session.mount('https://{}/'.format(host), adapter)
+        new_session.mount('http://{}/'.format(host), adapter)
+    return new_session
+
+
+def may_retry(url):
+    """Spend one retry from the budget of ``url``'s host, returning False if it is used up."""
+    host = urlsplit(url).hostname
+    if _budget(host).withdraw():
+        OUTBOUND_RETRIES.inc(host, 'retried')
+        return True
+    OUTBOUND_RETRIES.inc(host, 'budget_exhausted')
+    logging.warning('retry budget for %s is exhausted, not retrying', host)
+    return False
+
+
+def stats():
+    """Requests, new connections, reuse and retries per host since the process started."""
+    per_host = {}
+
+    def entry(host):
+        return per_host.setdefault(host, {
+            'requests': 0, 'connections': 0, 'retried': 0, 'budget_exhausted': 0
+        })
+
+    for (host,), count in OUTBOUND_REQUESTS.snapshot():
+        entry(host)['requests'] += count
+    for (host,), count in OUTBOUND_CONNECTIONS.snapshot():
+        entry(host)['connections'] += count
+    for (host, result), count in OUTBOUND_RETRIES.snapshot():
+        entry(host)[result] += count
+
+    for host_stats in per_host.values():
+        host_stats['reused'] = max(0, host_stats['requests'] - host_stats['connections'])
+    return per_host
+
+
+def _budget(host):
+    budget = _budgets.get(host)
+    if budget is None:
+        with _lock:
+            budget = _budgets.setdefault(host, RetryBudget(**_settings))
+    return budget
+
+
+class RetryBudget:
+    """
+    Limit retries to a fraction of recent requests.
+
+    Every request deposits ``ratio`` of a retry and every retry withdraws a
+    whole one. ``min_per_second`` more trickle in over time, so a quiet host
+    can still be retried, and at most ``burst`` retries can be saved up. When
+    a host is failing outright this caps the extra load retries add to it at
+    roughly ``ratio``.
+    """
+
+    def __init__(self, ratio=0.1, min_per_second=1.0, burst=10):
+        self._ratio = ratio
+        self._min_per_second = min_per_second
+        self._burst = burst
+        self._balance = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._balance = min(self._burst, self._balance + self._ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill()
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+    def _refill(self):
+        now = time.monotonic()
+        self._balance = min(self._burst, self._balance + (now - self._updated) * self._min_per_second)
+        self._updated = now
+
+
+class PooledAdapter(requests.adapters.HTTPAdapter):
+    """
+    An ``HTTPAdapter`` with default timeouts, budgeted retries and reuse counts.
+
+    A request is only repeated when that is safe: when the connection could
+    not be made, so nothing was sent, or when an idempotent request got a 502,
+    503 or 504.
+    """
+
+    def __init__(self, pool_maxsize=10, connect_timeout=3.05, read_timeout=10, max_retries=2, backoff=0.1):
+        self._timeout = (connect_timeout, read_timeout)
+        self._retries = max_retries
+        self._backoff = backoff
+        super().__init__(pool_maxsize=pool_maxsize)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        host = urlsplit(request.url).hostname
+        timeout = self._timeout if timeout is None else timeout
+
+        _budget(host).deposit()
+        attempt = 0
+        while True:
+            OUTBOUND_REQUESTS.inc(host)
+            try:
+                response = super().send(request, timeout=timeout, **kwargs)
+            except requests.ConnectionError as e:
+                if attempt >= self._retries or not self._retryable(request, e) or not may_retry(request.url):
+                    raise
+                logging.info('retrying %s %s after %s', request.method, host, e)
+            else:
+                if attempt >= self._retries or request.method not in _IDEMPOTENT_METHODS or \
+                        response.status_code not in _RETRY_STATUSES or not may_retry(request.url):
+                    return response
+                logging.info('retrying %s %s after HTTP %d', request.method, host, response.status_code)
+                response.close()
+
+            time.sleep(random.uniform(0, self._backoff * 2 ** attempt))
+            attempt += 1
+
+    @staticmethod
+    def _retryable(request, error):
+        if request.method in _IDEMPOTENT_METHODS or isinstance(error, requests.ConnectTimeout):
+            return True
+        # requests wraps urllib3's MaxRetryError, whose reason says whether a connection was ever made
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class _CountingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    def _new_conn(self):
+        OUTBOUND_CONNECTIONS.inc(self.host)
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    def _new_conn(self):
+        OUTBOUND_CONNECTIONS.inc(self.host)
+        return super()._new_conn()
@@ -0,0 +1,186 @@
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, timezone
+from itertools import accumulate
+import fcntl
+import gzip
+import json
+import logging
+import os
+
+_BLOCK_RECORDS = 100
+_TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+
+
+class TinnitusIndex:
+    """
+    Sidecar block index over a JSON lines tinnitus record file.
+
+    Each line of the ``.idx`` file describes one contiguous block of records
+    by byte offset, length and the earliest and latest ``recorded_time`` in
+    it. Record times are UTC ISO 8601 strings, which sort chronologically as
+    plain strings. The record store appends an entry per batch it writes, and
+    any tail of the record file that is not yet indexed is indexed the next
+    time it is read. A ``compressed`` file is read from its ``.gz`` sibling
+    using offsets into the uncompressed data.
+    """
+
+    def __init__(self, record_file_path, compressed=False):
+        self._path = record_file_path
+        self._index_path = record_file_path + '.idx'
+        self._compressed = compressed
+
+    def append(self, offset, lines, times):
+        """Record a block written at ``offset``; the caller holds the file lock."""
+        indexed_end = self._indexed_end()
+        if indexed_end < offset:
+            self._index_range(indexed_end, offset)
+        return self._write_block(offset, lines, times)
+
+    def sync(self):
+        """Index any unindexed tail and return every block; the caller holds the file lock."""
+        self._index_range(self._indexed_end())
+        return self._load()
+
+    def records(self, start=None, end=None):
+        """Yield the records recorded between ``start`` and ``end`` inclusive."""
+        blocks = self._blocks()
+        if not blocks:
+            return
+
+        # records are only roughly ordered across worker processes, so search
+        # on the running maximum, which is sorted
+        latest = list(accumulate((b['last'] for b in blocks), max))
+        first = bisect_left(latest, start) if start is not None else 0
+
+        opener = (lambda: gzip.open(self._path + '.gz', 'rb')) if self._compressed else \
+            (lambda: open(self._path, 'rb'))
+        with opener() as f_in:
+            for block in blocks[first:]:
+                if end is not None and block['first'] > end:
+                    continue
+                f_in.seek(block['offset'])
+                for line in f_in.read(block['length']).splitlines():
+                    record = _parse(line)
+                    if record is None:
+                        continue
+                    recorded = record['recorded_time']
+                    if (start is None or recorded >= start) and (end is None or recorded <= end):
+                        yield record
+
+    def _blocks(self):
+        if self._compressed:
+            return self._load()
+
+        try:
+            size = os.path.getsize(self._path)
+        except FileNotFoundError:
+            return []
+
+        if size > self._indexed_end():
+            with open(self._path, 'a') as f_data:
+                fcntl.flock(f_data, fcntl.LOCK_EX)
+                try:
+                    self._index_range(self._indexed_end())
+                finally:
+                    fcntl.flock(f_data, fcntl.LOCK_UN)
+        return self._load()
+
+    def _load(self):
+        try:
+            with open(self._index_path) as f_in:
+                return [json.loads(line) for line in f_in if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _indexed_end(self):
+        try:
+            with open(self._index_path, 'rb') as f_in:
+                f_in.seek(0, os.SEEK_END)
+                f_in.seek(max(0, f_in.tell() - 4096))
+                lines = f_in.read().splitlines()
+        except FileNotFoundError:
+            return 0
+        if not lines:
+            return 0
+        block = json.loads(lines[-1].decode())
+        return block['offset'] + block['length']
+
+    def _index_range(self, offset, end=None):
+        """Index whole records from ``offset`` up to ``end`` or the end of the file."""
+        lines, times = [], []
+        with open(self._path, 'rb') as f_data:
+            f_data.seek(offset)
+            position = offset
+            for line in f_data:
+                if not line.endswith(b'\n') or (end is not None and position >= end):
+                    # stop short of a record that is still being written
+                    break
+                lines.append(line)
+                record = _parse(line)
+                if record is not None:
+                    times.append(record['recorded_time'])
+                position += len(line)
+                if len(lines) == _BLOCK_RECORDS:
+                    offset += self._write_block(offset, lines, times)['length']
+                    lines, times = [], []
+        if lines:
+            self._write_block(offset, lines, times)
+
+    def _write_block(self, offset, lines, times):
+        block = {
+            'offset': offset,
+            'length': sum(len(l) for l in lines),
+            'first': min(times, default=''),
+            'last': max(times, default='')
+        }
+        with open(self._index_path, 'a') as f_out:
+            f_out.write(json.dumps(block) + '\n')
+        return block
+
+
+def _parse(line):
+    try:
+        return json.loads(line.decode())
+    except ValueError:
+        # a record torn by a crash mid write
+        logging.warning('skipping unreadable tinnitus record %r', line[:80])
+        return None
+
+
+def record_time(value):
+    """Convert a datetime or time string, naive meaning UTC, to the stored form."""
+    if isinstance(value, str):
+        for time_format in _TIME_FORMATS:
+            try:
+                value = datetime.strptime(value, time_format)
+                break
+            except ValueError:
+                pass
+        else:
+            raise ValueError('{} is not a valid time'.format(value))
+
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def daily_averages(records):
+    """Average decibels and audibility per UTC day and ear."""
+    totals = defaultdict(lambda: [0, 0, 0])
+    for record in records:
+        total = totals[(record['recorded_time'][:10], record['ear'])]
+        total[0] += 1
+        total[1] += record['decibels']
+        total[2] += record['audibility']
+
+    return [
+        {
+            'date': date,
+            'ear': ear,
+            'count': count,
+            'average_decibels': decibels / count,
+            'average_audibility': audibility / count
+        }
+        for (date, ear), (count, decibels, audibility) in sorted(totals.items())
+    ]
@@ -0,0 +1,249 @@
+from contextlib import contextmanager
+from itertools import groupby
+from os.path import expanduser
+import fcntl
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from .record_index import TinnitusIndex
+
+_MANIFEST_NAME = 'manifest.json'
+_MIGRATION_BATCH = 1000
+
+
+class SegmentedRecordStore:
+    """
+    Tinnitus records stored as a directory of JSON lines segments.
+
+    Records are appended to the newest segment until it passes
+    ``max_segment_bytes`` or a record from a later month arrives, at which
+    point it is closed, optionally gzipped, and a new segment is started.
+    ``manifest.json`` lists the segments in order with the time bounds of the
+    closed ones so readers can skip them, and each segment has its own block
+    index. Appends and rollovers are serialized across processes with an
+    advisory lock on ``<path>.lock``. Every file other than the open segment
+    is replaced atomically, so a crash loses at most a torn final record.
+
+    A single record file left at ``path`` by older versions is migrated into
+    segments the first time the store is opened.
+    """
+
+    def __init__(self, path, max_segment_bytes=16 * 1024 * 1024, compress=True, fsync=True):
+        self._path = expanduser(path)
+        self._lock_path = self._path + '.lock'
+        self._manifest_path = os.path.join(self._path, _MANIFEST_NAME)
+        self._max_segment_bytes = max_segment_bytes
+        self._compress = compress
+        self._fsync = fsync
+        self._active_name = None
+        self._active_file = None
+
+        self._migrate_if_needed()
+
+    def append(self, lines, times):
+        """Append ``lines`` whose ``recorded_time`` values are ``times``."""
+        with self._locked():
+            self._append(lines, times)
+
+    def close(self):
+        if self._active_file is not None:
+            self._active_file.close()
+            self._active_file = self._active_name = None
+
+    def _append(self, lines, times):
+        manifest = _load_manifest(self._manifest_path)
+        for month, group in groupby(zip(lines, times), key=lambda line_time: line_time[1][:7]):
+            group_lines, group_times = zip(*group)
+            segment = self._segment_for(manifest, month)
+
+            f_out = self._open(segment['name'])
+            fcntl.flock(f_out, fcntl.LOCK_EX)
+            try:
+                offset = os.fstat(f_out.fileno()).st_size
+                f_out.write(''.join(group_lines))
+                f_out.flush()
+                if self._fsync:
+                    os.fsync(f_out.fileno())
+                TinnitusIndex(self._segment_path(segment)).append(offset, group_lines, group_times)
+            finally:
+                fcntl.flock(f_out, fcntl.LOCK_UN)
+
+    def _segment_for(self, manifest, month):
+        segments = manifest['segments']
+        active = segments[-1] if segments else None
+        if active is not None:
+            try:
+                full = os.path.getsize(self._segment_path(active)) >= self._max_segment_bytes
+            except FileNotFoundError:
+                full = False
+            # late records from an earlier month stay in the newer segment
+            if not full and month <= active['month']:
+                return active
+            self._close_segment(manifest, active)
+
+        segment = {
+            'name': '{}-{:04d}.jsonl'.format(month, len(segments)),
+            'month': month,
+            'first': None,
+            'last': None,
+            'closed': False,
+            'compressed': False
+        }
+        segments.append(segment)
+        _save_manifest(self._manifest_path, manifest)
+        return segment
+
+    def _close_segment(self, manifest, segment):
+        path = self._segment_path(segment)
+        with open(path, 'ab') as f_data:
+            fcntl.flock(f_data, fcntl.LOCK_EX)
+            try:
+                blocks = TinnitusIndex(path).sync()
+                if self._compress:
+                    _gzip(path)
+            finally:
+                fcntl.flock(f_data, fcntl.LOCK_UN)
+
+        times = [b['first'] for b in blocks if b['first']] + [b['last'] for b in blocks if b['last']]
+        segment.update(
+            first=min(times, default=None),
+            last=max(times, default=None),
+            closed=True,
+            compressed=self._compress)
+
+        # the manifest switches readers to the compressed copy before the
+        # original goes away
+        _save_manifest(self._manifest_path, manifest)
+        if self._compress:
+            os.remove(path)
+        if self._active_name == segment['name']:
+            self.close()
+
+    def _open(self, name):
+        if self._active_name != name:
+            self.close()
+            path = os.path.join(self._path, name)
+            with open(path, 'ab+') as f_check:
+                if f_check.tell() > 0:
+                    f_check.seek(-1, os.SEEK_END)
+                    if f_check.read(1) != b'\n':
+                        # seal a record torn by a crash so the next one starts clean
+                        f_check.write(b'\n')
+            self._active_file = open(path, 'a')
+            self._active_name = name
+        return self._active_file
+
+    def _segment_path(self, segment):
+        return os.path.join(self._path, segment['name'])
+
+    def _migrate_if_needed(self):
+        migrating = self._path + '.migrating'
+        if os.path.isdir(self._path) and not os.path.exists(migrating):
+            return
+
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with self._locked():
+            if os.path.isfile(self._path):
+                os.replace(self._path, migrating)
+
+            if os.path.exists(migrating):
+                logging.info('migrating tinnitus records from %s into segments', migrating)
+                # start over if an earlier migration was interrupted
+                shutil.rmtree(self._path, ignore_errors=True)
+                os.makedirs(self._path)
+                _save_manifest(self._manifest_path, {'segments': []})
+
+                with open(migrating) as f_in:
+                    lines, times = [], []
+                    for line in f_in:
+                        try:
+                            times.append(json.loads(line)['recorded_time'])
+                        except ValueError:
+                            continue
+                        lines.append(line if line.endswith('\n') else line + '\n')
+                        if len(lines) == _MIGRATION_BATCH:
+                            self._append(lines, times)
+                            lines, times = [], []
+                    if lines:
+                        self._append(lines, times)
+
+                os.remove(migrating)
+                for leftover in (migrating + '.idx', self._path + '.idx'):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+            else:
+                os.makedirs(self._path, exist_ok=True)
+                if not os.path.exists(self._manifest_path):
+                    _save_manifest(self._manifest_path, {'segments': []})
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def query_records(store_path, ear=None, start=None, end=None, min_decibels=None, max_decibels=None):
+    """Yield records matching every filter given; times are UTC ISO 8601 strings."""
+    for record in _records(expanduser(store_path), start, end):
+        if ear is not None and record['ear'] != ear:
+            continue
+        if min_decibels is not None and record['decibels'] < min_decibels:
+            continue
+        if max_decibels is not None and record['decibels'] > max_decibels:
+            continue
+        yield record
+
+
+def _records(store_path, start, end):
+    for segment in _load_manifest(os.path.join(store_path, _MANIFEST_NAME))['segments']:
+        if segment['closed']:
+            if start is not None and segment['last'] is not None and segment['last'] < start:
+                continue
+            if end is not None and segment['first'] is not None and segment['first'] > end:
+                continue
+
+        path = os.path.join(store_path, segment['name'])
+        # the segment may have been compressed since the manifest was read
+        compressed = segment['compressed'] or not os.path.exists(path)
+        yield from TinnitusIndex(path, compressed=compressed).records(start, end)
+
+
+def _load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f_in:
+            return json.load(f_in)
+    except FileNotFoundError:
+        return {'segments': []}
+
+
+def _save_manifest(manifest_path, manifest):
+    _atomic_write(manifest_path, lambda f_out: f_out.write(json.dumps(manifest, indent=2).encode()))
+
+
+def _gzip(path):
+    def compress(f_out):
+        with open(path, 'rb') as f_in, gzip.GzipFile(fileobj=f_out, mode='wb') as f_gzip:
+            shutil.copyfileobj(f_in, f_gzip)
+    _atomic_write(path + '.gz', compress)
+
+
+def _atomic_write(path, write):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f_out:
+            write(f_out)
+            f_out.flush()
+            os.fsync(f_out.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
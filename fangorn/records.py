@@ -1,16 +1,34 @@
 from .configuration import config
+from .record_index import daily_averages, record_time
+from .record_store import SegmentedRecordStore, query_records
+from .validation import Validator, matches_token, string, url
 from collections import namedtuple
 from datetime import datetime, timezone
 from os.path import expanduser
+import atexit
 import falcon
 import json
+import logging
 import marshmallow
+import threading
+import time
 
 
 class TinnitusRecorder:
     def __init__(self):
-        self._schema = SlashCommandDataSchema(config['slack']['tinnitus_command']['token'])
-        self._record_writer = TinnitusWriter(config['records']['tinnitus']['path'])
+        self.reload()
+        tinnitus_config = config['records']['tinnitus']
+        self._path = expanduser(tinnitus_config['path'])
+        self._record_writer = TinnitusWriter(
+            SegmentedRecordStore(tinnitus_config['path'], **tinnitus_config['segments']),
+            **tinnitus_config['writer'])
+        atexit.register(self._record_writer.close)
+
+    def reload(self):
+        """Pick up the current command token."""
+        token = config['slack']['tinnitus_command']['token']
+        self._schema = SlashCommandDataValidator(token)
+        self._token = token
 
     def on_post(self, req, resp):
         data, err = self._schema.load(req.params)
@@ -28,7 +46,15 @@ class TinnitusRecorder:
             return
 
         record = {**data.text, **{'recorded_time': datetime.now(timezone.utc).isoformat()}}
-        self._record_writer.write_record(record)
+        try:
+            self._record_writer.write_record(record)
+        except OSError:
+            resp.body = json.dumps({
+                'text': 'could not write the record, please try again',
+                'response_type': 'ephemeral'
+            })
+            resp.status = falcon.HTTP_OK
+            return
 
         resp.body = json.dumps({
             'text': 'record successfuly written\near: {ear}\naudibility: {audibility}\ndecibels: {decibels}'.format(**data.text),
@@ -36,6 +62,33 @@ class TinnitusRecorder:
         })
         resp.status = falcon.HTTP_OK
 
+    def on_get(self, req, resp):
+        # sent as a bearer token, since query strings end up in access logs
+        scheme, _, token = (req.get_header('Authorization') or '').partition(' ')
+        if scheme.lower() != 'bearer' or not matches_token(token.strip(), self._token):
+            resp.status = falcon.HTTP_403
+            return
+
+        try:
+            since, until = (record_time(req.get_param(p)) if req.has_param(p) else None
+                            for p in ('since', 'until'))
+        except ValueError as e:
+            raise falcon.HTTPBadRequest('Invalid time', str(e))
+
+        records = query_records(
+            self._path,
+            ear=req.get_param('ear'),
+            start=since,
+            end=until,
+            min_decibels=req.get_param_as_int('min_decibels'),
+            max_decibels=req.get_param_as_int('max_decibels'))
+
+        if req.get_param_as_bool('daily'):
+            resp.body = json.dumps({'daily_averages': daily_averages(records)})
+        else:
+            resp.body = json.dumps({'records': list(records)})
+        resp.status = falcon.HTTP_OK
+
 
 CommandData = namedtuple('CommandData', ('text', 'command', 'response_url', 'token'))
 
@@ -52,56 +105,171 @@ class SlashCommandDataSchema(marshmallow.Schema):
 
     @marshmallow.validates('token')
     def _matches_token(self, value):
-        if value != self._token:
+        if not matches_token(value, self._token):
             raise marshmallow.ValidationError('invalid token')
 
     def _parse_text(self, text):
-        text = text.strip()
+        return _parse_text(text)
 
-        if len(text) < 3 or len(text) > 5:
-            raise marshmallow.ValidationError('text must be 4 to 6 characters')
+    @marshmallow.post_load
+    def _post_load(self, data):
+        return CommandData(**data)
 
-        i = iter(text)
-        ear = next(i).lower()
-        audibility = next(i)
-        decibels = ''.join(i)
 
-        errors = []
-        if ear != 'l' and ear != 'r':
-            errors.append('l or r are the only valid ear choices.')
+class SlashCommandDataValidator(Validator):
+    """Fast equivalent of ``SlashCommandDataSchema(...).load``."""
 
-        try:
-            audibility = int(audibility)
-            if audibility < 0 or audibility > 2:
-                errors.append('audibility must be between 0 and 2.')
-        except ValueError:
-            errors.append('audibility must be an integer.')
+    def _text(self, value):
+        return _parse_text(string(self, value))
 
-        try:
-            decibels = int(decibels)
-            if decibels < 0 or decibels > 200:
-                errors.append('decibels must be between 0 and 200.')
-        except ValueError:
-            errors.append('decibels must be an integer.')
+    fields = (
+        ('command', True, string),
+        ('token', True, string),
+        ('text', True, _text),
+        ('response_url', True, url)
+    )
+    build = CommandData
 
-        if errors:
-            raise marshmallow.ValidationError(' '.join(errors))
 
-        return {
-            'ear': ear,
-            'audibility': audibility,
-            'decibels': decibels
-        }
+def _parse_text(text):
+    text = text.strip()
 
-    @marshmallow.post_load
-    def _post_load(self, data):
-        return CommandData(**data)
+    if len(text) < 3 or len(text) > 5:
+        raise marshmallow.ValidationError('text must be 4 to 6 characters')
+
+    i = iter(text)
+    ear = next(i).lower()
+    audibility = next(i)
+    decibels = ''.join(i)
+
+    errors = []
+    if ear != 'l' and ear != 'r':
+        errors.append('l or r are the only valid ear choices.')
+
+    try:
+        audibility = int(audibility)
+        if audibility < 0 or audibility > 2:
+            errors.append('audibility must be between 0 and 2.')
+    except ValueError:
+        errors.append('audibility must be an integer.')
+
+    try:
+        decibels = int(decibels)
+        if decibels < 0 or decibels > 200:
+            errors.append('decibels must be between 0 and 200.')
+    except ValueError:
+        errors.append('decibels must be an integer.')
+
+    if errors:
+        raise marshmallow.ValidationError(' '.join(errors))
+
+    return {
+        'ear': ear,
+        'audibility': audibility,
+        'decibels': decibels
+    }
 
 
 class TinnitusWriter:
-    def __init__(self, record_file_path):
-        self._path = expanduser(record_file_path)
+    """
+    Append JSON line records to a record store in batches.
+
+    Records are buffered in memory and handed to the store together once
+    ``max_records`` are waiting or ``max_delay`` seconds after the first of
+    them arrived. The store serializes appends across processes and fsyncs
+    them if configured to. With ``wait_for_flush`` set, ``write_record`` only
+    returns once its batch has been written, so concurrent callers share one
+    write and one fsync, and raises ``OSError`` if the batch could not be
+    written. Without it a failed batch is only logged.
+    """
+
+    def __init__(self, store, max_records=100, max_delay=0.05, wait_for_flush=True):
+        self._store = store
+        self._max_records = max_records
+        self._max_delay = max_delay
+        self._wait_for_flush = wait_for_flush
+
+        self._io_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._batch = _Batch()
+        self._closed = False
+
+        self._flusher = threading.Thread(target=self._flush_periodically, name='tinnitus-writer', daemon=True)
+        self._flusher.start()
 
     def write_record(self, record):
-        with open(self._path, 'a') as f_out:
-            f_out.write(json.dumps(record) + '\n')
+        line = json.dumps(record) + '\n'
+        with self._cond:
+            if self._closed:
+                raise ValueError('write to closed TinnitusWriter')
+            batch = self._batch
+            batch.lines.append(line)
+            batch.times.append(record['recorded_time'])
+            full = len(batch.lines) >= self._max_records
+            self._cond.notify_all()
+
+        if full:
+            self.flush()
+
+        if self._wait_for_flush:
+            with self._cond:
+                while not batch.done:
+                    self._cond.wait()
+            if batch.error is not None:
+                raise OSError('tinnitus record was not written: {!r}'.format(batch.error)) from batch.error
+
+    def flush(self):
+        with self._io_lock:
+            with self._cond:
+                batch, self._batch = self._batch, _Batch()
+
+            if batch.lines:
+                try:
+                    self._store.append(batch.lines, batch.times)
+                except Exception as e:
+                    # waiters get the error, the batch itself is lost
+                    logging.exception('could not write %d tinnitus records', len(batch.lines))
+                    batch.error = e
+
+            with self._cond:
+                batch.done = True
+                self._cond.notify_all()
+
+    def close(self):
+        """Write out anything still buffered and close the file."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        self.flush()
+        self._store.close()
+
+    def _flush_periodically(self):
+        while True:
+            with self._cond:
+                while not self._batch.lines and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+
+                deadline = time.monotonic() + self._max_delay
+                while self._batch.lines and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+            try:
+                self.flush()
+            except Exception:
+                logging.exception('error flushing tinnitus records')
+
+
+class _Batch:
+    def __init__(self):
+        self.lines = []
+        self.times = []
+        self.done = False
+        self.error = None
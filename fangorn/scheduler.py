@@ -0,0 +1,154 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+
+_STATE_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+Job = namedtuple('Job', ('name', 'times', 'days', 'origin', 'destinations', 'channel'))
+
+
+def job_from_config(spec, location_aliases):
+    times = []
+    for at in spec['at']:
+        hour, minute = (int(part) for part in str(at).split(':'))
+        times.append(datetime.time(hour, minute))
+
+    return Job(
+        name=spec.get('name', '{} to {}'.format(spec['origin'], spec['destination'])),
+        times=sorted(times),
+        days=frozenset(spec.get('days', range(7))),
+        origin=location_aliases.get(spec['origin'], spec['origin']),
+        destinations=[location_aliases.get(d, d) for d in _as_list(spec['destination'])],
+        channel=spec['channel'])
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def next_run(job, after):
+    """The first time after ``after`` that ``job`` is scheduled for."""
+    for day_offset in range(8):
+        day = after.date() + datetime.timedelta(days=day_offset)
+        if day.weekday() not in job.days:
+            continue
+        for at in job.times:
+            candidate = datetime.datetime.combine(day, at)
+            if candidate > after:
+                return candidate
+    raise ValueError('{} has no scheduled days'.format(job.name))
+
+
+def default_state_path():
+    state_home = os.getenv('XDG_STATE_HOME') or os.path.expanduser('~/.local/state')
+    return os.path.join(state_home, 'fangorn', 'scheduler.json')
+
+
+def post_traffic(mapper, slack, channel, origin, destinations):
+    slack_message = mapper.traffic_message(origin, destinations)
+    slack.api_call(
+        'chat.postMessage',
+        channel=channel,
+        as_user=True,
+        **slack_message)
+
+
+class TrafficScheduler:
+    """
+    Run recurring traffic posts from a single timer loop.
+
+    Jobs are kept in a priority queue ordered by their next run time and run
+    on a pool of ``max_concurrency`` threads that share one mapper and one
+    Slack client. Times are in the host's local time zone. A run that is
+    noticed less than ``catch_up`` seconds late, for instance after the
+    daemon restarts, still happens; later than that it is skipped. Either
+    way a job runs at most once for any number of missed times.
+
+    Each job's last completed run is kept in a JSON file at ``state_path``,
+    so a restart only catches up on times after it and never posts a run
+    twice.
+    """
+
+    def __init__(self, jobs, mapper, slack, max_concurrency=2, catch_up=600, state_path=None):
+        self._jobs = list(jobs)
+        self._mapper = mapper
+        self._slack = slack
+        self._catch_up = datetime.timedelta(seconds=catch_up)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._stopped = threading.Event()
+        self._state_path = state_path or default_state_path()
+        self._state_lock = threading.Lock()
+        self._last_runs = self._load_state()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self, now=datetime.datetime.now):
+        counter = itertools.count()
+        start = now() - self._catch_up
+        queue = [(next_run(job, max(start, self._last_runs.get(job.name, start))), next(counter), job)
+                 for job in self._jobs]
+        heapq.heapify(queue)
+
+        try:
+            while queue and not self._stopped.is_set():
+                run_at, _, job = queue[0]
+                wait = (run_at - now()).total_seconds()
+                if wait > 0:
+                    # wake at least once a minute so clock changes are noticed
+                    self._stopped.wait(min(wait, 60))
+                    continue
+
+                current = now()
+                if current - run_at > self._catch_up:
+                    logging.warning('skipping %s scheduled for %s, it is too late to catch up', job.name, run_at)
+                else:
+                    logging.info('running %s scheduled for %s', job.name, run_at)
+                    self._executor.submit(self._run_job, job, run_at)
+                heapq.heapreplace(queue, (next_run(job, max(run_at, current)), next(counter), job))
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def _run_job(self, job, run_at):
+        try:
+            post_traffic(self._mapper, self._slack, job.channel, job.origin, job.destinations)
+        except Exception:
+            logging.exception('traffic job %s failed', job.name)
+            return
+        self._record_run(job, run_at)
+
+    def _record_run(self, job, run_at):
+        with self._state_lock:
+            # runs of one job can finish out of order, keep the latest
+            self._last_runs[job.name] = max(run_at, self._last_runs.get(job.name, run_at))
+            state = {name: at.strftime(_STATE_TIME_FORMAT) for name, at in self._last_runs.items()}
+            try:
+                os.makedirs(os.path.dirname(self._state_path), exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self._state_path), suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as f_out:
+                        json.dump(state, f_out)
+                    os.replace(temp_path, self._state_path)
+                except BaseException:
+                    os.unlink(temp_path)
+                    raise
+            except OSError:
+                logging.exception('could not save scheduler state to %s', self._state_path)
+
+    def _load_state(self):
+        try:
+            with open(self._state_path) as f_in:
+                state = json.load(f_in)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            logging.warning('ignoring unreadable scheduler state in %s', self._state_path)
+            return {}
+        return {name: datetime.datetime.strptime(at, _STATE_TIME_FORMAT) for name, at in state.items()}
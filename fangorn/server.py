@@ -2,10 +2,13 @@ from falcon_cors import CORS
 import falcon
 
 from . import init
+from . import metrics
 from .configuration import config
 from .healthcheck import HealthCheck
+from .idempotency import DeliveryCache, IdempotencyMiddleware
 from .message_router import SlackMessageRouter
 from .records import TinnitusRecorder
+from .signing import SlackRequestMiddleware
 from .traffic import TrafficPoster
 
 
@@ -13,19 +16,38 @@ def get_app(env, config_dir=None):
     init.load_configs(env, config_dir)
     init.set_up_logging()
     app = _build_app()
+    init.reload_on_sighup(env, config_dir)
     return app
 
 
-def _build_app():
+def _build_app(traffic_responder=None):
     cors = CORS(**config['cors'])
-
-    app = falcon.API(middleware=[cors.middleware])
-
-    app.req_options.auto_parse_form_urlencoded = True
-
-    app.add_route('/api/messagerouter', SlackMessageRouter())
-    app.add_route('/api/traffic', TrafficPoster())
-    app.add_route('/api/records/tinnitus', TinnitusRecorder())
+    metrics.configure(config['metrics'].get('directory'), config['metrics']['flush_interval'])
+
+    dedup = config['slack']['dedup']
+    # a verified repeat gets the first response from the dedup cache rather than a replay error
+    signing = SlackRequestMiddleware(reject_replays=not dedup['enabled'], **config['slack']['signing'])
+    middleware = [metrics.MetricsMiddleware(), cors.middleware, signing]
+    if dedup['enabled']:
+        cache = DeliveryCache(dedup.get('directory'), dedup['window'], dedup['max_entries'],
+                              dedup['pending_timeout'], dedup['sweep_interval'])
+        middleware.append(IdempotencyMiddleware(cache, dedup['paths'], dedup['in_flight_wait']))
+    app = falcon.API(middleware=middleware)
+
+    # slash command text may contain commas, don't split it into a list
+    app.req_options.auto_parse_qs_csv = False
+
+    router, traffic, tinnitus = SlackMessageRouter(), TrafficPoster(traffic_responder), TinnitusRecorder()
+    app.add_route('/api/messagerouter', router)
+    app.add_route('/api/traffic', traffic)
+    app.add_route('/api/records/tinnitus', tinnitus)
     app.add_route('/healthcheck', HealthCheck())
+    app.add_route('/metrics', metrics.MetricsResource())
+
+    # matchers, location aliases, tokens and the signing secret can change without a restart. The
+    # google, http, dedup, delivery, deferred and records settings are read once, so they need one
+    init.on_reload(lambda: signing.reload(**config['slack']['signing']))
+    for resource in (router, traffic, tinnitus):
+        init.on_reload(resource.reload)
 
     return app
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+import hashlib
+import hmac
+import logging
+import threading
+import time
+
+import falcon
+from falcon.uri import parse_query_string
+
+_VERSION = 'v0'
+
+
+class SlackRequestMiddleware:
+    """
+    Verify Slack request signatures and parse form bodies.
+
+    Form encoded bodies are read here rather than by falcon so that the raw
+    bytes are available for verification. POSTs to ``paths`` must carry a
+    valid ``X-Slack-Signature`` over the body and a ``X-Slack-Request-Timestamp``
+    within ``max_age`` seconds, and a signature already seen inside that
+    window is rejected as a replay. Rejected requests never reach form
+    parsing or the resource. Without a ``secret`` nothing is verified.
+
+    With ``reject_replays`` off, replays are only marked with
+    ``req.context['slack_replay']`` and left for later middleware to answer.
+    """
+
+    def __init__(self, secret=None, paths=(), max_age=300, replay_cache_size=10000, reject_replays=True):
+        self.reload(secret)
+        self._paths = frozenset(paths)
+        self._reject_replays = reject_replays
+        self._max_age = max_age
+        self._seen = ReplayCache(max_age, replay_cache_size)
+
+        if self._secret is None and self._paths:
+            logging.warning('no slack signing secret configured, requests are not being verified')
+
+    def reload(self, secret=None, **unused):
+        self._secret = secret.encode() if secret else None
+
+    def process_request(self, req, resp):
+        if req.content_type is None or 'application/x-www-form-urlencoded' not in req.content_type:
+            return
+
+        body = req.stream.read(req.content_length or 0)
+        secret = self._secret
+        if secret is not None and req.method == 'POST' and req.path in self._paths:
+            self._verify(req, body, secret)
+
+        try:
+            body = body.decode('ascii')
+        except UnicodeDecodeError:
+            raise falcon.HTTPBadRequest(title='Invalid form body', description='Form bodies must be ASCII.')
+
+        req.params.update(parse_query_string(
+            body,
+            req.options.keep_blank_qs_values,
+            getattr(req.options, 'auto_parse_qs_csv', False)))
+
+    def _verify(self, req, body, secret):
+        timestamp = req.get_header('X-Slack-Request-Timestamp')
+        signature = req.get_header('X-Slack-Signature')
+        if timestamp is None or signature is None:
+            raise falcon.HTTPUnauthorized(title='Unsigned request')
+
+        try:
+            age = abs(time.time() - int(timestamp))
+        except ValueError:
+            age = None
+        if age is None or age > self._max_age:
+            raise falcon.HTTPUnauthorized(title='Stale request')
+
+        base = b':'.join((_VERSION.encode(), timestamp.encode(), body))
+        expected = '{}={}'.format(_VERSION, hmac.new(secret, base, hashlib.sha256).hexdigest())
+        if not hmac.compare_digest(expected.encode(), signature.encode()):
+            raise falcon.HTTPUnauthorized(title='Invalid signature')
+
+        if not self._seen.add(signature):
+            if self._reject_replays:
+                raise falcon.HTTPUnauthorized(title='Replayed request')
+            req.context['slack_replay'] = True
+        req.context['slack_verified'] = True
+
+
+class ReplayCache:
+    """Remember keys for ``window`` seconds, keeping at most ``max_size`` of them."""
+
+    def __init__(self, window, max_size):
+        self._window = window
+        self._max_size = max_size
+        self._expiries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        """Remember ``key``, returning False if it was already seen."""
+        now = time.monotonic()
+        with self._lock:
+            # keys are inserted in time order, so expired ones are at the front
+            while self._expiries:
+                oldest, expiry = next(iter(self._expiries.items()))
+                if expiry > now:
+                    break
+                del self._expiries[oldest]
+
+            if key in self._expiries:
+                return False
+
+            self._expiries[key] = now + self._window
+            if len(self._expiries) > self._max_size:
+                self._expiries.popitem(last=False)
+            return True
@@ -0,0 +1,165 @@
+import logging
+import queue
+import random
+import threading
+import time
+
+import requests
+
+from . import outbound
+from .metrics import OUTBOUND_LATENCY
+
+_POST_MESSAGE_URL = 'https://slack.com/api/chat.postMessage'
+_STOP = object()
+
+
+class SlackDeliveryQueue:
+    """
+    Post Slack messages from a bounded queue drained by background workers.
+
+    Callers enqueue ``chat.postMessage`` arguments and return immediately.
+    Workers post through the shared outbound session, retry connection errors
+    and 5xx responses with jittered exponential backoff while Slack's retry
+    budget allows, and honour Slack's ``Retry-After`` header when rate
+    limited.
+    """
+
+    def __init__(self, token, queue_depth=100, workers=4, max_retries=3,
+                 backoff=1.0, timeout=10.0, url=_POST_MESSAGE_URL):
+        self._url = url
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._backoff = backoff
+
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._closed = False
+
+        self._session = outbound.session()
+        self.reload(token)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'delivered': 0,
+            'failed': 0,
+            'retried': 0,
+            'rate_limited': 0,
+            'max_depth': 0
+        }
+
+        self._workers = [threading.Thread(target=self._work, name='slack-delivery-{}'.format(i), daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def post_message(self, **message):
+        """Enqueue a message, returning False if the queue is full or closed."""
+        if self._closed:
+            self._count('dropped')
+            logging.warning('slack delivery queue closed, dropping message for %s', message.get('channel'))
+            return False
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self._count('dropped')
+            logging.warning('slack delivery queue full, dropping message for %s', message.get('channel'))
+            return False
+
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._queue.qsize())
+        return True
+
+    def reload(self, token):
+        """Post with ``token`` from now on, including messages already queued."""
+        self._headers = {'Authorization': 'Bearer {}'.format(token)}
+
+    @property
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['depth'] = self._queue.qsize()
+        stats['capacity'] = self._queue.maxsize
+        return stats
+
+    def close(self, timeout=None):
+        """Deliver everything already queued, then stop the workers, waiting at most ``timeout`` seconds."""
+        self._closed = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            for _ in self._workers:
+                # a full queue only makes room as fast as slack answers
+                self._queue.put(_STOP, timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+        except queue.Full:
+            logging.warning('slack delivery queue still full after %ss, abandoning %d messages',
+                            timeout, self._queue.qsize())
+            return
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+    def _work(self):
+        while True:
+            message = self._queue.get()
+            try:
+                if message is _STOP:
+                    return
+                self._deliver(message)
+            except Exception:
+                self._count('failed')
+                logging.exception('unexpected error delivering slack message')
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, message):
+        delay = 0
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                if delay is None:
+                    break
+                self._count('retried')
+                time.sleep(delay)
+
+            try:
+                with OUTBOUND_LATENCY.time('slack_post_message'):
+                    response = self._session.post(self._url, json=message, headers=self._headers,
+                                                  timeout=self._timeout)
+            except requests.RequestException as e:
+                logging.warning('slack delivery attempt %d failed: %s', attempt + 1, e)
+                delay = self._backoff_delay(attempt) if outbound.may_retry(self._url) else None
+                continue
+
+            if response.status_code == 429:
+                self._count('rate_limited')
+                delay = self._retry_after(response, attempt)
+                continue
+
+            if response.status_code >= 500:
+                logging.warning('slack delivery attempt %d failed: HTTP %d', attempt + 1, response.status_code)
+                delay = self._backoff_delay(attempt) if outbound.may_retry(self._url) else None
+                continue
+
+            body = response.json() if response.ok else {}
+            if body.get('ok'):
+                self._count('delivered')
+                return
+
+            logging.error('slack rejected message for %s: %s',
+                          message.get('channel'), body.get('error', response.status_code))
+            break
+
+        self._count('failed')
+
+    def _retry_after(self, response, attempt):
+        try:
+            return float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return self._backoff_delay(attempt)
+
+    def _backoff_delay(self, attempt):
+        # full jitter keeps workers from retrying in lockstep
+        return random.uniform(0, self._backoff * 2 ** attempt)
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self._stats[stat] += 1
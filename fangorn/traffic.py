@@ -5,15 +5,31 @@ import falcon
 import marshmallow
 
 from .configuration import config
+from .deferred import DeferredResponder
+from .geocode import location_index
 from .google_maps_wrapper import TrafficMapper
+from .utils import split_destinations
+from .validation import Validator, matches_token, string, url
 
 
 class TrafficPoster:
-    def __init__(self):
-        self._schema = SlashCommandDataSchema(config['slack']['traffic_command']['token'],
-                                              config['google']['location_aliases'])
+    def __init__(self, responder=None):
+        command_config = config['slack']['traffic_command']
+        self.reload()
         self._mapper = TrafficMapper()
 
+        deferred = command_config['deferred']
+        self._responder = responder
+        if responder is None and deferred['enabled']:
+            self._responder = DeferredResponder(
+                workers=deferred['workers'],
+                backlog=deferred['backlog'],
+                job_timeout=deferred['job_timeout'])
+
+    def reload(self):
+        """Rebuild the validator with the current token and location aliases."""
+        self._schema = SlashCommandDataValidator(config['slack']['traffic_command']['token'], location_index())
+
     def on_post(self, req, resp):
         data, err = self._schema.load(req.params)
         if err:
@@ -22,15 +38,28 @@ class TrafficPoster:
             return
 
         origin = data.text['from']
-        destination = data.text['to']
-        duration, distance, image_name = self._mapper.get_map(origin, destination)
-
-        slack_message = self._mapper.as_slack_message(
-            origin, destination, duration, distance, image_name)
-        slack_message.update(response_type='in_channel')
-        resp.body = json.dumps(slack_message)
+        destinations = data.text['to']
+        note = _assumed_note(data.text['assumed'])
+
+        if self._responder is None:
+            resp.body = json.dumps(self._traffic_message(origin, destinations, note))
+        elif self._responder.submit(data.response_url, self._traffic_message, origin, destinations, note):
+            resp.body = json.dumps({
+                'text': 'Working on traffic from {} to {}...{}'.format(origin, ', '.join(destinations), note),
+                'response_type': 'ephemeral'
+            })
+        else:
+            resp.body = json.dumps({
+                'text': 'Too many traffic requests right now, please try again shortly.',
+                'response_type': 'ephemeral'
+            })
         resp.status = falcon.HTTP_200
 
+    def _traffic_message(self, origin, destinations, note=''):
+        slack_message = self._mapper.traffic_message(origin, destinations)
+        slack_message.update(text=slack_message['text'] + note, response_type='in_channel')
+        return slack_message
+
 
 CommandData = namedtuple('CommandData', ('text', 'command', 'response_url', 'token'))
 
@@ -48,34 +77,69 @@ class SlashCommandDataSchema(marshmallow.Schema):
 
     @marshmallow.validates('token')
     def _matches_token(self, value):
-        if value != self._token:
+        if not matches_token(value, self._token):
             raise marshmallow.ValidationError('invalid token')
 
     def _parse_text(self, text):
-        tokens = text.strip().split()
-        from_index, to_index = None, None
-        for index, token in enumerate(tokens):
-            if token == 'from:' and from_index is None:
-                from_index = index
-            elif token == 'to:' and to_index is None:
-                to_index = index
-            if from_index is not None and to_index is not None:
-                break
-
-        if from_index is None or to_index is None:
-            raise marshmallow.ValidationError('"{}" is an invalid command'.format(text))
-
-        from_location = ' '.join(tokens[from_index + 1:len(tokens) if from_index > to_index else to_index])
-        to_location = ' '.join(tokens[to_index + 1:len(tokens) if to_index > from_index else from_index])
-
-        if not from_location or not to_location:
-            raise marshmallow.ValidationError('"{}" is an invalid command'.format(text))
-
-        return {
-            'from': self._locations[from_location] if from_location in self._locations else from_location,
-            'to': self._locations[to_location] if to_location in self._locations else to_location
-        }
+        return _parse_text(text, self._locations)
 
     @marshmallow.post_load
     def _post_load(self, data):
         return CommandData(**data)
+
+
+class SlashCommandDataValidator(Validator):
+    """Fast equivalent of ``SlashCommandDataSchema(...).load``."""
+
+    def __init__(self, command_token, location_aliases):
+        super().__init__(command_token)
+        self._locations = location_aliases
+
+    def _text(self, value):
+        return _parse_text(string(self, value), self._locations)
+
+    fields = (
+        ('command', True, string),
+        ('token', True, string),
+        ('text', True, _text),
+        ('response_url', True, url)
+    )
+    build = CommandData
+
+
+def _parse_text(text, locations):
+    tokens = text.strip().split()
+    from_index, to_index = None, None
+    for index, token in enumerate(tokens):
+        if token == 'from:' and from_index is None:
+            from_index = index
+        elif token == 'to:' and to_index is None:
+            to_index = index
+        if from_index is not None and to_index is not None:
+            break
+
+    if from_index is None or to_index is None:
+        raise marshmallow.ValidationError('"{}" is an invalid command'.format(text))
+
+    from_location = ' '.join(tokens[from_index + 1:len(tokens) if from_index > to_index else to_index])
+    to_location = ' '.join(tokens[to_index + 1:len(tokens) if to_index > from_index else from_index])
+
+    if not from_location or not to_location:
+        raise marshmallow.ValidationError('"{}" is an invalid command'.format(text))
+
+    # "to: ;" is not empty text, but it names no destination
+    destinations = split_destinations(to_location, locations)
+    if not destinations:
+        raise marshmallow.ValidationError('"{}" is an invalid command'.format(text))
+
+    return {
+        'from': locations[from_location] if from_location in locations else from_location,
+        'to': [locations[d] if d in locations else d for d in destinations],
+        # typos that were taken for an alias, so the reply can say so
+        'assumed': [(typed, locations.assumed(typed)) for typed in [from_location] + destinations
+                    if locations.assumed(typed) is not None]
+    }
+
+
+def _assumed_note(assumed):
+    return ''.join(' (taking "{}" to mean "{}")'.format(typed, alias) for typed, alias in assumed)
@@ -20,6 +20,40 @@ def merge_dicts(a, b):
     return a
 
 
+class LazyFormat:
+    """Defer an expensive log argument until the record is actually formatted."""
+
+    def __init__(self, fn, *args):
+        self._fn = fn
+        self._args = args
+
+    def __str__(self):
+        return self._fn(*self._args)
+
+
+def format_pairs(mapping):
+    return '\n'.join('\t{}: {}'.format(k, v) for k, v in mapping.items())
+
+
+def split_destinations(text, locations):
+    """
+    Split a list of destinations.
+
+    Semicolons always separate destinations. Commas only do when every part
+    is a location alias, since a plain address contains commas itself.
+    """
+    destinations = []
+    for part in (p.strip() for p in text.split(';')):
+        if not part:
+            continue
+        aliases = [a.strip() for a in part.split(',')]
+        if len(aliases) > 1 and all(a in locations for a in aliases):
+            destinations.extend(aliases)
+        else:
+            destinations.append(part)
+    return destinations
+
+
 path_type = click.Path(file_okay=False, exists=True, resolve_path=True)
 
 
@@ -0,0 +1,76 @@
+import hmac
+
+import marshmallow
+
+MISSING = 'Missing data for required field.'
+INVALID_STRING = 'Not a valid string.'
+INVALID_TOKEN = 'invalid token'
+
+_url = marshmallow.validate.URL(relative=False)
+
+
+class Validator:
+    """
+    Precompiled stand-in for a marshmallow schema's ``load``.
+
+    Subclasses list their fields as ``(name, required, deserialize)`` tuples,
+    where ``deserialize`` takes the raw value and raises
+    ``marshmallow.ValidationError`` on bad input, and set ``build`` to what
+    makes the loaded object from the fields as keyword arguments, a plain
+    ``dict`` unless overridden. ``load`` returns the same
+    ``(data, errors)`` pair the schema would: the constructed object and an
+    empty dict on success, otherwise the fields that did deserialize and a
+    dict of error message lists keyed by field, or ``_schema`` for errors
+    from ``_validate``.
+    """
+
+    fields = ()
+    build = dict
+
+    def __init__(self, token):
+        self._token = token.encode()
+
+    def load(self, params):
+        data, errors = {}, {}
+        for name, required, deserialize in self.fields:
+            if name not in params:
+                if required:
+                    errors[name] = [MISSING]
+                continue
+            try:
+                data[name] = deserialize(self, params[name])
+            except marshmallow.ValidationError as e:
+                errors[name] = e.messages if isinstance(e.messages, list) else [e.messages]
+
+        if 'token' in data and not hmac.compare_digest(data['token'].encode(), self._token):
+            del data['token']
+            errors['token'] = [INVALID_TOKEN]
+
+        try:
+            self._validate(data)
+        except marshmallow.ValidationError as e:
+            errors['_schema'] = e.messages if isinstance(e.messages, list) else [e.messages]
+
+        if errors:
+            return data, errors
+        return self.build(**data), {}
+
+    def _validate(self, data):
+        pass
+
+
+def string(validator, value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if not isinstance(value, str):
+        raise marshmallow.ValidationError(INVALID_STRING)
+    return value
+
+
+def url(validator, value):
+    return _url(string(validator, value))
+
+
+def matches_token(value, token):
+    """Compare a request token in constant time."""
+    return hmac.compare_digest(value.encode(), token.encode())
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from urllib.parse import urlencode
+
+import pytest
+
+from benchmarks import fakes
+from benchmarks.harness import ENV, TOKEN, sign, wait_until_up, write_configs
+from fangorn import init
+from fangorn.async_server import _build_asgi_app
+
+BENCH_USER = 'loadtest'
+
+
+@pytest.fixture
+def upstream():
+    with fakes.FakeUpstream() as upstream:
+        yield upstream
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, upstream):
+    config_dir = str(tmp_path / 'config')
+    os.makedirs(config_dir)
+    write_configs(config_dir, str(tmp_path), {
+        'google': {'directions': {'url_base': upstream.url}},
+        'slack': {
+            'delivery': {'url': upstream.url + '/api/chat.postMessage'},
+            'dedup': {'in_flight_wait': 2},
+            'outgoing_webhook': {'matchers': {BENCH_USER: {
+                'text_contains': ['ssd'], 'unmatch': [], 'output_channel': '#general'}}}
+        }
+    })
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    init.load_configs(ENV, config_dir)
+    return _build_asgi_app()
+
+
+async def _request(app, method, path, body=b'', headers=()):
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'root_path': '',
+        'headers': [(name.encode(), value.encode()) for name, value in headers],
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 1234), 'http_version': '1.1', 'scheme': 'http'
+    }
+    await app(scope, receive, send)
+    return messages[0]['status'], messages[1]['body']
+
+
+def _webhook():
+    return urlencode({
+        'token': TOKEN, 'team_id': 'T1', 'channel_id': 'C1', 'user_name': BENCH_USER,
+        'timestamp': '1500000000.000001', 'text': 'selling an ssd'
+    }).encode()
+
+
+def test_duplicate_deliveries_do_not_block_the_loop(app):
+    # falcon dispatches through the method map it built when the route was added
+    method_map = app._app._router.find('/api/messagerouter')[1]
+    on_post = method_map['POST']
+
+    def slow_on_post(req, resp, **kwargs):
+        time.sleep(0.5)
+        on_post(req, resp, **kwargs)
+
+    method_map['POST'] = slow_on_post
+    headers = [('Content-Type', 'application/x-www-form-urlencoded')]
+
+    async def scenario():
+        gaps, done = [], asyncio.Event()
+
+        async def heartbeat():
+            last = time.monotonic()
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+                gaps.append(time.monotonic() - last)
+                last = time.monotonic()
+
+        ticking = asyncio.ensure_future(heartbeat())
+        first = asyncio.ensure_future(_request(app, 'POST', '/api/messagerouter', _webhook(), headers))
+        await asyncio.sleep(0.05)
+        duplicate = await _request(app, 'POST', '/api/messagerouter', _webhook(), headers)
+        first = await first
+        done.set()
+        await ticking
+        return max(gaps), first, duplicate
+
+    longest_gap, first, duplicate = asyncio.new_event_loop().run_until_complete(scenario())
+    # the loop kept running while the first delivery was handled and the duplicate waited on it
+    assert longest_gap < 0.2
+    assert first[0] == 200
+    assert duplicate == first
+
+
+@pytest.fixture
+def served(tmp_path, upstream):
+    """The app under uvicorn in its own process, the way the benchmarks serve it."""
+    config_dir = str(tmp_path / 'config')
+    os.makedirs(config_dir)
+    write_configs(config_dir, str(tmp_path), {
+        'slack': {'delivery': {'url': upstream.url + '/api/chat.postMessage'}},
+        'google': {
+            'directions': {'url_base': upstream.url},
+            'static_map': {'url_base': upstream.url + '/maps/api/staticmap'}
+        }
+    })
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    server = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.harness', '--mode', 'asgi', '--port', str(port), '--config-dir', config_dir
+    ], env=dict(os.environ, XDG_CACHE_HOME=str(tmp_path / 'cache')))
+    try:
+        wait_until_up(port)
+        yield 'http://127.0.0.1:{}'.format(port)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def test_served_by_uvicorn(served, upstream):
+    upstream.reset()
+
+    with urllib.request.urlopen(served + '/healthcheck', timeout=5) as response:
+        assert response.status == 200
+
+    body = urlencode({
+        'token': TOKEN, 'command': '/traffic', 'text': 'from: 1 Main St to: 2 Main St',
+        'response_url': upstream.url + '/respond/1'
+    })
+    request = urllib.request.Request(served + '/api/traffic', data=body.encode(), headers=sign(body))
+    with urllib.request.urlopen(request, timeout=5) as response:
+        assert response.status == 200
+        assert b'Working on traffic' in response.read()
+
+    # the lookup runs on a thread and its answer is posted to the response_url through aiohttp
+    deadline = time.monotonic() + 10
+    while not upstream.calls['response_url'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert upstream.calls['response_url'] == 1
+    assert upstream.calls['directions'] == 1
@@ -0,0 +1,94 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import queue
+import threading
+
+import pytest
+
+from fangorn import deferred
+
+
+class _ResponseUrl(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.posts.put((self.path, json.loads(body.decode())))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def response_url():
+    server = HTTPServer(('127.0.0.1', 0), _ResponseUrl)
+    server.posts = queue.Queue()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _url(server, path):
+    return 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+
+
+def test_result_is_posted_to_response_url(response_url):
+    responder = deferred.DeferredResponder(workers=2, backlog=2)
+    try:
+        assert responder.submit(_url(response_url, '/ok'), lambda text: {'text': text}, 'done')
+        assert response_url.posts.get(timeout=5) == ('/ok', {'text': 'done'})
+    finally:
+        responder.shutdown()
+
+
+def test_failed_job_posts_error_message(response_url):
+    def fail():
+        raise RuntimeError('boom')
+
+    responder = deferred.DeferredResponder(workers=1, backlog=0)
+    try:
+        assert responder.submit(_url(response_url, '/fail'), fail)
+        assert response_url.posts.get(timeout=5) == ('/fail', deferred.ERROR_MESSAGE)
+    finally:
+        responder.shutdown()
+
+
+def test_full_backlog_is_refused(response_url):
+    release = threading.Event()
+    responder = deferred.DeferredResponder(workers=1, backlog=1)
+    try:
+        assert responder.submit(_url(response_url, '/1'), lambda: release.wait() and {'text': '1'})
+        assert responder.submit(_url(response_url, '/2'), lambda: {'text': '2'})
+        assert not responder.submit(_url(response_url, '/3'), lambda: {'text': '3'})
+
+        release.set()
+        posts = sorted(response_url.posts.get(timeout=5) for _ in range(2))
+        assert posts == [('/1', {'text': '1'}), ('/2', {'text': '2'})]
+        # finished jobs give their slots back
+        assert responder.submit(_url(response_url, '/4'), lambda: {'text': '4'})
+        assert response_url.posts.get(timeout=5) == ('/4', {'text': '4'})
+    finally:
+        release.set()
+        responder.shutdown()
+
+
+def test_slow_job_gets_timeout_message_and_its_result_is_dropped(response_url):
+    release = threading.Event()
+    responder = deferred.DeferredResponder(workers=1, backlog=0, job_timeout=0.1)
+    try:
+        assert responder.submit(_url(response_url, '/slow'), lambda: release.wait() and {'text': 'late'})
+        assert response_url.posts.get(timeout=5) == ('/slow', deferred.TIMEOUT_MESSAGE)
+
+        # the worker stays busy until the job returns
+        assert not responder.submit(_url(response_url, '/next'), lambda: {'text': 'next'})
+        release.set()
+        responder.shutdown()
+        with pytest.raises(queue.Empty):
+            response_url.posts.get(timeout=0.2)
+    finally:
+        release.set()
+        responder.shutdown()
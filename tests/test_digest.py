@@ -0,0 +1,26 @@
+import threading
+
+from fangorn.digest import ChannelDigest
+
+
+def test_flusher_survives_a_failed_post():
+    posted = []
+    done = threading.Event()
+
+    def post_message(channel, **kwargs):
+        if not posted:
+            posted.append(None)
+            raise RuntimeError('queue is broken')
+        posted.append(channel)
+        done.set()
+        return True
+
+    digest = ChannelDigest(post_message)
+    digest.add('#first', {'text': 'a'}, max_delay=0.01)
+    digest.add('#second', {'text': 'b'}, max_delay=0.2)
+
+    assert done.wait(5)
+    assert posted == [None, '#second']
+    digest.close()
+    assert digest.stats['dropped'] == 1
+    assert digest.stats['posted'] == 1
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from fangorn import geocode
+from fangorn.geocode import GeocodeCache, LocationIndex
+
+ALIASES = {
+    'home': '401 North Racine Avenue, Chicago, IL 60642',
+    'Work': '1370 Piccard Drive, Rockville, MD 20850',
+    'the office': '233 S Wacker Dr, Chicago, IL 60606'
+}
+
+
+def test_aliases_resolve_forgivingly():
+    locations = LocationIndex(ALIASES)
+    for text in ('home', ' HOME ', 'work.', 'the ofice'):
+        assert text in locations
+    assert locations['the ofice'] == ALIASES['the office']
+    assert locations.get('1 Main St') is None
+
+
+def test_short_words_are_not_taken_for_aliases():
+    locations = LocationIndex(ALIASES)
+    assert 'york' not in locations
+    assert 'hoem' not in locations
+    assert LocationIndex(ALIASES, fuzzy_cutoff=0.75)['hoem'] == ALIASES['home']
+
+
+def test_assumed_names_the_alias_a_typo_was_taken_for():
+    locations = LocationIndex(ALIASES)
+    assert locations.assumed('the ofice') == 'the office'
+    assert locations.assumed(' WORK ') is None
+    assert locations.assumed('1 Main St') is None
+
+
+def test_default_path_without_home(monkeypatch):
+    monkeypatch.delenv('XDG_CACHE_HOME', raising=False)
+    monkeypatch.delenv('HOME', raising=False)
+    assert geocode.default_geocode_path().endswith('/.cache/fangorn/geocode.json')
+
+
+def test_default_path_prefers_xdg(monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', '/xdg')
+    assert geocode.default_geocode_path() == '/xdg/fangorn/geocode.json'
+
+
+def _cache(path, max_entries=4096):
+    lookups = []
+
+    def lookup(address):
+        lookups.append(address)
+        return (41.0, -87.5) if address != 'nowhere' else None
+
+    return GeocodeCache(str(path), lookup, max_entries), lookups
+
+
+def test_each_address_is_geocoded_once(tmp_path):
+    cache, lookups = _cache(tmp_path / 'geocode.json')
+    assert cache.coordinates('1 Main St') == '41.000000,-87.500000'
+    assert cache.coordinates(' 1 main st ') == '41.000000,-87.500000'
+    assert cache.coordinates('nowhere') is None
+    assert lookups == ['1 Main St', 'nowhere']
+
+    reopened, lookups = _cache(tmp_path / 'geocode.json')
+    assert reopened.coordinates('1 MAIN ST') == '41.000000,-87.500000'
+    assert lookups == []
+
+
+def test_save_keeps_the_most_recent_entries(tmp_path):
+    path = tmp_path / 'geocode.json'
+    ours, _ = _cache(path, max_entries=3)
+    ours.coordinates('a')
+    # another process resolves b and re-resolves a after we loaded
+    path.write_text(json.dumps({'b': '1,1', 'a': '2,2'}))
+    ours.coordinates('c')
+    ours.coordinates('d')
+    # b is trimmed as the oldest, ours stay in the order we resolved them
+    assert list(json.loads(path.read_text())) == ['a', 'c', 'd']
+
+
+def test_failed_save_leaves_no_temp_file(tmp_path, monkeypatch):
+    cache, _ = _cache(tmp_path / 'geocode.json')
+
+    def fail(*args):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(geocode.os, 'replace', fail)
+    assert cache.coordinates('1 Main St') == '41.000000,-87.500000'
+    assert [p.name for p in tmp_path.iterdir()] == []
@@ -0,0 +1,152 @@
+import os
+import threading
+from urllib.parse import urlencode
+
+import falcon
+import falcon.testing
+import pytest
+
+from benchmarks.harness import SECRET, sign
+from fangorn.idempotency import DeliveryCache, IdempotencyMiddleware
+from fangorn.signing import SlackRequestMiddleware
+
+COMMAND = '/api/traffic'
+WEBHOOK = '/api/messagerouter'
+FORM = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DeliveryCache(str(tmp_path / 'dedup'), sweep_interval=3600)
+
+
+def test_first_claim_wins_until_released(cache):
+    assert not cache.known('k')
+    assert cache.claim('k') == (True, None)
+    assert cache.claim('k') == (False, None)
+    cache.release('k')
+    assert cache.known('k')
+    assert cache.wait('k', timeout=5) is None
+    assert cache.claim('k') == (True, None)
+
+
+def test_completed_response_is_replayed(cache):
+    response = {'status': '200 OK', 'body': '{}', 'content_type': 'application/json'}
+    cache.claim('k')
+    cache.complete('k', response)
+    assert cache.claim('k') == (False, response)
+    assert cache.wait('k', timeout=0) == response
+
+
+def test_wait_gives_up_on_an_unfinished_claim(cache):
+    cache.claim('k')
+    assert cache.wait('k', timeout=0.05) is None
+
+
+def test_lapsed_claim_can_be_claimed_again(tmp_path):
+    cache = DeliveryCache(str(tmp_path), pending_timeout=-1, sweep_interval=3600)
+    assert cache.claim('k') == (True, None)
+    assert cache.claim('k') == (True, None)
+
+
+def test_sweep_keeps_the_newest_entries(tmp_path):
+    cache = DeliveryCache(str(tmp_path), max_entries=2, sweep_interval=3600)
+    for n, key in enumerate('abc'):
+        cache.claim(key)
+        cache.complete(key, {'status': '200 OK', 'body': key})
+        os.utime(str(tmp_path / (key + '.json')), (n, n))
+    cache.sweep()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['b.json', 'c.json']
+
+
+class _Resource:
+    def __init__(self):
+        self.calls = 0
+        self.status = falcon.HTTP_200
+        self.entered = threading.Event()
+        self.proceed = threading.Event()
+        self.proceed.set()
+
+    def on_post(self, req, resp):
+        self.calls += 1
+        self.entered.set()
+        self.proceed.wait(5)
+        resp.status = self.status
+        resp.body = '{{"call": {}}}'.format(self.calls)
+
+
+@pytest.fixture
+def app(cache):
+    resource = _Resource()
+    signing = SlackRequestMiddleware(SECRET, paths=[COMMAND], reject_replays=False)
+    api = falcon.API(middleware=[signing, IdempotencyMiddleware(cache, paths=[COMMAND, WEBHOOK],
+                                                                in_flight_wait=0.1)])
+    api.add_route(COMMAND, resource)
+    api.add_route(WEBHOOK, resource)
+    return falcon.testing.TestClient(api), resource, cache
+
+
+def _command(trigger_id='1'):
+    body = urlencode({'text': 'from: home to: work', 'trigger_id': trigger_id})
+    # a retry repeats the signature and timestamp of the first attempt
+    return body, sign(body)
+
+
+def test_signed_retry_is_answered_from_the_first_response(app):
+    client, resource, _ = app
+    body, headers = _command()
+    first = client.simulate_post(COMMAND, body=body, headers=headers)
+    retry = client.simulate_post(COMMAND, body=body, headers=headers)
+    assert resource.calls == 1
+    assert (retry.status, retry.text) == (first.status, first.text) == (falcon.HTTP_200, '{"call": 1}')
+
+
+def test_retry_of_a_server_error_runs_again(app):
+    client, resource, _ = app
+    body, headers = _command()
+    resource.status = falcon.HTTP_500
+    assert client.simulate_post(COMMAND, body=body, headers=headers).status == falcon.HTTP_500
+    resource.status = falcon.HTTP_200
+    assert client.simulate_post(COMMAND, body=body, headers=headers).text == '{"call": 2}'
+
+
+def test_repeat_of_a_delivery_still_in_flight_is_asked_to_retry(app):
+    client, resource, _ = app
+    body, headers = _command()
+    resource.proceed.clear()
+    first = threading.Thread(target=client.simulate_post, args=(COMMAND,), kwargs={'body': body, 'headers': headers})
+    first.start()
+    assert resource.entered.wait(5)
+    try:
+        repeat = client.simulate_post(COMMAND, body=body, headers=headers)
+        assert repeat.status == falcon.HTTP_503
+    finally:
+        resource.proceed.set()
+        first.join()
+
+    # once the first finishes, the next retry gets its answer
+    retry = client.simulate_post(COMMAND, body=body, headers=headers)
+    assert (retry.status, retry.text, resource.calls) == (falcon.HTTP_200, '{"call": 1}', 1)
+
+
+def test_replay_whose_response_was_evicted_is_rejected(app):
+    client, resource, cache = app
+    body, headers = _command()
+    client.simulate_post(COMMAND, body=body, headers=headers)
+    for entry in os.scandir(cache._directory):
+        os.remove(entry.path)
+    assert client.simulate_post(COMMAND, body=body, headers=headers).status == falcon.HTTP_401
+    assert resource.calls == 1
+
+
+def test_unverified_signature_header_does_not_key_the_delivery(app):
+    client, resource, _ = app
+    forged = dict(FORM, **{'X-Slack-Signature': 'v0=forged'})
+    for text in ('first message', 'second message'):
+        body = urlencode({'team_id': 'T1', 'channel_id': 'C1', 'user_name': 'u', 'timestamp': '1.0', 'text': text})
+        assert client.simulate_post(WEBHOOK, body=body, headers=forged).status == falcon.HTTP_200
+    assert resource.calls == 2
+
+    # without a verified signature, repeats are matched on their content
+    assert client.simulate_post(WEBHOOK, body=body, headers=forged).text == '{"call": 2}'
+    assert resource.calls == 2
@@ -0,0 +1,79 @@
+import os
+
+from fangorn import image_store
+from fangorn.image_store import ImageStore
+
+
+class _Response:
+    def __init__(self, body):
+        self._body = body
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self._body), chunk_size):
+            yield self._body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+def _store(tmp_path, **kwargs):
+    return ImageStore(str(tmp_path), sweep_interval=3600, **kwargs)
+
+
+def _images(tmp_path):
+    return sorted(name for name in os.listdir(str(tmp_path)) if name != 'index.json')
+
+
+def test_identical_images_are_stored_once(tmp_path):
+    store = _store(tmp_path)
+    first, second = _Response(b'png'), _Response(b'png')
+    name = store.put(first)
+    assert store.put(second) == name
+    assert first.closed and second.closed
+    assert _images(tmp_path) == [name]
+    assert store.reuse(name)
+
+
+def test_image_swept_by_another_process_during_put_is_stored_again(tmp_path, monkeypatch):
+    store = _store(tmp_path)
+    name = store.put(_Response(b'png'))
+    real_utime = os.utime
+
+    def swept_first(path, *args):
+        # another process sweeps the image away just before we touch it
+        os.remove(path)
+        monkeypatch.setattr(image_store.os, 'utime', real_utime)
+        real_utime(path, *args)
+
+    monkeypatch.setattr(image_store.os, 'utime', swept_first)
+    assert store.put(_Response(b'png')) == name
+    assert _images(tmp_path) == [name]
+
+
+def test_files_removed_during_a_sweep_are_skipped(tmp_path, monkeypatch):
+    store = _store(tmp_path)
+    kept = store.put(_Response(b'kept'))
+    gone = store.put(_Response(b'gone'))
+    real_scandir = os.scandir
+
+    def racing_scandir(path):
+        entries = list(real_scandir(path))
+        os.remove(os.path.join(path, gone))
+        return iter(entries)
+
+    monkeypatch.setattr(image_store.os, 'scandir', racing_scandir)
+    store.sweep()
+    assert not store.reuse(gone)
+    assert store.touch(kept) and not store.touch(gone)
+
+
+def test_sweep_evicts_least_recently_used_over_budget(tmp_path):
+    store = _store(tmp_path, max_bytes=8)
+    old = store.put(_Response(b'aaaa'))
+    new = store.put(_Response(b'bbbb'))
+    newest = store.put(_Response(b'cccc'))
+    os.utime(os.path.join(str(tmp_path), old), (1, 1))
+    store._index[old]['last_access'] = 1
+    store.sweep()
+    assert _images(tmp_path) == sorted([new, newest])
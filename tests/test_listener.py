@@ -0,0 +1,147 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from benchmarks import fakes
+from fangorn import listener as listener_module
+from fangorn.listener import RtmListener
+
+SELLER_ID, SELLER = 'U0SELLER', 'seller'
+MATCHERS = {
+    SELLER: {'text_contains': ['ssd'], 'unmatch': ['pre-built'], 'output_channel': '#general'},
+    'deals': {'text_contains': ['hdd'], 'unmatch': [], 'output_channel': 'C0DEALS'},
+    'digester': {'text_contains': ['gpu'], 'unmatch': [], 'output_channel': '#general',
+                 'digest': {'max_delay': 60, 'max_batch': 2}}
+}
+
+
+def _wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out waiting')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def rtm():
+    with fakes.FakeRtm() as server:
+        server.users[SELLER_ID] = SELLER
+        yield server
+
+
+@pytest.fixture
+def upstream(rtm):
+    with fakes.FakeUpstream(rtm=rtm) as upstream:
+        yield upstream
+
+
+@pytest.fixture
+def run_listener(upstream):
+    running = []
+
+    def run(**kwargs):
+        listener = RtmListener('xoxb-token', MATCHERS, api_url=upstream.url + '/api',
+                               **dict({'backoff': 0.01}, **kwargs))
+        thread = threading.Thread(target=listener.run, daemon=True)
+        thread.start()
+        running.append((listener, thread))
+        return listener
+
+    yield run
+    for listener, thread in running:
+        listener.stop()
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+def _message(text, **event):
+    return dict({'type': 'message', 'channel': 'C0SALES', 'user': SELLER_ID, 'text': text}, **event)
+
+
+def test_matches_are_posted_to_the_matchers_channel(rtm, upstream, run_listener):
+    listener = run_listener()
+    assert rtm.wait_for_clients()
+
+    rtm.broadcast(_message('lunch anyone?'))
+    rtm.broadcast(_message('ssd, pre-built'))
+    rtm.broadcast(_message('ssd', subtype='message_changed'))
+    rtm.broadcast(_message('my own ssd', user=rtm.self_id))
+    rtm.broadcast(_message('selling an ssd\nbarely used'))
+    rtm.broadcast(_message('spare hdd', subtype='bot_message', user=None, username='deals'))
+    _wait_until(lambda: len(rtm.received) == 2)
+
+    posted = sorted((m['channel'], m['text']) for _, m in rtm.received)
+    assert posted == [
+        ('C0DEALS', '<!channel>: This looks interesting...\n>spare hdd'),
+        ('C0GENERAL', '<!channel>: This looks interesting...\n>selling an ssd\n>barely used')
+    ]
+    _wait_until(lambda: listener.stats['unacked'] == 0)
+    stats = listener.stats
+    assert (stats['events'], stats['matched'], stats['posted']) == (6, 2, 2)
+    # the author and channel were looked up once each
+    assert upstream.calls['users.info'] == 1
+    assert upstream.calls['conversations.list'] == 1
+
+
+def test_reconnects_with_growing_backoff(rtm, run_listener, monkeypatch):
+    delays = []
+    real_uniform = listener_module.random.uniform
+    monkeypatch.setattr(listener_module.random, 'uniform', lambda a, b: delays.append(b) or real_uniform(a, b))
+
+    # a port nothing listens on, so connecting fails until the real url is back
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))
+    rtm_url, rtm.url = rtm.url, 'ws://127.0.0.1:{}/'.format(closed.getsockname()[1])
+    closed.close()
+
+    listener = run_listener(max_backoff=0.04)
+    _wait_until(lambda: len(delays) >= 4)
+    rtm.url = rtm_url
+    assert rtm.wait_for_clients()
+    assert delays[:4] == [0.01, 0.02, 0.04, 0.04]
+
+    # a hello resets the backoff, and a routed message shows the hello before it was read
+    rtm.broadcast(_message('selling an ssd'))
+    _wait_until(lambda: len(rtm.received) == 1)
+    del delays[:]
+    rtm.drop()
+    # the fake counts the connection as soon as it accepts it, before the listener does
+    _wait_until(lambda: rtm.connections == 2 and listener.stats['connects'] == 2)
+    assert delays[0] == 0.01
+
+
+def test_unacknowledged_posts_are_resent_after_reconnecting(rtm, run_listener):
+    listener = run_listener()
+    assert rtm.wait_for_clients()
+
+    rtm.acknowledge = False
+    rtm.broadcast(_message('selling an ssd'))
+    _wait_until(lambda: len(rtm.received) == 1)
+    assert listener.stats['unacked'] == 1
+
+    rtm.acknowledge = True
+    rtm.drop()
+    _wait_until(lambda: len(rtm.received) == 2)
+    first, resent = (m for _, m in rtm.received)
+    assert resent['text'] == first['text']
+    _wait_until(lambda: listener.stats['unacked'] == 0)
+    assert listener.stats['resent'] == 1
+    assert listener.stats['disconnects'] == 1
+
+
+def test_digest_matchers_post_batches_and_flush_on_stop(rtm, upstream, run_listener):
+    listener = run_listener()
+    assert rtm.wait_for_clients()
+
+    for n in range(3):
+        rtm.broadcast(_message('gpu #{}'.format(n), subtype='bot_message', user=None, username='digester'))
+    _wait_until(lambda: listener.stats['digested'] == 3)
+    # the first two filled a batch, the third waits for its delay
+    _wait_until(lambda: upstream.calls['chat.postMessage'] == 1)
+    assert rtm.received == []
+
+    listener.stop()
+    _wait_until(lambda: upstream.calls['chat.postMessage'] == 2)
@@ -0,0 +1,32 @@
+from collections import namedtuple
+
+import pytest
+
+from fangorn.matching import Matcher
+
+Message = namedtuple('Message', ('text',))
+
+SPEC = {'text_contains': ['ssd', 'hdd'], 'unmatch': ['pre-built'], 'output_channel': '#general'}
+
+
+def test_reports_every_term_found():
+    assert Matcher(SPEC)(Message('Selling an SSD drive and an hdd')) == {'ssd', 'hdd'}
+
+
+def test_unmatch_wins():
+    assert Matcher(SPEC)(Message('pre-built pc with an ssd')) == frozenset()
+
+
+def test_no_include_terms_never_matches():
+    assert Matcher(dict(SPEC, text_contains=[]))(Message('ssd')) == frozenset()
+
+
+@pytest.mark.parametrize('digest', [None, {}, {'max_delay': 5}, {'max_delay': 5, 'max_batch': 10}])
+def test_accepts_digest_limits(digest):
+    assert Matcher(dict(SPEC, digest=digest)).digest == digest
+
+
+@pytest.mark.parametrize('digest', [{'max_dealy': 5}, {'max_batch': 10, 'channel': '#x'}, 30, ['max_delay']])
+def test_rejects_unknown_digest_settings(digest):
+    with pytest.raises(ValueError):
+        Matcher(dict(SPEC, digest=digest))
@@ -0,0 +1,110 @@
+import json
+import threading
+
+import falcon
+import falcon.testing
+import pytest
+
+from fangorn import records
+from fangorn.configuration import config
+
+TOKEN = 'tinnitus-token'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setitem(config, 'slack', {'tinnitus_command': {'token': TOKEN}})
+    monkeypatch.setitem(config, 'records', {'tinnitus': {
+        'path': str(tmp_path / 'tinnitus'),
+        'writer': {'max_records': 100, 'max_delay': 0.01, 'wait_for_flush': True},
+        'segments': {'fsync': False}
+    }})
+    recorder = records.TinnitusRecorder()
+    recorder._record_writer.write_record(_record(40))
+    app = falcon.API()
+    app.add_route('/api/records/tinnitus', recorder)
+    yield falcon.testing.TestClient(app)
+    recorder._record_writer.close()
+
+
+def test_query_with_bearer_token(client):
+    result = client.simulate_get('/api/records/tinnitus', headers={'Authorization': 'Bearer ' + TOKEN})
+    assert result.status == falcon.HTTP_200
+    assert [r['decibels'] for r in json.loads(result.text)['records']] == [40]
+
+
+def test_query_daily_averages(client):
+    writer = client.app._router.find('/api/records/tinnitus')[0]._record_writer
+    writer.write_record(dict(_record(60), audibility=2, recorded_time='2017-11-01T21:00:00+00:00'))
+    writer.write_record(dict(_record(90), ear='r', recorded_time='2017-11-02T08:00:00+00:00'))
+
+    result = client.simulate_get('/api/records/tinnitus', query_string='daily=true',
+                                 headers={'Authorization': 'Bearer ' + TOKEN})
+    assert result.status == falcon.HTTP_200
+    assert json.loads(result.text) == {'daily_averages': [
+        {'date': '2017-11-01', 'ear': 'l', 'count': 2, 'average_decibels': 50, 'average_audibility': 1.5},
+        {'date': '2017-11-02', 'ear': 'r', 'count': 1, 'average_decibels': 90, 'average_audibility': 1}
+    ]}
+
+
+@pytest.mark.parametrize('headers, query', [
+    ({}, None),
+    ({'Authorization': 'Bearer wrong'}, None),
+    ({'Authorization': 'Basic ' + TOKEN}, None),
+    # the query string is no longer accepted
+    ({}, 'token=' + TOKEN)
+])
+def test_query_without_valid_token_is_forbidden(client, headers, query):
+    result = client.simulate_get('/api/records/tinnitus', headers=headers, query_string=query)
+    assert result.status == falcon.HTTP_403
+
+
+class _FailingStore:
+    def __init__(self, failures=1):
+        self.failures = failures
+        self.lines = []
+
+    def append(self, lines, times):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('disk full')
+        self.lines.extend(lines)
+
+    def close(self):
+        pass
+
+
+def _record(decibels):
+    return {'ear': 'l', 'audibility': 1, 'decibels': decibels, 'recorded_time': '2017-11-01T08:00:00+00:00'}
+
+
+def test_failed_batch_is_reported_to_its_writers_and_the_flusher_carries_on():
+    store = _FailingStore()
+    writer = records.TinnitusWriter(store, max_delay=0.01)
+    errors = []
+
+    def write():
+        try:
+            writer.write_record(_record(40))
+        except OSError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+
+    # the next batch is written by the same flusher
+    writer.write_record(_record(50))
+    assert [json.loads(line)['decibels'] for line in store.lines] == [50]
+    writer.close()
+
+
+def test_failed_write_is_answered_instead_of_hanging(client, monkeypatch):
+    recorder = client.app._router.find('/api/records/tinnitus')[0]
+    monkeypatch.setattr(recorder._record_writer, '_store', _FailingStore())
+    result = client.simulate_post('/api/records/tinnitus', params={
+        'command': '/tinnitus', 'token': TOKEN, 'text': 'l140', 'response_url': 'https://hooks.slack.com/x'})
+    assert result.status == falcon.HTTP_200
+    assert json.loads(result.text)['text'] == 'could not write the record, please try again'
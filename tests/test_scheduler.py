@@ -0,0 +1,54 @@
+import datetime
+import threading
+
+from fangorn.scheduler import Job, TrafficScheduler
+
+JOB = Job(name='commute', times=[datetime.time(8, 0)], days=frozenset(range(7)),
+          origin='home', destinations=['work'], channel='#general')
+
+
+class _Mapper:
+    def traffic_message(self, origin, destinations):
+        return {'text': 'traffic from {} to {}'.format(origin, ', '.join(destinations))}
+
+
+class _Slack:
+    def __init__(self):
+        self.posts = []
+
+    def api_call(self, method, **kwargs):
+        self.posts.append(kwargs['channel'])
+
+
+def _run(state_path, at):
+    slack = _Slack()
+    scheduler = TrafficScheduler([JOB], _Mapper(), slack, state_path=str(state_path))
+    timer = threading.Timer(0.3, scheduler.stop)
+    timer.start()
+    scheduler.run(now=lambda: at)
+    timer.join()
+    return slack.posts
+
+
+def test_a_restart_does_not_repeat_a_run(tmp_path):
+    state_path = tmp_path / 'state' / 'scheduler.json'
+    assert _run(state_path, datetime.datetime(2019, 5, 6, 8, 5)) == ['#general']
+    assert _run(state_path, datetime.datetime(2019, 5, 6, 8, 6)) == []
+    # the next day's run is still caught up on
+    assert _run(state_path, datetime.datetime(2019, 5, 7, 8, 5)) == ['#general']
+
+
+def test_a_failed_run_is_caught_up_after_a_restart(tmp_path):
+    state_path = tmp_path / 'scheduler.json'
+
+    class _FailingSlack(_Slack):
+        def api_call(self, method, **kwargs):
+            raise OSError('slack is down')
+
+    scheduler = TrafficScheduler([JOB], _Mapper(), _FailingSlack(), state_path=str(state_path))
+    timer = threading.Timer(0.3, scheduler.stop)
+    timer.start()
+    scheduler.run(now=lambda: datetime.datetime(2019, 5, 6, 8, 5))
+    timer.join()
+
+    assert _run(state_path, datetime.datetime(2019, 5, 6, 8, 6)) == ['#general']
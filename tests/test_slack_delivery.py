@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from benchmarks import fakes
+from fangorn.slack_delivery import SlackDeliveryQueue
+
+
+@pytest.fixture
+def upstream():
+    with fakes.FakeUpstream() as upstream:
+        yield upstream
+
+
+def _queue(upstream, slack_latency, **kwargs):
+    upstream.slack_latency = slack_latency
+    return SlackDeliveryQueue('xoxb-token', url=upstream.url + '/api/chat.postMessage', backoff=0.01, **kwargs)
+
+
+def test_close_delivers_everything_queued(upstream):
+    delivery = _queue(upstream, 0.01, queue_depth=10, workers=2)
+    for n in range(6):
+        assert delivery.post_message(channel='#general', text=str(n))
+    delivery.close(timeout=5)
+    assert delivery.stats['delivered'] == 6
+    assert upstream.calls['chat.postMessage'] == 6
+
+
+def test_messages_after_close_are_refused(upstream):
+    delivery = _queue(upstream, 0)
+    delivery.close(timeout=5)
+    assert not delivery.post_message(channel='#general', text='late')
+    assert delivery.stats['dropped'] == 1
+
+
+def test_close_gives_up_on_a_full_queue_after_its_timeout(upstream):
+    delivery = _queue(upstream, 1.0, queue_depth=1, workers=1)
+    assert delivery.post_message(channel='#general', text='in flight')
+    deadline = time.monotonic() + 5
+    while delivery.stats['depth'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # the worker is busy with the first message, so the second fills the queue
+    assert delivery.post_message(channel='#general', text='queued')
+
+    start = time.monotonic()
+    delivery.close(timeout=0.2)
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,127 @@
+import itertools
+
+import pytest
+
+from fangorn import records, traffic
+from fangorn.geocode import LocationIndex
+from fangorn.message_router import WebhookDataSchema, WebhookDataValidator
+
+TOKEN = 'xoxb-token'
+USER_NAMES = {'logan', 'deals'}
+ALIASES = {'home': '401 North Racine Avenue, Chicago, IL 60642', 'work': '1370 Piccard Drive, Rockville, MD 20850'}
+RESPONSE_URL = 'https://hooks.slack.com/commands/T0001/1234/abcd'
+
+
+def _combinations(fields):
+    """Every mix of present, absent and each candidate value for the fields."""
+    names = list(fields)
+    for values in itertools.product(*(fields[n] + (None,) for n in names)):
+        yield {n: v for n, v in zip(names, values) if v is not None}
+
+
+def _assert_same(schema, validator, params):
+    expected = schema.load(dict(params))
+    data, errors = validator.load(dict(params))
+    assert data == expected.data
+    assert errors == expected.errors
+
+
+WEBHOOK = {'token': TOKEN, 'text': 'selling an ssd', 'user_name': 'logan'}
+
+
+@pytest.mark.parametrize('params', [
+    WEBHOOK,
+    dict(WEBHOOK, user_name='slackbot', bot_name='deals'),
+    dict(WEBHOOK, bot_name='other'),
+    dict(WEBHOOK, token='wrong'),
+    dict(WEBHOOK, token=''),
+    dict(WEBHOOK, text=5),
+    dict(WEBHOOK, text=b'selling an ssd'),
+    {'text': 'selling an ssd'},
+    {}
+], ids=repr)
+def test_webhook_parity(params):
+    _assert_same(WebhookDataSchema(TOKEN, USER_NAMES), WebhookDataValidator(TOKEN, USER_NAMES), params)
+
+
+def test_webhook_bot_name_replaces_user_name():
+    data, errors = WebhookDataValidator(TOKEN, USER_NAMES).load(dict(WEBHOOK, user_name='slackbot', bot_name='deals'))
+    assert not errors
+    assert data.user_name == 'deals'
+
+
+def test_webhook_parity_exhaustive():
+    schema, validator = WebhookDataSchema(TOKEN, USER_NAMES), WebhookDataValidator(TOKEN, USER_NAMES)
+    for params in _combinations({
+        'token': (TOKEN, 'wrong', ''),
+        'text': ('selling an ssd', ''),
+        'user_name': ('logan', 'stranger'),
+        'bot_name': ('deals', 'other')
+    }):
+        _assert_same(schema, validator, params)
+
+
+TRAFFIC = {'command': '/traffic', 'token': TOKEN, 'text': 'from: home to: work', 'response_url': RESPONSE_URL}
+
+
+@pytest.mark.parametrize('params', [
+    TRAFFIC,
+    dict(TRAFFIC, text='to: Work; 1 Main St from: HOME'),
+    dict(TRAFFIC, text='from: home'),
+    dict(TRAFFIC, text='from: to: work'),
+    dict(TRAFFIC, text='from: home to: ;'),
+    dict(TRAFFIC, text='from: home to: ; ;'),
+    dict(TRAFFIC, text=''),
+    dict(TRAFFIC, token='wrong'),
+    dict(TRAFFIC, response_url='not a url'),
+    {'command': '/traffic', 'token': TOKEN},
+    {}
+], ids=repr)
+def test_traffic_parity(params):
+    _assert_same(traffic.SlashCommandDataSchema(TOKEN, LocationIndex(ALIASES)),
+                 traffic.SlashCommandDataValidator(TOKEN, LocationIndex(ALIASES)), params)
+
+
+def test_traffic_rejects_text_without_destinations():
+    validator = traffic.SlashCommandDataValidator(TOKEN, LocationIndex(ALIASES))
+    _, errors = validator.load(dict(TRAFFIC, text='from: home to: ;'))
+    assert errors == {'text': ['"from: home to: ;" is an invalid command']}
+
+
+def test_traffic_names_the_aliases_it_assumed():
+    validator = traffic.SlashCommandDataValidator(TOKEN, LocationIndex(ALIASES, fuzzy_cutoff=0.75))
+    data, errors = validator.load(dict(TRAFFIC, text='from: hoem to: work; 1 Main St'))
+    assert not errors
+    assert data.text['from'] == ALIASES['home']
+    assert data.text['assumed'] == [('hoem', 'home')]
+    assert traffic._assumed_note(data.text['assumed']) == ' (taking "hoem" to mean "home")'
+
+
+def test_traffic_parity_exhaustive():
+    schema = traffic.SlashCommandDataSchema(TOKEN, LocationIndex(ALIASES))
+    validator = traffic.SlashCommandDataValidator(TOKEN, LocationIndex(ALIASES))
+    for params in _combinations({
+        'command': ('/traffic',),
+        'token': (TOKEN, 'wrong'),
+        'text': ('from: home to: work', 'to: work from: 1 Main St', 'from: home', 'from: to: work', ''),
+        'response_url': (RESPONSE_URL, 'ftp://a.b/', '')
+    }):
+        _assert_same(schema, validator, params)
+
+
+TINNITUS = {'command': '/tinnitus', 'token': TOKEN, 'text': 'l140', 'response_url': RESPONSE_URL}
+
+
+@pytest.mark.parametrize('params', [
+    TINNITUS,
+    dict(TINNITUS, text=' R2200 '),
+    dict(TINNITUS, text='x9abc'),
+    dict(TINNITUS, text='l1'),
+    dict(TINNITUS, text='l1201'),
+    dict(TINNITUS, token='wrong'),
+    dict(TINNITUS, response_url='http://localhost:8080/x'),
+    {'token': TOKEN, 'text': 'l140'},
+    {}
+], ids=repr)
+def test_tinnitus_parity(params):
+    _assert_same(records.SlashCommandDataSchema(TOKEN), records.SlashCommandDataValidator(TOKEN), params)